@@ -25,6 +25,8 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+from bisect import bisect_right
+
 class Unishox:
     """
     This is a highly modified and optimized version of Unishox
@@ -104,115 +106,158 @@ class Unishox:
 
     NICE_LEN = 5
 
-    mask = [0x80, 0xC0, 0xE0, 0xF0, 0xF8, 0xFC, 0xFE, 0xFF]
+    count_codes = [0x82, 0xC3, 0xE5, 0xED, 0xF5]    # pylint: disable=bad-whitespace
+    bit_len     = [   5,    7,    9,   12,   16]    # pylint: disable=bad-whitespace
 
     # pylint: disable=missing-function-docstring,invalid-name
 
-    # Input
-    # out = bytearray
-    def append_bits(self, out, ol, code, clen, state):
-        #print("Append bits {ol} {code} {clen} {state}".format(ol=ol, code=code, clen=clen, state=state))
+    def __init__(self, optimal=False, sets=None, cl_95=None):
+        self.optimal = optimal      # use compressOptimal()
+        if sets is not None:        # tables of unishox_train.py
+            self.sets = sets
+            self.cl_95 = cl_95
+        # codes of the printable chars 32..126 in each state, see bits()
+        self.literals = [None] + [[self.literalBits(c, state) for c in range(95)] for state in (self.SHX_STATE_1, self.SHX_STATE_2)]
+        # decoding tables of us_vcode and us_hcode, see prefixTable()
+        self.us_vtable = self.prefixTable(self.us_vcode)
+        self.us_htable = self.prefixTable(self.us_hcode)
+        # first value encoded by each count code, see encodeCount()
+        self.count_base = [sum(1 << b for b in self.bit_len[:i]) for i in range(len(self.bit_len))]
+        # (code length, number of bits, first value) of the counts, by their first 5 bits, see readCount()
+        self.count_table = []
+        for (idx, clen) in self.us_htable:
+            if idx >= 1:
+                idx -= 1
+            self.count_table.append((clen + self.bit_len[idx], self.bit_len[idx], self.count_base[idx]) if idx < 5 else (clen, 0, 0))
+        # number of bits sent by encodeCount() for the counts used by compressOptimal()
+        self.count_bits = [(self.count_codes[i] & 0x07) + self.bit_len[i] for i in range(len(self.bit_len) - 1) for n in range(1 << self.bit_len[i])]
+        # decoding tables of the symbols, see symbolTables(), built by the first decompress()
+        self.symbols = None
+        self.ops = None
+
+    #################################################################################
+    # Encoding
+    #################################################################################
+
+    # Returns the code as (value, bit count) with the value right-aligned,
+    # or None if nothing is sent in this state
+    def bits(self, code, clen, state):
         if state == self.SHX_STATE_2:
             # remove change state prefix
             if (code >> 9) == 0x1C:
                 code <<= 7
                 clen -= 7
-        while clen > 0:
-            cur_bit = ol % 8
-            blen = 8 if (clen > 8) else clen
-            a_byte = (code >> 8) & self.mask[blen - 1]
-            #print("append_bits a_byte {ab} blen {blen}".format(ab=a_byte,blen=blen))
-            a_byte >>= cur_bit
-            if blen + cur_bit > 8:
-                blen = (8 - cur_bit)
-            if cur_bit == 0:
-                out[ol // 8] = a_byte
-            else:
-                out[ol // 8] |= a_byte
-            code <<= blen
-            ol += blen
-            if 0 == ol % 8:     # pylint: disable=misplaced-comparison-constant
-                # we completed a full byte
-                last_c = out[(ol // 8) - 1]
-                if last_c in (0, self.ESCAPE_MARKER):
-                    out[ol // 8] = 1 + last_c           # increment to 0x01 or 0x2B
-                    out[(ol // 8) -1] = self.ESCAPE_MARKER   # replace old value with marker
-                    ol += 8   # add one full byte
-            clen -= blen
-        return ol
-
-    codes   = [0x82, 0xC3, 0xE5, 0xED, 0xF5]    # pylint: disable=bad-whitespace
-    bit_len = [   5,    7,    9,   12,   16]    # pylint: disable=bad-whitespace
+        if clen <= 0:
+            return None
+        return ((code & 0xFFFF) >> (16 - clen), clen)
+
+    def literalBits(self, c, state):
+        cl = self.cl_95[c]
+        cl_code = cl & 0xFFF0
+        cl_len = cl & 0x000F
+        if cl_len == 13:
+            cl_code = cl_code >> 1
+        return self.bits(cl_code, cl_len, state)
+
+    # Packs (value, bit count) codes MSB first into buf with an integer accumulator.
+    # A completed byte 0x00 or ESCAPE_MARKER is replaced by the marker followed by
+    # the byte plus one. Returns the pending bits (acc, nacc), with nacc < 8
+    def packBits(self, codes, buf, acc, nacc):
+        marker = self.ESCAPE_MARKER
+        append = buf.append
+        for (value, n) in codes:
+            acc = (acc << n) | value
+            nacc += n
+            while nacc >= 8:
+                nacc -= 8
+                a_byte = acc >> nacc
+                acc &= (1 << nacc) - 1
+                if a_byte in (0, marker):
+                    append(marker)          # replace old value with marker
+                    append(a_byte + 1)      # increment to 0x01 or 0x2B
+                else:
+                    append(a_byte)
+        return acc, nacc
 
-    def encodeCount(self, out, ol, count):
-        #print("encodeCount ol = {ol}, count = {count}".format(ol=ol, count=count))
+    def encodeCount(self, codes, count):
         till = 0
-        base = 0
         for i in range(len(self.bit_len)):
             bit_len_i = self.bit_len[i]
             till += (1 << bit_len_i)
             if count < till:
-                codes_i = self.codes[i]
-                ol = self.append_bits(out, ol, (codes_i & 0xF8) << 8, codes_i & 0x07, 1)
-                #print("encodeCount append_bits ol = {ol}, code = {code}, len = {len}".format(ol=ol,code=(codes_i & 0xF8) << 8,len=codes_i & 0x07))
-                ol = self.append_bits(out, ol, (count - base) << (16 - bit_len_i), bit_len_i, 1)
-                #print("encodeCount append_bits ol = {ol}, code = {code}, len = {len}".format(ol=ol,code=(count - base) << (16 - bit_len_i),len=bit_len_i))
-                return ol
-            base = till
-        return ol
-
-    # Returns (int, ol, state, is_all_upper)
-    def matchOccurance(self, inn, len_, l_, out, ol, state, is_all_upper):
-        # int j, k;
+                codes_i = self.count_codes[i]
+                codes.append(((codes_i & 0xF8) >> (8 - (codes_i & 0x07)), codes_i & 0x07))
+                codes.append((count - self.count_base[i], bit_len_i))
+                return
+
+    # Returns a dict mapping each NICE_LEN-gram of the input to the ascending
+    # list of its positions, used by findMatch()
+    def buildIndex(self, inn, len_):
+        index = {}
+        nice_len = self.NICE_LEN
+        for j in range(len_ - nice_len + 1):
+            index.setdefault(bytes(inn[j:j + nice_len]), []).append(j)
+        return index
+
+    # Returns (longest_len, longest_dist)
+    # Only the positions sharing the NICE_LEN-gram at l_ can match. They are
+    # visited from the closest one backwards and only a strictly longer match
+    # is kept, which selects the same match as scanning the whole prefix.
+    def findMatch(self, inn, len_, l_, index):
+        nice_len = self.NICE_LEN
         longest_dist = 0
         longest_len = 0
-        #for (j = l_ - self.NICE_LEN; j >= 0; j--) {
-        j = l_ - self.NICE_LEN
-        while j >= 0:
-            k = l_
-            #for (k = l_; k < len && j + k - l_ < l_; k++) {
-            while k < len_ and j + k - l_ < l_:
-                if inn[k] != inn[j + k - l_]:
-                    break
+        positions = index.get(bytes(inn[l_:l_ + nice_len]))
+        if not positions:
+            return longest_len, longest_dist
+        max_len = min(len_, l_ + self.OPT_COUNT_MAX + nice_len - 1)
+        i = bisect_right(positions, l_ - nice_len) - 1
+        while i >= 0:
+            j = positions[i]
+            d = l_ - j
+            if d - nice_len + 1 >= self.OPT_COUNT_MAX:
+                break                           # too far for readCount() of the C decoder
+            limit = min(max_len, l_ + d)        # the match cannot overlap l_
+            k = l_ + nice_len                   # the first NICE_LEN bytes are equal
+            while k < limit and inn[k] == inn[k - d]:
                 k += 1
-            if k - l_ > self.NICE_LEN - 1:
-                match_len = k - l_ - self.NICE_LEN
-                match_dist = l_ - j - self.NICE_LEN + 1
-                if match_len > longest_len:
-                    longest_len = match_len
-                    longest_dist = match_dist
-            j -= 1
-
-        if longest_len:
-            #print("longest_len {ll}".format(ll=longest_len))
-            #ol_save = ol
-            if state == self.SHX_STATE_2 or is_all_upper:
-                is_all_upper = 0
-                state = self.SHX_STATE_1
-                ol = self.append_bits(out, ol, self.BACK2_STATE1_CODE, self.BACK2_STATE1_CODE_LEN, state)
-
-            ol = self.append_bits(out, ol, self.DICT_CODE, self.DICT_CODE_LEN, 1)
-            ol = self.encodeCount(out, ol, longest_len)
-            ol = self.encodeCount(out, ol, longest_dist)
-            #print("longest_len {ll} longest_dist {ld} ol {ols}-{ol}".format(ll=longest_len, ld=longest_dist, ol=ol, ols=ol_save))
-            l_ += longest_len + self.NICE_LEN
-            l_ -= 1
-
-            return l_, ol, state, is_all_upper
-        return -l_, ol, state, is_all_upper
-
-
-    def compress(self, inn, len_, out, len_out):
-        ol = 0
+            match_len = k - l_ - nice_len
+            if match_len > longest_len:
+                longest_len = match_len
+                longest_dist = d - nice_len + 1
+                if k == max_len:
+                    break                       # no longer match possible
+            i -= 1
+        return longest_len, longest_dist
+
+    # `dictionary` is data the decoder sees as output before the first byte,
+    # DICT codes can reference it
+    def compress(self, inn, len_, out, len_out, dictionary=b''):
+        if self.optimal:
+            return self.compressOptimal(inn, len_, out, len_out, dictionary)
+        return self.compressGreedy(inn, len_, out, len_out, dictionary)
+
+    def compressGreedy(self, inn, len_, out, len_out, dictionary=b''):
+        start = len(dictionary)
+        if dictionary:
+            inn = bytes(dictionary) + bytes(inn[:len_])
+            len_ += start
+        index = self.buildIndex(inn, len_)
+        codes = []          # (value, bit count) of the output, see packBits()
+        emit = codes.append
+        bits = self.bits
+        literals = self.literals
+        nice_len = self.NICE_LEN
+        checked = None      # number of codes when the output size was last checked
         state = self.SHX_STATE_1
         is_all_upper = 0
-        l = 0
+        l = start
         while l < len_:
         # for (l=0; l<len_; l++) {
 
             c_in = inn[l]
 
-            if l and l < len_ - 4:
+            if l > start and l < len_ - 4:
                 if c_in == inn[l - 1] and c_in == inn[l + 1] and c_in == inn[l + 2] and c_in == inn[l + 3]:
                     rpt_count = l + 4
                     while rpt_count < len_ and inn[rpt_count] == c_in:
@@ -222,287 +267,584 @@ class Unishox:
                     if state == self.SHX_STATE_2 or is_all_upper:
                         is_all_upper = 0
                         state = self.SHX_STATE_1
-                        ol = self.append_bits(out, ol, self.BACK2_STATE1_CODE, self.BACK2_STATE1_CODE_LEN, state) # back to lower case and Set1
+                        emit(bits(self.BACK2_STATE1_CODE, self.BACK2_STATE1_CODE_LEN, state))  # back to lower case and Set1
 
-                    ol = self.append_bits(out, ol, self.RPT_CODE_TASMOTA, self.RPT_CODE_TASMOTA_LEN, 1)     # reusing CRLF for RPT
-                    ol = self.encodeCount(out, ol, rpt_count - 4)
+                    emit(bits(self.RPT_CODE_TASMOTA, self.RPT_CODE_TASMOTA_LEN, 1))     # reusing CRLF for RPT
+                    self.encodeCount(codes, rpt_count - 4)
                     l += rpt_count
-                    #l -= 1
                     continue
 
-            if l < (len_ - self.NICE_LEN + 1):
-                #l_old = l
-                (l, ol, state, is_all_upper) = self.matchOccurance(inn, len_, l, out, ol, state, is_all_upper)
-                if l > 0:
-                    #print("matchOccurance l = {l} l_old = {lo}".format(l=l,lo=l_old))
-                    l += 1    # for loop
-                    continue
+            if l < (len_ - nice_len + 1):
+                (longest_len, longest_dist) = self.findMatch(inn, len_, l, index)
+                if longest_len:
+                    if state == self.SHX_STATE_2 or is_all_upper:
+                        is_all_upper = 0
+                        state = self.SHX_STATE_1
+                        emit(bits(self.BACK2_STATE1_CODE, self.BACK2_STATE1_CODE_LEN, state))
 
-                l = -l
+                    emit(bits(self.DICT_CODE, self.DICT_CODE_LEN, 1))
+                    self.encodeCount(codes, longest_len)
+                    self.encodeCount(codes, longest_dist)
+                    l += longest_len + nice_len
+                    continue
 
             if state == self.SHX_STATE_2:      # if Set2
-                if ord(' ') <= c_in <= ord('@') or ord('[') <= c_in <= ord('`') or ord('{') <= c_in <= ord('~'):
+                if 32 <= c_in <= 64 or 91 <= c_in <= 96 or 123 <= c_in <= 126:     # ' '..'@', '['..'`', '{'..'~'
                     pass
                 else:
                     state = self.SHX_STATE_1        # back to Set1 and lower case
-                    ol = self.append_bits(out, ol, self.BACK2_STATE1_CODE, self.BACK2_STATE1_CODE_LEN, state)
+                    emit(bits(self.BACK2_STATE1_CODE, self.BACK2_STATE1_CODE_LEN, state))
 
             is_upper = 0
-            if ord('A') <= c_in <= ord('Z'):
+            if 65 <= c_in <= 90:                # 'A'..'Z'
                 is_upper = 1
             else:
                 if is_all_upper:
                     is_all_upper = 0
-                    ol = self.append_bits(out, ol, self.BACK2_STATE1_CODE, self.BACK2_STATE1_CODE_LEN, state)
+                    emit(bits(self.BACK2_STATE1_CODE, self.BACK2_STATE1_CODE_LEN, state))
 
             if 32 <= c_in <= 126:
                 if is_upper and not is_all_upper:
                     ll = l+5
                     # for (ll=l+5; ll>=l && ll<len_; ll--) {
                     while l <= ll < len_:
-                        if inn[ll] < ord('A') or inn[ll] > ord('Z'):
+                        if inn[ll] < 65 or inn[ll] > 90:
                             break
 
                         ll -= 1
 
                     if ll == l-1:
-                        ol = self.append_bits(out, ol, self.ALL_UPPER_CODE, self.ALL_UPPER_CODE_LEN, state)   # CapsLock
+                        emit(bits(self.ALL_UPPER_CODE, self.ALL_UPPER_CODE_LEN, state))   # CapsLock
                         is_all_upper = 1
 
-                if state == self.SHX_STATE_1 and ord('0') <= c_in <= ord('9'):
-                    ol = self.append_bits(out, ol, self.SW2_STATE2_CODE, self.SW2_STATE2_CODE_LEN, state)   # Switch to sticky Set2
+                if state == self.SHX_STATE_1 and 48 <= c_in <= 57:     # '0'..'9'
+                    emit(bits(self.SW2_STATE2_CODE, self.SW2_STATE2_CODE_LEN, state))   # Switch to sticky Set2
                     state = self.SHX_STATE_2
 
                 c_in -= 32
                 if is_all_upper and is_upper:
                     c_in += 32
                 if c_in == 0 and state == self.SHX_STATE_2:
-                    ol = self.append_bits(out, ol, self.ST2_SPC_CODE, self.ST2_SPC_CODE_LEN, state)       # space from Set2 ionstead of Set1
+                    emit(bits(self.ST2_SPC_CODE, self.ST2_SPC_CODE_LEN, state))       # space from Set2 ionstead of Set1
                 else:
-                    # ol = self.append_bits(out, ol, pgm_read_word(&c_95[c_in]), pgm_read_byte(&l_95[c_in]), state);  // original version with c/l in split arrays
-                    cl = self.cl_95[c_in]
-                    cl_code = cl & 0xFFF0
-                    cl_len = cl & 0x000F
-                    if cl_len == 13:
-                        cl_code = cl_code >> 1
-                    ol = self.append_bits(out, ol, cl_code, cl_len, state)
+                    code = literals[state][c_in]
+                    if code:
+                        emit(code)
 
             elif c_in == 10:
-                ol = self.append_bits(out, ol, self.LF_CODE, self.LF_CODE_LEN, state)         # LF
-            elif c_in == '\t':
-                ol = self.append_bits(out, ol, self.TAB_CODE, self.TAB_CODE_LEN, state)       # TAB
+                emit(bits(self.LF_CODE, self.LF_CODE_LEN, state))         # LF
             else:
-                ol = self.append_bits(out, ol, self.BIN_CODE_TASMOTA, self.BIN_CODE_TASMOTA_LEN, state)       # Binary, we reuse the Unicode marker which 3 bits instead of 9
-                ol = self.encodeCount(out, ol, (255 - c_in) & 0xFF)
+                # TAB is sent as binary too: TAB_CODE was never emitted
+                emit(bits(self.BIN_CODE_TASMOTA, self.BIN_CODE_TASMOTA_LEN, state))       # Binary, we reuse the Unicode marker which 3 bits instead of 9
+                self.encodeCount(codes, (255 - c_in) & 0xFF)
 
+            checked = len(codes)    # the output size is checked at this point, see below
+            l += 1
 
+        buf = bytearray()
+        if checked is not None:
+            (acc, nacc) = self.packBits(codes[:checked], buf, 0, 0)
             # check that we have some headroom in the output buffer
-            if ol // 8 >= len_out - 4:
+            if (len(buf) * 8 + nacc) // 8 >= len_out - 4:
                 return -1      # we risk overflow and crash
+            (acc, nacc) = self.packBits(codes[checked:], buf, acc, nacc)
+        else:
+            (acc, nacc) = self.packBits(codes, buf, 0, 0)
+        return self.flush(buf, acc, nacc, out)
+
+    # Terminates the packed bits and copies them to out, returns the length
+    def flush(self, buf, acc, nacc, out):
+        if nacc:
+            self.packBits([self.bits(self.TERM_CODE, 8 - nacc, self.SHX_STATE_1)], buf, acc, nacc)   # 0011 0111 1100 0000 TERM = 0011 0111 11
+        if len(buf) > len(out):
+            return -1
+        out[:len(buf)] = buf
+        return len(buf)
+
+    #################################################################################
+    # Optimal parsing
+    #################################################################################
+
+    # States of the optimal parse, the encoder state with the CapsLock flag
+    OPT_SET1 = 0        # SHX_STATE_1
+    OPT_UPPER = 1       # SHX_STATE_1 with CapsLock
+    OPT_SET2 = 2        # SHX_STATE_2
+
+    # readCount() of the C decoder does not read the 16 bits count code
+    OPT_COUNT_MAX = 4768
+
+    # Earlier positions visited by findMatches() for each position
+    OPT_CHAIN = 32
+
+    # Returns the codes of the char c in each optimal parse state, or None
+    # where c cannot be sent without changing state
+    def optimalLiterals(self, c):
+        bits = self.bits
+        lf = [bits(self.LF_CODE, self.LF_CODE_LEN, 1)]
+        binary = [bits(self.BIN_CODE_TASMOTA, self.BIN_CODE_TASMOTA_LEN, 1)]
+        self.encodeCount(binary, 255 - c)
+        if 65 <= c <= 90:                   # 'A'..'Z', lower case code under CapsLock
+            return [[self.literals[1][c - 32]], [self.literals[1][c]], None]
+        if 48 <= c <= 57:                   # '0'..'9', the code of Set1 switches to Set2
+            return [None, None, [self.literals[2][c - 32]]]
+        if 32 <= c <= 126:
+            set2 = None
+            if c == 32:
+                set2 = [bits(self.ST2_SPC_CODE, self.ST2_SPC_CODE_LEN, 2)]
+            elif c <= 64 or 91 <= c <= 96 or c >= 123:
+                set2 = [self.literals[2][c - 32]]
+            return [[self.literals[1][c - 32]], None, set2]
+        if c == 10:                         # LF does not depend on the state
+            return [lf, lf, lf]
+        if c == 9:                          # TAB is an upper case space
+            return [[bits(self.TAB_CODE, self.TAB_CODE_LEN, 1)], [self.literals[1][0]], None]
+        return [binary, binary, None]
+
+    # Returns the (length, distance) of the matches at l_ that are longer
+    # than all the closer ones, among the OPT_CHAIN closest candidates,
+    # see findMatch()
+    def findMatches(self, inn, len_, l_, index):
+        nice_len = self.NICE_LEN
+        matches = []
+        positions = index.get(bytes(inn[l_:l_ + nice_len]))
+        if not positions:
+            return matches
+        longest = nice_len - 1
+        max_len = min(len_, l_ + self.OPT_COUNT_MAX + nice_len - 1)
+        i = bisect_right(positions, l_ - nice_len) - 1
+        stop = max(-1, i - self.OPT_CHAIN)
+        while i > stop:
+            j = positions[i]
+            d = l_ - j
+            if d - nice_len + 1 >= self.OPT_COUNT_MAX:
+                break
+            limit = min(max_len, l_ + d)        # the match cannot overlap l_
+            if limit - l_ <= longest:
+                i -= 1
+                continue                        # cannot be longer
+            k = l_ + nice_len
+            while k + 32 <= limit and inn[k:k + 32] == inn[k - d:k - d + 32]:
+                k += 32
+            while k < limit and inn[k] == inn[k - d]:
+                k += 1
+            if k - l_ > longest:
+                longest = k - l_
+                matches.append((longest, d))
+                if k == max_len:
+                    break
+            i -= 1
+        return matches
+
+    # Lengths tried by compressOptimal() for a RPT or DICT of lo..hi bytes
+    # sent as a count of length - base: all the lengths of the first count
+    # code, then the longest of each count code, and hi
+    def optimalLengths(self, lo, hi, base):
+        first = base + self.count_base[1]
+        lengths = list(range(lo, min(hi, first - 1) + 1))
+        for count_base in self.count_base[2:]:
+            if lo <= base + count_base - 1 < hi:
+                lengths.append(base + count_base - 1)
+        if hi >= max(lo, first):
+            lengths.append(hi)
+        return lengths
+
+    # Same output format as compress(), with a parse of minimal size: a
+    # shortest path over (position, state) where each char, RPT, DICT and
+    # state change is weighted by the length of its codes. The matches and
+    # lengths tried are bounded, see findMatches() and optimalLengths(), and
+    # escape markers are not weighted: the greedy output is returned instead
+    # when it is smaller.
+    def compressOptimal(self, inn, len_, out, len_out, dictionary=b''):
+        greedy = bytearray(len_out)
+        greedy_len = self.compressGreedy(inn, len_, greedy, len_out, dictionary)
+        OPT_SET1, OPT_UPPER, OPT_SET2 = self.OPT_SET1, self.OPT_UPPER, self.OPT_SET2
+        bits = self.bits
+        back2 = bits(self.BACK2_STATE1_CODE, self.BACK2_STATE1_CODE_LEN, 1)
+        switches = [(OPT_UPPER, OPT_SET1, back2), (OPT_SET2, OPT_SET1, back2),
+                    (OPT_SET1, OPT_SET2, bits(self.SW2_STATE2_CODE, self.SW2_STATE2_CODE_LEN, 1)),
+                    (OPT_SET1, OPT_UPPER, bits(self.ALL_UPPER_CODE, self.ALL_UPPER_CODE_LEN, 1))]
+        count_bits = self.count_bits
+        rpt_bits = self.RPT_CODE_TASMOTA_LEN
+        dict_bits = self.DICT_CODE_LEN
+        nice_len = self.NICE_LEN
+        literals = {}
+        start = len(dictionary)
+        if dictionary:
+            inn = bytes(dictionary) + bytes(inn[:len_])
+            len_ += start
+        index = self.buildIndex(inn, len_)
+        # number of bytes equal to inn[l] from l
+        runs = [1] * (len_ + 1)
+        for l in range(len_ - 2, start - 1, -1):
+            if inn[l] == inn[l + 1]:
+                runs[l] = runs[l + 1] + 1
+
+        inf = float('inf')
+        cost = [[inf] * (len_ + 1) for s in range(3)]
+        prev = [[None] * (len_ + 1) for s in range(3)]     # (position, state, codes or op)
+        cost[OPT_SET1][start] = 0
+        for l in range(start, len_ + 1):
+            for (s, t, code) in switches:
+                if cost[s][l] + code[1] < cost[t][l]:
+                    cost[t][l] = cost[s][l] + code[1]
+                    prev[t][l] = (l, s, [code])
+            if l == len_:
+                break
 
-            l += 1
-
-        bits = ol % 8
-        if bits:
-            ol = self.append_bits(out, ol, self.TERM_CODE, 8 - bits, 1)   # 0011 0111 1100 0000 TERM = 0011 0111 11
-        return (ol + 7) // 8
-        # return ol // 8 + 1 if (ol%8) else 0
-
-
-    def getBitVal(self, inn, bit_no, count):
-        c_in = inn[bit_no >> 3]
-        if bit_no >> 3 and self.ESCAPE_MARKER == inn[(bit_no >> 3) - 1]:
-            c_in -= 1
-        r = 1 << count if (c_in & (0x80 >> (bit_no % 8))) else 0
-        #print("getBitVal r={r}".format(r=r))
-        return r
+            c_in = inn[l]
+            if c_in not in literals:
+                literals[c_in] = [(codes, sum(n for (v, n) in codes)) if codes else None for codes in self.optimalLiterals(c_in)]
+            for s in range(3):
+                lit = literals[c_in][s]
+                if lit and cost[s][l] + lit[1] < cost[s][l + 1]:
+                    cost[s][l + 1] = cost[s][l] + lit[1]
+                    prev[s][l + 1] = (l, s, lit[0])
+
+            if l > start and c_in == inn[l - 1] and runs[l] >= 4:
+                rpt_max = min(runs[l], self.OPT_COUNT_MAX + 4 - 1)
+                for rpt_count in self.optimalLengths(4, rpt_max, 4):
+                    rpt_cost = rpt_bits + count_bits[rpt_count - 4]
+                    for s in range(3):
+                        if cost[s][l] + rpt_cost < cost[s][l + rpt_count]:
+                            cost[s][l + rpt_count] = cost[s][l] + rpt_cost
+                            prev[s][l + rpt_count] = (l, s, ('rpt', rpt_count))
+
+            if l < len_ - nice_len + 1:
+                shorter = nice_len - 1        # longest match at a closer distance
+                for (longest, dist) in self.findMatches(inn, len_, l, index):
+                    dist_cost = dict_bits + count_bits[dist - nice_len + 1]
+                    for match_len in self.optimalLengths(shorter + 1, longest, nice_len):
+                        match_cost = dist_cost + count_bits[match_len - nice_len]
+                        for s in (OPT_SET1, OPT_SET2):      # DICT means binary under CapsLock
+                            if cost[s][l] + match_cost < cost[s][l + match_len]:
+                                cost[s][l + match_len] = cost[s][l] + match_cost
+                                prev[s][l + match_len] = (l, s, ('dict', match_len, dist))
+                    shorter = longest
+
+        # walk back the shortest path
+        path = []
+        l = len_
+        s = min(range(3), key=lambda s: cost[s][len_])
+        while prev[s][l] is not None:
+            (l, s, op) = prev[s][l]
+            path.append(op)
+        codes = []
+        for op in reversed(path):
+            if op[0] == 'rpt':
+                codes.append(bits(self.RPT_CODE_TASMOTA, self.RPT_CODE_TASMOTA_LEN, 1))
+                self.encodeCount(codes, op[1] - 4)
+            elif op[0] == 'dict':
+                codes.append(bits(self.DICT_CODE, self.DICT_CODE_LEN, 1))
+                self.encodeCount(codes, op[1] - nice_len)
+                self.encodeCount(codes, op[2] - nice_len + 1)
+            else:
+                codes += op
+
+        buf = bytearray()
+        (acc, nacc) = self.packBits(codes, buf, 0, 0)
+        # check that we have some headroom in the output buffer
+        if codes and len(buf) >= len_out - 4:
+            return self.flush(greedy[:greedy_len], 0, 0, out) if greedy_len >= 0 else -1
+        if greedy_len >= 0 and greedy_len < len(buf) + (1 if nacc else 0):
+            return self.flush(greedy[:greedy_len], 0, 0, out)
+        return self.flush(buf, acc, nacc, out)
+
+
+    #################################################################################
+    # Decoding
+    #################################################################################
+
+    # Returns a table indexed by the next 5 bits of the stream, giving the index
+    # and the length of the code of us_vcode/us_hcode they start with, or (1, 5)
+    # if none matches
+    def prefixTable(self, code_type):
+        table = []
+        for w in range(32):
+            entry = (1, 5)
+            code = 0
+            for count in range(1, 6):
+                code += ((w >> (5 - count)) & 1) << (count - 1)    # first bit is the lowest of code
+                code_type_code = code_type[code]
+                if code_type_code and (code_type_code & 0x07) == count:
+                    entry = (code_type_code >> 3, count)
+                    break
+            table.append(entry)
+        return table
+
+    # Returns the input without escape markers, followed by 3 padding bytes
+    def unescape(self, inn, len_):
+        parts = bytes(inn[:len_]).split(bytes([self.ESCAPE_MARKER]))
+        out = bytearray(parts[0])
+        for part in parts[1:]:
+            if part:
+                out.append(part[0] - 1)     # byte following a marker was incremented
+                out += part[1:]
+        return bytes(out), len(out) << 3
+
+    # inn is the unescaped input, see unescape()
+    def getNumFromBits(self, inn, bit_no_p, count):
+        i = bit_no_p >> 3
+        w = (inn[i] << 16) | (inn[i + 1] << 8) | inn[i + 2]
+        return (w >> (24 - (bit_no_p & 7) - count)) & ((1 << count) - 1), bit_no_p + count
 
     # Returns:
     # 0..11
     # or -1 if end of stream
-    def getCodeIdx(self, code_type, inn, len_, bit_no_p):
-        code = 0
-        count = 0
-        while count < 5:
-            if bit_no_p >= len_:
-                return -1, bit_no_p
-            # detect marker
-            if self.ESCAPE_MARKER == inn[bit_no_p >> 3]:
-                bit_no_p += 8      # skip marker
-
-            if bit_no_p >= len_:
-                return -1, bit_no_p
-
-            code += self.getBitVal(inn, bit_no_p, count)
-            bit_no_p += 1
-            count += 1
-            code_type_code = code_type[code]
-            if code_type_code and (code_type_code & 0x07) == count:
-                #print("getCodeIdx = {r}".format(r=code_type_code >> 3))
-                return code_type_code >> 3, bit_no_p
-
-        #print("getCodeIdx  not found = {r}".format(r=1))
-        return 1, bit_no_p
-
-    def getNumFromBits(self, inn, bit_no_p, count):
-        ret = 0
-        while count:
-            count -= 1
-            if self.ESCAPE_MARKER == inn[bit_no_p >> 3]:
-                bit_no_p += 8      # skip marker
-            ret += self.getBitVal(inn, bit_no_p, count)
-            bit_no_p += 1
-        # print("getNumFromBits = {r}".format(r=ret))
-        return ret, bit_no_p
+    def getCodeIdx(self, code_table, inn, len_, bit_no_p):
+        if bit_no_p >= len_:
+            return -1, bit_no_p
+        i = bit_no_p >> 3
+        w = (inn[i] << 8) | inn[i + 1]
+        (idx, count) = code_table[(w >> (11 - (bit_no_p & 7))) & 0x1F]
+        if bit_no_p + count > len_:
+            return -1, len_
+        return idx, bit_no_p + count
 
     def readCount(self, inn, bit_no_p, len_):
-        (idx, bit_no_p) = self.getCodeIdx(self.us_hcode, inn, len_, bit_no_p)
+        (idx, bit_no_p) = self.getCodeIdx(self.us_htable, inn, len_, bit_no_p)
         if idx >= 1:
             idx -= 1    # we skip v = 1 (code '0') since we no more accept 2 bits encoding
         if idx >= 5 or idx < 0:
             return 0, bit_no_p  # unsupported or end of stream
-        till = 0
-        bit_len_idx = 0
-        base = 0
-        #for (uint32_t i = 0; i <= idx; i++) {
-        i = 0
-        while i <= idx:
-        # for i in range(idx):
-            base = till
-            bit_len_idx = self.bit_len[i]
-            till += (1 << bit_len_idx)
-            i += 1
-
-        (count, bit_no_p) = self.getNumFromBits(inn, bit_no_p, bit_len_idx)
-        count = count + base
-        #print("readCount getNumFromBits = {count} ({bl})".format(count=count,bl=bit_len_idx))
-
-        return count, bit_no_p
-
-    def decodeRepeat(self, inn, len_, out, ol, bit_no):
-        #print("decodeRepeat Enter")
-        (dict_len, bit_no) = self.readCount(inn, bit_no, len_)
+        (count, bit_no_p) = self.getNumFromBits(inn, bit_no_p, self.bit_len[idx])
+        return count + self.count_base[idx], bit_no_p
+
+    # Same as readCount(), reading the `stream` integer of decompress()
+    def readStreamCount(self, inn, stream, len_, bit_no):
+        if bit_no + 21 > len_:      # close to the end, see getCodeIdx()
+            return self.readCount(inn, bit_no, len_)
+        shift = len_ + self.DEC_BITS - bit_no
+        (n, nbits, base) = self.count_table[(stream >> (shift - 5)) & 0x1F]
+        return ((stream >> (shift - n)) & ((1 << nbits) - 1)) + base, bit_no + n
+
+    # Appends the DICT copy of dict_len bytes at dist to the decoded output
+    def decodeRepeat(self, out, dict_len, dist):
         dict_len += self.NICE_LEN
-        (dist, bit_no) = self.readCount(inn, bit_no, len_)
         dist += self.NICE_LEN - 1
         #memcpy(out + ol, out + ol - dist, dict_len);
-        i = 0
-        while i < dict_len:
-        #for i in range(dict_len):
-            out[ol + i] = out[ol - dist + i]
-            i += 1
-        ol += dict_len
-
-        return ol, bit_no
-
-    def decompress(self, inn, len_, out, len_out):
-        ol = 0
+        ol = len(out)
+        if dist > ol:
+            raise IndexError("repeat before the start of the output, missing dictionary?")
+        if dist >= dict_len:
+            out += out[ol - dist:ol - dist + dict_len]
+        else:
+            for i in range(dict_len):
+                out.append(out[ol - dist + i])
+
+    # Symbols returned by decodeSymbol() besides a char
+    DEC_STATE = -1      # only the state changed
+    DEC_END = -2        # end of stream or TERM
+    DEC_BIN = -3        # binary char, followed by its count
+    DEC_DICT = -4       # DICT, followed by its length and distance
+    DEC_RPT = -5        # RPT, followed by its count
+
+    # Decodes the codes of one symbol at bit_no, the counts that follow
+    # DEC_BIN, DEC_DICT and DEC_RPT are not read.
+    # Returns (char or DEC_*, bit_no, dstate, is_all_upper)
+    def decodeSymbol(self, inn, len_, bit_no, dstate, is_all_upper):
+        getCodeIdx = self.getCodeIdx
+        is_upper = is_all_upper
+        (v, bit_no) = getCodeIdx(self.us_vtable, inn, len_, bit_no)    # read vCode
+        if v < 0:
+            return self.DEC_END, bit_no, dstate, is_all_upper
+        h = dstate     # Set1 or Set2
+        if v == 0:    # Switch which is common to Set1 and Set2, first entry
+            (h, bit_no) = getCodeIdx(self.us_htable, inn, len_, bit_no)    # read hCode
+            if h < 0:
+                return self.DEC_END, bit_no, dstate, is_all_upper
+            if h == self.SHX_SET1:          # target is Set1
+                if dstate == self.SHX_SET1:   # Switch from Set1 to Set1 us UpperCase
+                    if is_all_upper:      # if CapsLock, then back to LowerCase
+                        return self.DEC_STATE, bit_no, dstate, 0
+
+                    (v, bit_no) = getCodeIdx(self.us_vtable, inn, len_, bit_no)   # read again vCode
+                    if v < 0:
+                        return self.DEC_END, bit_no, dstate, is_all_upper
+                    if v == 0:
+                        (h, bit_no) = getCodeIdx(self.us_htable, inn, len_, bit_no)  # read second hCode
+                        if h < 0:
+                            return self.DEC_END, bit_no, dstate, is_all_upper
+                        if h == self.SHX_SET1:  # If double Switch Set1, the CapsLock
+                            return self.DEC_STATE, bit_no, dstate, 1
+
+                    is_upper = 1      # anyways, still uppercase
+                else:
+                    return self.DEC_STATE, bit_no, self.SHX_SET1, is_all_upper  # if Set was not Set1, switch to Set1
+
+            elif h == self.SHX_SET2:    # If Set2, switch dstate to Set2
+                return self.DEC_STATE, bit_no, self.SHX_SET2, is_all_upper
+
+            if h != self.SHX_SET1:    # all other Sets (why not else)
+                (v, bit_no) = getCodeIdx(self.us_vtable, inn, len_, bit_no)    # we changed set, now read vCode for char
+                if v < 0:
+                    return self.DEC_END, bit_no, dstate, is_all_upper
+
+        if v == 0 and h == self.SHX_SET1A:
+            return (self.DEC_BIN if is_upper else self.DEC_DICT), bit_no, dstate, is_all_upper
+
+        if h == self.SHX_SET1 and v == 3:
+            # was Unicode, will do Binary instead
+            return self.DEC_BIN, bit_no, dstate, is_all_upper
+
+        c = 0
+        if h < 7 and v < 11:
+            c = ord(self.sets[h][v])
+        if 97 <= c <= 122:          # 'a'..'z'
+            if is_upper:
+                c -= 32       # go to UpperCase for letters
+        else:          # handle all other cases
+            if is_upper and dstate == self.SHX_SET1 and v == 1:
+                c = 9     # If UpperCase Space, change to TAB
+            if h == self.SHX_SET1B:
+                if 8 == v:   # was LF or RPT, now only LF   # pylint: disable=misplaced-comparison-constant
+                    c = 10
+                elif 9 == v:           # was CRLF, now RPT    # pylint: disable=misplaced-comparison-constant
+                    return self.DEC_RPT, bit_no, dstate, is_all_upper
+                elif 10 == v:         # pylint: disable=misplaced-comparison-constant
+                    return self.DEC_END, bit_no, dstate, is_all_upper     # TERM, stop decoding
+        return c, bit_no, dstate, is_all_upper
+
+    # symbolTables() of each `sets`, shared by the instances
+    decode_tables = {}
+
+    # Width in bits of the windows of symbolTables()
+    DEC_BITS = 14
+
+    # Returns two tables indexed by the decoder state in the bits above DEC_BITS
+    # (bit 1 Set2, bit 0 CapsLock) and the next DEC_BITS bits of the stream:
+    # - the symbols that decode to a char or a state change, as (chars, number
+    #   of chars, code length, next state index) for as many such symbols as
+    #   fit in the window
+    # - the DEC_BIN, DEC_DICT and DEC_RPT symbols, as (DEC_*, code length,
+    #   next state index)
+    # Both give None where decodeSymbol() must be used.
+    def symbolTables(self):
+        bits = self.DEC_BITS
+        size = 1 << bits
+        mask = size - 1
+        # first symbol of each window
+        single = [None] * (4 * size)
+        ops = [None] * (4 * size)
+        for st in range(4):
+            dstate = self.SHX_SET2 if st & 2 else self.SHX_SET1
+            w = 0
+            while w < size:
+                window = (w << (24 - bits)).to_bytes(3, 'big') + b'\0\0'
+                (c, n, d, u) = self.decodeSymbol(window, bits, 0, dstate, st & 1)
+                if c == self.DEC_END:       # longer than the window
+                    w += 1
+                    continue
+                # all windows starting with these n bits hold the same symbol
+                entry = (c, n, ((2 if d == self.SHX_SET2 else 0) + u) << bits)
+                if c >= self.DEC_STATE:
+                    single[st * size + w:st * size + w + (1 << (bits - n))] = [entry] * (1 << (bits - n))
+                else:
+                    ops[st * size + w:st * size + w + (1 << (bits - n))] = [entry] * (1 << (bits - n))
+                w += 1 << (bits - n)
+        # followed by the next symbols, as long as they fit, binary chars included
+        table = [None] * (4 * size)
+        for i in range(4 * size):
+            w = i & mask
+            st = i - w
+            chars = bytearray()
+            pos = 0
+            while True:
+                entry = single[st | ((w << pos) & mask)]
+                if entry is None:
+                    entry = ops[st | ((w << pos) & mask)]
+                    if entry is None or entry[0] != self.DEC_BIN or pos + entry[1] + 5 > bits:
+                        break
+                    # the count, see readCount()
+                    (c, n, st_next) = entry
+                    (count_len, nbits, base) = self.count_table[((w << (pos + n)) & mask) >> (bits - 5)]
+                    if pos + n + count_len > bits:
+                        break
+                    c = 255 - base - ((((w << (pos + n)) & mask) >> (bits - count_len)) & ((1 << nbits) - 1))
+                    if c < 0:
+                        break
+                    entry = (c, n + count_len, st_next)
+                (c, n, st_next) = entry
+                if pos + n > bits:
+                    break
+                if c >= 0:
+                    chars.append(c)
+                pos += n
+                st = st_next
+            if pos:
+                table[i] = (bytes(chars), len(chars), pos, st)
+        return table, ops
+
+    # `dictionary` must be the one given to compress()
+    def decompress(self, inn, len_, out, len_out, dictionary=b''):
+        start = len(dictionary)
+        res = bytearray(dictionary)     # decoded output, DICT codes can reference the dictionary
+        len_out += start
         bit_no = 0
-        dstate = self.SHX_SET1
-        is_all_upper = 0
-
-        len_ <<= 3    # *8, len_ in bits
-        out[ol] = 0
+        st = 0              # state index of symbolTables(), Set1 without CapsLock
+
+        (inn, len_) = self.unescape(inn, len_)      # len_ in bits
+        inn += b'\0\0\0'
+        if self.symbols is None:
+            key = tuple(map(tuple, self.sets))
+            if key not in self.decode_tables:
+                self.decode_tables[key] = self.symbolTables()
+            (self.symbols, self.ops) = self.decode_tables[key]
+        table = self.symbols
+        ops = self.ops
+        bits = self.DEC_BITS
+        mask = (1 << bits) - 1
+        fast_end = len_ - bits      # a whole window is left
+        stream = int.from_bytes(inn, 'big') >> (len(inn) * 8 - len_ - bits)     # ends with `bits` zeros
+        if not dictionary:
+            out[0] = 0
         while bit_no < len_:
-            c = 0
-            is_upper = is_all_upper
-            (v, bit_no) = self.getCodeIdx(self.us_vcode, inn, len_, bit_no)    # read vCode
-            #print("bit_no {b}. v = {v}".format(b=bit_no,v=v))
-            if v < 0:
+            ol = len(res)
+            while bit_no <= fast_end:
+                entry = table[st | (stream >> (len_ - bit_no)) & mask]
+                # near the end of the output, go symbol by symbol for the overflow check
+                if entry is None or ol + entry[1] >= len_out:
+                    break
+                (chars, m, n, st) = entry
+                res += chars
+                ol += m
+                bit_no += n
+            if bit_no >= len_:
+                break
+
+            op = ops[st | (stream >> (len_ - bit_no)) & mask] if bit_no <= fast_end else None
+            if op is not None:
+                (c, n, st) = op
+                bit_no += n
+            else:
+                (c, bit_no, dstate, is_all_upper) = self.decodeSymbol(inn, len_, bit_no,
+                                                                      self.SHX_SET2 if st & (2 << bits) else self.SHX_SET1, (st >> bits) & 1)
+                st = ((2 if dstate == self.SHX_SET2 else 0) + is_all_upper) << bits
+            if c == self.DEC_END:
                 break     # end of stream
-            h = dstate     # Set1 or Set2
-            if v == 0:    # Switch which is common to Set1 and Set2, first entry
-                (h, bit_no) = self.getCodeIdx(self.us_hcode, inn, len_, bit_no)    # read hCode
-                #print("bit_no {b}. h = {h}".format(b=bit_no,h=h))
-                if h < 0:
-                    break     # end of stream
-                if h == self.SHX_SET1:          # target is Set1
-                    if dstate == self.SHX_SET1:   # Switch from Set1 to Set1 us UpperCase
-                        if is_all_upper:      # if CapsLock, then back to LowerCase
-                            is_upper = 0
-                            is_all_upper = 0
-                            continue
-
-                        (v, bit_no) = self.getCodeIdx(self.us_vcode, inn, len_, bit_no)   # read again vCode
-                        if v < 0:
-                            break     # end of stream
-                        if v == 0:
-                            (h, bit_no) = self.getCodeIdx(self.us_hcode, inn, len_, bit_no)  # read second hCode
-                            if h < 0:
-                                break      # end of stream
-                            if h == self.SHX_SET1:  # If double Switch Set1, the CapsLock
-                                is_all_upper = 1
-                                continue
-
-                        is_upper = 1      # anyways, still uppercase
-                    else:
-                        dstate = self.SHX_SET1  # if Set was not Set1, switch to Set1
-                        continue
-
-                elif h == self.SHX_SET2:    # If Set2, switch dstate to Set2
-                    if dstate == self.SHX_SET1:
-                        dstate = self.SHX_SET2
-                    continue
-
-                if h != self.SHX_SET1:    # all other Sets (why not else)
-                    (v, bit_no) = self.getCodeIdx(self.us_vcode, inn, len_, bit_no)    # we changed set, now read vCode for char
-                    if v < 0:
-                        break      # end of stream
-
-            if v == 0 and h == self.SHX_SET1A:
-                #print("v = 0, h = self.SHX_SET1A")
-                if is_upper:
-                    (temp, bit_no) = self.readCount(inn, bit_no, len_)
-                    out[ol] = 255 - temp    # binary
-                    ol += 1
-                else:
-                    (ol, bit_no) = self.decodeRepeat(inn, len_, out, ol, bit_no)   # dist
-                continue
-
-            if h == self.SHX_SET1 and v == 3:
-                # was Unicode, will do Binary instead
-                (temp, bit_no) = self.readCount(inn, bit_no, len_)
-                out[ol] = 255 - temp    # binary
-                ol += 1
-                continue
-
-            if h < 7 and v < 11:
-                #print("h {h} v {v}".format(h=h,v=v))
-                c = ord(self.sets[h][v])
-            if ord('a') <= c <= ord('z'):
-                if is_upper:
-                    c -= 32       # go to UpperCase for letters
-            else:          # handle all other cases
-                if is_upper and dstate == self.SHX_SET1 and v == 1:
-                    c = ord('\t')     # If UpperCase Space, change to TAB
-                if h == self.SHX_SET1B:
-                    if 8 == v:   # was LF or RPT, now only LF   # pylint: disable=misplaced-comparison-constant
-                        out[ol] = ord('\n')
-                        ol += 1
-                        continue
-
-                    if 9 == v:           # was CRLF, now RPT    # pylint: disable=misplaced-comparison-constant
-                        (count, bit_no) = self.readCount(inn, bit_no, len_)
-                        count += 4
-                        if ol + count >= len_out:
-                            return -1        # overflow
-
-                        rpt_c = out[ol - 1]
-                        while count:
-                            count -= 1
-                            out[ol] = rpt_c
-                            ol += 1
-                        continue
-
-                    if 10 == v:         # pylint: disable=misplaced-comparison-constant
-                        break           # TERM, stop decoding
-
-            out[ol] = c
-            ol += 1
-
-            if ol >= len_out:
-                return -1         # overflow
-
+            if c == self.DEC_BIN:
+                (temp, bit_no) = self.readStreamCount(inn, stream, len_, bit_no)
+                res.append(255 - temp)      # binary
+            elif c == self.DEC_DICT:
+                (dict_len, bit_no) = self.readStreamCount(inn, stream, len_, bit_no)
+                (dist, bit_no) = self.readStreamCount(inn, stream, len_, bit_no)
+                if ol + dict_len + self.NICE_LEN >= len_out:
+                    return -1        # overflow
+                self.decodeRepeat(res, dict_len, dist)
+            elif c == self.DEC_RPT:
+                (count, bit_no) = self.readStreamCount(inn, stream, len_, bit_no)
+                count += 4
+                if ol + count >= len_out:
+                    return -1        # overflow
+                res += res[-1:] * count
+            elif c >= 0:
+                res.append(c)
+                if ol + 1 >= len_out and c != 10:
+                    return -1         # overflow
+
+        ol = len(res) - start
+        if ol > len(out):
+            return -1         # overflow
+        out[:ol] = res[start:]
         return ol
 
     # pylint: enable=missing-function-docstring
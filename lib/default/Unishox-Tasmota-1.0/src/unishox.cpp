@@ -445,16 +445,27 @@ void Unishox::decodeRepeat(void) {
   uint32_t dict_len = readCount() + NICE_LEN;
   uint32_t dist = readCount() + NICE_LEN - 1;
   if (ol + dict_len <= len_out) {
-    memcpy(out + ol, out + ol - dist, dict_len);
-    ol += dict_len;
+    if (dist <= ol) {
+      memcpy(out + ol, out + ol - dist, dict_len);
+      ol += dict_len;
+    } else if (dist - ol <= dict_size) {    // starts in the shared dictionary
+      int32_t src = (int32_t)ol - (int32_t)dist;
+      while (dict_len--) {
+        out[ol++] = (src < 0) ? pgm_read_byte(&dict[dict_size + src]) : out[src];
+        src++;
+      }
+    }
   }
 }
 
-int32_t Unishox::unishox_decompress(const char *p_in, size_t p_len, char *p_out, size_t p_len_out) {
+int32_t Unishox::unishox_decompress(const char *p_in, size_t p_len, char *p_out, size_t p_len_out,
+                                    const char *p_dict, size_t p_dict_size) {
   in = p_in;
   len = p_len;
   out = p_out;
   len_out = p_len_out;
+  dict = p_dict;
+  dict_size = p_dict ? p_dict_size : 0;
 
   in_eof = false;
   ol = 0;
@@ -24,7 +24,10 @@ class Unishox {
 public:
   Unishox() {};
 
-  int32_t unishox_decompress(const char *in, size_t len, char *out, size_t len_out);
+  // `dict` (PROGMEM) is seen as output before the first byte, it must be
+  // the dictionary the data was compressed with
+  int32_t unishox_decompress(const char *in, size_t len, char *out, size_t len_out,
+                             const char *dict = nullptr, size_t dict_size = 0);
   int32_t unishox_compress(const char *in, size_t len, char *out, size_t len_out);
 
 private:
@@ -50,6 +53,8 @@ private:
   char *        out;
   size_t        len;
   size_t        len_out;
+  const char *  dict;     // shared dictionary, or nullptr
+  size_t        dict_size;
 
   uint8_t dstate;
   unsigned char byte_in;
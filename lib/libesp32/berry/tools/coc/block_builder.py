@@ -1,6 +1,7 @@
 import copy
 import json
 from hash_map import *
+from phase_timer import *
 
 class block:
     def __init__(self):
@@ -19,11 +20,14 @@ def depend(obj, macro):
 class block_builder:
     """Output an object"""
 
-    def __init__(self, obj, macro):
+    def __init__(self, obj, macro, layout = None, timer = None):
         self.block = block()
         self.strtab = []
         self.strtab_weak = []
         self.strtab_long = []
+        self.layout = layout        # map_layout, or None to keep the default layout
+        self.report = []            # per-map layout statistics, when `layout` is set
+        self.timer = timer          # phase_timer, `layout` accounts for hash maps
 
         self.block.name = obj.name
         if depend(obj, macro):
@@ -47,56 +51,66 @@ class block_builder:
                     self.block.data_ordered.append(key)
     
     def block_tostring(self, block):
-        ostr = ""
+        return "".join(self.block_emit(block))
+
+    def map_tostring(self, block, name, local, literal, hmap = None):
+        return "".join(self.map_emit(block, name, local, literal, hmap))
+
+    # the emitters yield the output in chunks, joined once by `render()`
+    def block_emit(self, block):
         if block.type == "map":
-            ostr += self.map_tostring(block, block.name, False, self.get_strings_literal(block))
+            yield from self.map_emit(block, block.name, False, self.get_strings_literal(block))
         elif block.type == "class":
-            ostr += self.class_tostring(block)
+            yield from self.class_emit(block)
         elif block.type == "vartab":
-            ostr += self.vartab_tostring(block)
+            yield from self.vartab_emit(block)
         elif block.type == "module":
-            ostr += self.module_tostring(block)
-        return ostr
+            yield from self.module_emit(block)
 
-    def class_tostring(self, block):
-        ostr = ""
-        hmap = hash_map(block.data)
+    def class_emit(self, block):
+        with timed(self.timer, "layout"):
+            hmap = hash_map(block.data)
         map_name = block.name + "_map"
         if len(block.data) > 0:
-            ostr += self.map_tostring(block, map_name, True, self.get_strings_literal(block)) + "\n"
-        
-        ostr += self.scope(block) + " be_define_const_class(\n    "
-        ostr += block.name + ",\n    "
-        ostr += str(hmap.var_count()) + ",\n    "
-        ostr += self.get_super(block) + ",\n    "
-        ostr += self.name(block) + "\n);\n"
-        return ostr
-    
-    def map_tostring(self, block, name, local, literal):
-        hmap = hash_map(block.data)
-        entlist = hmap.entry_list()
-        ostr = ""
+            yield from self.map_emit(block, map_name, True, self.get_strings_literal(block), hmap)
+            yield "\n"
+
+        yield self.scope(block) + " be_define_const_class(\n    "
+        yield block.name + ",\n    "
+        yield str(hmap.var_count()) + ",\n    "
+        yield self.get_super(block) + ",\n    "
+        yield self.name(block) + "\n);\n"
+
+    def map_emit(self, block, name, local, literal, hmap = None):
+        with timed(self.timer, "layout"):
+            if hmap is None:
+                hmap = hash_map(block.data)
+            if self.layout is not None:
+                self.optimize_map(hmap, name)
+            entlist = hmap.entry_list()
 
-        ostr += "static be_define_const_map_slots(" + name + ") {\n"
+        yield "static be_define_const_map_slots(" + name + ") {\n"
+        key = "    { be_const_key_weak(" if literal else "    { be_const_key("
         for ent in entlist:
-            if literal:
-                ostr += "    { be_const_key_weak(" + ent.key + ", "
-            else:
-                ostr += "    { be_const_key(" + ent.key + ", "
-            ostr += str(ent.next) + "), " + ent.value + " },\n"
-        ostr += "};\n\n"
-
-        if local:
-            ostr += "static"
-        else:
-            ostr += self.scope(block)
-        ostr += " be_define_const_map(\n    "
-        ostr += name + ",\n    "
-        ostr += str(len(entlist)) + "\n);\n"
-        return ostr
-    
-    def vartab_tostring(self, block):
-        ostr = ""
+            yield key + ent.key + ", " + str(ent.next) + "), " + ent.value + " },\n"
+        yield "};\n\n"
+
+        yield "static" if local else self.scope(block)
+        yield " be_define_const_map(\n    "
+        yield name + ",\n    "
+        yield str(len(entlist)) + "\n);\n"
+
+    def optimize_map(self, hmap, name):
+        rank = self.layout.rank
+        (avg0, hot0, max0) = hmap.chain_stats(rank)
+        hmap.optimize(rank)
+        (avg1, hot1, max1) = hmap.chain_stats(rank)
+        line = f"{name:<48} {hmap.count:5d}  avg {avg0:.3f} -> {avg1:.3f}  max {max0} -> {max1}"
+        if hot0 is not None:
+            line += f"  hot avg {hot0:.3f} -> {hot1:.3f}"
+        self.report.append(line)
+
+    def vartab_emit(self, block):
         varvec = []
         idxblk = copy.deepcopy(block)
         index = 0
@@ -105,33 +119,32 @@ class block_builder:
             varvec.append(block.data[key])
             idxblk.data[key] = "int(" + str(index) + ")"
             index += 1
-        
-        ostr += self.map_tostring(idxblk, block.name + "_map", True, False) + "\n"
-        ostr += "static const bvalue __vlist_array[] = {\n";
+
+        yield from self.map_emit(idxblk, block.name + "_map", True, False)
+        yield "\n"
+        yield "static const bvalue __vlist_array[] = {\n"
         for it in varvec:
-            ostr += "    be_const_" + it + ",\n"
-        ostr += "};\n\n"
+            yield "    be_const_" + it + ",\n"
+        yield "};\n\n"
 
-        ostr += "static be_define_const_vector(\n    "
-        ostr += block.name + "_vector,\n    __vlist_array,\n    "
-        ostr += str(len(varvec)) + "\n);\n"
-        return ostr
-    
-    def module_tostring(self, block):
-        ostr = ""
+        yield "static be_define_const_vector(\n    "
+        yield block.name + "_vector,\n    __vlist_array,\n    "
+        yield str(len(varvec)) + "\n);\n"
+
+    def module_emit(self, block):
         name = "m_lib" + block.name
         map_name = name + "_map"
 
-        ostr += self.map_tostring(block, map_name, True, self.get_strings_literal(block)) + "\n"
-        ostr += "static be_define_const_module(\n    "
-        ostr += name + ",\n    "
-        ostr += "\"" + block.name + "\"\n);\n"
+        yield from self.map_emit(block, map_name, True, self.get_strings_literal(block))
+        yield "\n"
+        yield "static be_define_const_module(\n    "
+        yield name + ",\n    "
+        yield "\"" + block.name + "\"\n);\n"
         scp = self.scope(block)
         if scp != "static":
-            ostr += "\n" + scp
-            ostr += " be_define_const_native_module("
-            ostr += block.name + ");\n"
-        return ostr
+            yield "\n" + scp
+            yield " be_define_const_native_module("
+            yield block.name + ");\n"
 
     def scope(self, block):
         if "local" in block.attr:
@@ -158,16 +171,27 @@ class block_builder:
         else:
             return block.name
     
+    # description of the object for the flash footprint report, None if not emitted
+    def footprint(self):
+        b = self.block
+        if not b.type: return None
+        return { "name": b.name, "type": b.type, "slots": len(b.data), "local": "local" in b.attr,
+                 "weak": self.get_strings_literal(b), "strings": self.strtab + self.strtab_weak }
+
     def writefile(self, filename, text):
-        otext = "#include \"be_constobj.h\"\n\n" + text
         with open(filename, "w", encoding='utf-8') as f:
-            f.write(otext)
+            f.write(text)
 
-    def dumpfile(self, path):
-        s = self.block_tostring(self.block)
+    # return the output file name (without folder) and its content
+    def render(self):
         if "file" in self.block.attr:
             name = self.block.attr["file"]
         else:
             name = self.block.name
-        self.writefile(path + "/be_fixed_" + name + ".h", s)
-        
\ No newline at end of file
+        chunks = ["#include \"be_constobj.h\"\n\n"]
+        chunks.extend(self.block_emit(self.block))
+        return ("be_fixed_" + name + ".h", "".join(chunks))
+
+    def dumpfile(self, path):
+        (name, text) = self.render()
+        self.writefile(path + "/" + name, text)
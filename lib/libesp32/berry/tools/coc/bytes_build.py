@@ -4,10 +4,14 @@ class bytes_build:
     def __init__(self, map):
         self.map = map.copy()
 
-    def build(self, path):
-        prefix = path + "/be_const_bytes"
-        self.writefile(prefix + "_def.h", self.build_bytes_def())
-        self.writefile(prefix + ".h", self.build_bytes_ext())
+    # return the list of output file names (without folder) and their content
+    def render(self):
+        return [ ("be_const_bytes_def.h", self.build_bytes_def()), ("be_const_bytes.h", self.build_bytes_ext()) ]
+
+    def build(self, path, manifest = None):
+        writefile = manifest.writefile if manifest else self.writefile
+        for (name, text) in self.render():
+            writefile(path + "/" + name, text)
     
     def writefile(self, filename, text):
         buf = ""
@@ -21,21 +25,19 @@ class bytes_build:
                 f.write(text)
     
     def build_bytes_def(self):
-        ostr = ""
-        ostr += "/* binary arrays */\n"
-        ostr += "be_define_const_bytes_empty();\n"
-        for k in self.map:
-            ostr += "be_define_const_bytes("
-            ostr += k + ", " + ", ".join( [ "0x" + k[i:i+2] for i in range(0, len(k), 2)] )
-            ostr += ");\n"
-
-        return ostr
+        return "".join(self.emit_bytes_def())
 
     def build_bytes_ext(self):
-        ostr = ""
-        ostr += "/* extern binary arrays */\n"
-        ostr += "extern const binstance_arg3 be_const_instance_;\n"
-        for k in self.map:
-            ostr += "extern const binstance_arg3 be_const_instance_" + k + ";\n"
+        return "".join(self.emit_bytes_ext())
+
+    def emit_bytes_def(self):
+        yield "/* binary arrays */\n"
+        yield "be_define_const_bytes_empty();\n"
+        for k in sorted(self.map):
+            yield "be_define_const_bytes(" + k + ", " + ", ".join( [ "0x" + k[i:i+2] for i in range(0, len(k), 2)] ) + ");\n"
 
-        return ostr
\ No newline at end of file
+    def emit_bytes_ext(self):
+        yield "/* extern binary arrays */\n"
+        yield "extern const binstance_arg3 be_const_instance_;\n"
+        for k in sorted(self.map):
+            yield "extern const binstance_arg3 be_const_instance_" + k + ";\n"
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Benchmark of coc on the firmware sources, with the time spent per phase
+
+The input folders and configuration are read from the coc command of
+`pio-tools/gen-berry-structures.py`, so the benchmark runs on what the build runs.
+
+    python3 coc_bench.py [-r REPEAT] [--top N] [--json FILE] [--baseline FILE]
+
+With `--baseline`, the phases are compared to a previous `--json` result and the
+exit status is 1 if any of them regressed by more than `--tolerance`.
+"""
+import os
+import sys
+import ast
+import json
+import tempfile
+import importlib.util
+import importlib.machinery
+from phase_timer import *
+from coc_string import strings
+
+TOOL_DIR = os.path.dirname(os.path.abspath(__file__))
+BERRY_DIR = os.path.normpath(os.path.join(TOOL_DIR, "..", ".."))
+GEN_SCRIPT = os.path.normpath(os.path.join(BERRY_DIR, "..", "..", "..", "pio-tools", "gen-berry-structures.py"))
+
+# the `coc` script has no .py extension
+def load_coc():
+    path = os.path.join(TOOL_DIR, "coc")
+    loader = importlib.machinery.SourceFileLoader("coc", path)
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader("coc", loader))
+    loader.exec_module(module)
+    return module
+
+# value of a string constant or of `join(...)` of string constants, None otherwise
+def literal(node):
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "join":
+        parts = [ literal(a) for a in node.args ]
+        if parts and None not in parts: return os.path.join(*parts)
+    return None
+
+# input folders and configuration files of the `cmd = (...)` tuple of the pio script
+def coc_arguments(script):
+    with open(script) as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == "cmd" for t in node.targets):
+            args = [ literal(e) for e in node.value.elts ]
+            break
+    else:
+        raise ValueError(f"no coc command found in {script}")
+    inputs = []
+    config = []
+    dest = None
+    i = 0
+    while i < len(args):
+        a = args[i]
+        if a == "-o":
+            dest = None
+            i += 1                  # skip the output folder
+        elif a == "-c":
+            dest = config
+        elif a is None or a.startswith("-"):
+            dest = None
+        elif a == "generate" or a.endswith("coc"):
+            pass
+        elif dest is not None:
+            dest.append(a)
+        elif not config:
+            inputs.append(a)
+        i += 1
+    return (inputs, config)
+
+def run(coc, inputs, config, output, jobs, cache):
+    strings.clear()                 # cold registry, as in a fresh process
+    timer = phase_timer()
+    coc.builder(inputs, output, config, cache, jobs, timer = timer)
+    return timer
+
+def bench(args):
+    (inputs, config) = coc_arguments(args.gen_script)
+    coc = load_coc()
+    os.chdir(BERRY_DIR)
+    best = None
+    for i in range(args.repeat):
+        if args.o:
+            os.makedirs(args.o, exist_ok = True)
+            timer = run(coc, inputs, config, args.o, args.jobs, args.cache)
+        else:
+            with tempfile.TemporaryDirectory() as output:
+                timer = run(coc, inputs, config, output, args.jobs, args.cache)
+        if best is None or timer.total < best.total:
+            best = timer
+    result = best.todict(args.top)
+    result["files_parsed"] = len(best.files)
+    result["repeat"] = args.repeat
+    result["jobs"] = args.jobs
+    return result
+
+def tostring(result):
+    ostr = f"coc: {result['files_parsed']} files, best of {result['repeat']}, jobs={result['jobs']}\n"
+    ostr += f"    {'total':<8} {result['total'] * 1000:9.2f} ms\n"
+    for p, t in result["phases"].items():
+        ostr += f"    {p:<8} {t * 1000:9.2f} ms\n"
+    ostr += "slowest files:\n"
+    for f in result["files"]:
+        ostr += f"    {f['time'] * 1000:9.2f} ms  {f['file']}\n"
+    return ostr
+
+# compare to a baseline, return the report and the list of regressed phases
+def compare(result, baseline, tolerance, threshold = 0.001):
+    rows = [ ("total", baseline.get("total"), result["total"]) ]
+    rows += [ (p, baseline.get("phases", {}).get(p), t) for p, t in result["phases"].items() ]
+    ostr = f"    {'phase':<8} {'baseline':>9}  {'current':>9}  change\n"
+    regressed = []
+    for (p, base, cur) in rows:
+        if base is None:
+            ostr += f"    {p:<8} {'-':>9}  {cur * 1000:9.2f}\n"
+            continue
+        change = (cur - base) / base * 100 if base > 0 else 0.0
+        flag = ""
+        if cur > base * (1 + tolerance) and cur - base > threshold:
+            flag = "  REGRESSION"
+            regressed.append(p)
+        ostr += f"    {p:<8} {base * 1000:9.2f}  {cur * 1000:9.2f}  {change:+6.1f}%{flag}\n"
+    return (ostr, regressed)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='benchmark coc on the firmware sources')
+    parser.add_argument("-r", "--repeat", type=int, default=3, help='number of runs, the fastest is reported (default 3)')
+    parser.add_argument("-j", "--jobs", type=int, default=1, help='number of processes used to parse files (default 1)')
+    parser.add_argument("-o", help='output folder, a new temporary folder is used for each run by default')
+    parser.add_argument("--cache", help='parse cache file, to measure incremental runs')
+    parser.add_argument("--top", type=int, default=10, help='number of slowest files listed (default 10)')
+    parser.add_argument("--json", help='write the result to this file')
+    parser.add_argument("--baseline", help='compare to the result of a previous --json run')
+    parser.add_argument("--tolerance", type=float, default=0.10, help='relative slowdown reported as a regression (default 0.10)')
+    parser.add_argument("--gen-script", default=GEN_SCRIPT, help='pio script holding the coc command line')
+    args = parser.parse_args()
+
+    result = bench(args)
+    print(tostring(result), end="")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+            f.write("\n")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        (report, regressed) = compare(result, baseline, args.tolerance)
+        print("compared to " + args.baseline + ":")
+        print(report, end="")
+        if regressed:
+            print("regressed: " + ", ".join(regressed))
+            sys.exit(1)
@@ -0,0 +1,39 @@
+import os
+import re
+import tempfile
+import unittest
+from coc_bench import *
+
+class Test_coc_harvest(unittest.TestCase):
+
+    # number of strings and bytes of the `--harvest-report` of a variant of the build
+    def harvest(self, preprocess, defines, include_dirs = None):
+        (inputs, config) = coc_arguments(GEN_SCRIPT)
+        coc = load_coc()
+        cwd = os.getcwd()
+        os.chdir(BERRY_DIR)
+        try:
+            with tempfile.TemporaryDirectory() as output:
+                report = os.path.join(output, "harvest.txt")
+                strings.clear()
+                coc.builder(inputs, output, config, include_dirs = include_dirs, defines = defines,
+                            preprocess = preprocess, harvest_report = report)
+                with open(report) as f:
+                    r = re.search(r"strings skipped: (\d+), about (\d+) bytes", f.read())
+        finally:
+            os.chdir(cwd)
+        return (int(r[1]), int(r[2]))
+
+    def test_known(self):
+        # almost every region depends on USE_* names set by the firmware build,
+        # only `berry_conf.h` names are decided and nothing is left out
+        self.assertEqual(self.harvest("known", ["TASMOTA"]), (0, 0))
+
+    def test_strict(self):
+        tasmota = os.path.join(BERRY_DIR, "..", "..", "..", "tasmota")
+        (count, size) = self.harvest("strict", ["TASMOTA", "ESP32", "COMPILE_BERRY_LIB"], [tasmota])
+        self.assertEqual(count, 89)
+        self.assertEqual(size, 2399)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import re
-from coc_string import unescape_operator
+import bisect
+from coc_string import strings
 
 class data_value:
     def __init__(self):
@@ -14,17 +15,62 @@ class object_block:
         self.data = {}
         self.data_ordered = []
 
+class parse_result:
+    """Strings, binaries and object blocks harvested from one source file"""
+
+    # sets are stored sorted so that the order does not depend on the
+    # hash seed, whether the result was just parsed or loaded from cache
+    def __init__(self, parser):
+        self.strtab = sorted(parser.strtab)
+        self.strtab_weak = sorted(parser.strtab_weak)
+        self.strtab_long = sorted(parser.strtab_long)
+        self.bintab = sorted(parser.bintab)
+        self.strtab_inactive = sorted(parser.strtab_inactive)
+        self.objects = parser.objects
+
 class coc_parser:
     """Parser for Berry"""
 
-    def __init__(self, text):
-        """Parse text file"""
+    # tokens that trigger a sub-parser, in priority order of the alternation
+    tokens = (
+        "@const_object_info_begin",
+        "be_const_str_",
+        "be_const_bytes_instance(",
+        "be_const_key(",
+        "be_nested_str(",
+        "be_const_key_weak(",
+        "be_nested_str_weak(",
+        "be_nested_str_long(",
+        "be_str_weak(",
+    )
+    # all patterns are compiled once and matched in place at `self.pos`,
+    # the source text is never sliced while scanning
+    pat_token = re.compile("|".join(re.escape(t) for t in tokens))
+    pat_space = re.compile(r"\s+")
+    pat_word = re.compile(r"\w+")
+    pat_tocomma = re.compile(r"[^,\s]*")
+    pat_value = re.compile(r"(\S+\(.*?\))|([^,\s]*)")
+    pat_tonewline = re.compile(r"[^\r\n]*")
+    pat_comment = re.compile(r"\s+//.*?$", re.MULTILINE)
+    pat_bin = re.compile(r"[0-9A-Za-z]*")
+    pat_directive = re.compile(r"^[ \t]*#[ \t]*(if|ifdef|ifndef|elif|else|endif)\b(.*)$", re.MULTILINE)
+
+    def __init__(self, text, macro = None, strict = False):
+        """Parse text file, skipping regions disabled by `macro` if provided"""
         self.objects = []
         self.strtab = set()
         self.strtab_weak = set()
         self.strtab_long = set()
         self.bintab = set()
+        self.strtab_inactive = set()        # strings only seen in disabled regions
         self.text = text
+        self.pos = 0
+        self.comments_removed = False
+        self.macro = macro
+        self.strict = strict                # names missing from `macro` are undefined, not unknown
+        self.spans = []
+        if macro is not None:
+            self.preprocess(())
         self.parsers = {
             "@const_object_info_begin": self.parse_object,
             "be_const_str_": self.parse_string,
@@ -37,59 +83,134 @@ class coc_parser:
             "be_str_weak(": self.parse_string_weak,
         }
 
-        while len(self.text) > 0:
-            pattern = "|".join(self.parsers.keys())
-            pattern = re.sub("\\(", "\\(", pattern)
-            r = re.search(pattern, self.text)
+        while self.pos < len(self.text):
+            r = coc_parser.pat_token.search(self.text, self.pos)
             if not r: break
 
-            self.text = self.text[r.end(0):]        # keep only after pattern
-            func = self.parsers[r[0]]                # retrieve function for matched
+            self.pos = r.end(0)                     # continue after pattern
+            if self.spans and self.is_inactive(r.start(0)):
+                self.parse_inactive(r[0])
+                continue
+            func = self.parsers[r[0]]               # retrieve function for matched
             func()                                  # call function
-    
-    # def scan_const_string(self):
-    #     r = re.match(r"\w*", self.text)
-    #     if r:
-    #         self.text = self.text[r.end(0)]
-    #         self.strtab.append(r[0])
-    
-    def skip_space(self):
-        r = re.match(r"\s+", self.text)
+
+    #################################################################################
+    # Conditional regions: a region is disabled only when its condition is
+    # known to be false from the macro table, unknown names keep it enabled
+    # (unless `strict`, where they are undefined).
+    # A stack entry is (enclosing region enabled, a branch was taken, enabled)
+    #################################################################################
+    def preprocess(self, stack):
+        self.spans = []             # (start, end) of disabled regions in self.text
+        self.states = []            # (position after a directive, stack after it)
+        start = None if (not stack or stack[-1][2]) else 0
+        for r in coc_parser.pat_directive.finditer(self.text):
+            stack = self.directive(stack, r[1], r[2].split("//", 1)[0].split("/*", 1)[0])
+            self.states.append((r.end(0), stack))
+            active = not stack or stack[-1][2]
+            if not active and start is None:
+                start = r.end(0)
+            elif active and start is not None:
+                self.spans.append((start, r.start(0)))
+                start = None
+        if start is not None:
+            self.spans.append((start, len(self.text)))
+        self.span_starts = [sp[0] for sp in self.spans]
+        self.state_starts = [st[0] for st in self.states]
+
+    def directive(self, stack, d, rest):
+        if d in ("if", "ifdef", "ifndef"):
+            parent = not stack or stack[-1][2]
+            if d == "if":
+                v = self.macro.query_known(rest, self.strict)
+            else:
+                name = rest.split()
+                defined = bool(name) and name[0] in self.macro.map
+                if defined or self.strict:
+                    v = defined if d == "ifdef" else not defined
+                else:
+                    v = None
+            return stack + ((parent, v is True, parent and v is not False),)
+        if not stack: return stack          # unbalanced, ignore
+        (parent, taken, _) = stack[-1]
+        if d == "elif":
+            v = self.macro.query_known(rest, self.strict) if parent and not taken else None
+            return stack[:-1] + ((parent, taken or v is True, parent and not taken and v is not False),)
+        if d == "else":
+            return stack[:-1] + ((parent, True, parent and not taken),)
+        return stack[:-1]                   # endif
+
+    def is_inactive(self, pos):
+        i = bisect.bisect_right(self.span_starts, pos) - 1
+        return i >= 0 and pos < self.spans[i][1]
+
+    def state_at(self, pos):
+        i = bisect.bisect_right(self.state_starts, pos) - 1
+        return self.states[i][1] if i >= 0 else ()
+
+    # a token in a disabled region: only record strings, for the report
+    def parse_inactive(self, token):
+        if token == "@const_object_info_begin":
+            n = len(self.objects)
+            self.parse_object()
+            for obj in self.objects[n:]:
+                # only what `block_builder` would have kept
+                if "depend" in obj.attr and not self.macro.query(obj.attr["depend"]): continue
+                if "name" in obj.attr: self.strtab_inactive.add(obj.attr["name"])
+                for key in obj.data_ordered:
+                    depend = obj.data[key].depend
+                    if depend is None or self.macro.query(depend):
+                        self.strtab_inactive.add(key)
+            del self.objects[n:]
+            return
+        if token == "be_const_bytes_instance(": return
+        literal = self.parse_ident()
+        if literal is not None:
+            self.strtab_inactive.add(literal)
+
+    # match a compiled pattern at the current position and advance past it
+    def match(self, pat):
+        r = pat.match(self.text, self.pos)
         if r:
-            self.text = self.text[r.end(0):]
-    
+            self.pos = r.end(0)
+        return r
+
+    def peek(self):
+        if self.pos < len(self.text):
+            return self.text[self.pos]
+        return ""
+
+    def skip_space(self):
+        self.match(coc_parser.pat_space)
+
     def parse_char_base(self, c, necessary):
-        res = self.text[0] == c
-        if not res and necessary:   print(self.text); raise "error"
-        if res: self.text = self.text[1:]
+        res = self.peek() == c
+        if not res and necessary:   print(self.text[self.pos:]); raise "error"
+        if res: self.pos += 1
         return res
-    
+
     def parse_char(self, c, necessary = False):
         self.skip_space()
         return self.parse_char_base(c, necessary)
-    
+
     def skip_char(self, c):
         self.parse_char(c, True)
 
     def parse_char_continue(self, c, necessary = False):
-        ch = self.text[0]
-        while ch == ' ' or ch == "\t":  self.text = self.text[1:]
+        while self.peek() == ' ' or self.peek() == "\t":  self.pos += 1
         return self.parse_char_base(c, necessary)
 
     def parse_word(self):
         self.skip_space()
-        r = re.match(r"\w+", self.text)
+        r = self.match(coc_parser.pat_word)
         if not r: return None
-        self.text = self.text[r.end(0):]
         return r[0]
 
     # parse until the next comma or space (trim preceding spaces before)
     # does not skip the comma
     def parse_tocomma(self):
         self.skip_space()
-        r = re.match(r"[^,\s]*", self.text)
-        self.text = self.text[r.end(0):]
-        return r[0]
+        return self.match(coc_parser.pat_tocomma)[0]
 
     # parse until the next closing parenthesis or a single token if no parenthesis (trim preceding spaces before)
     # matches:
@@ -98,61 +219,63 @@ class coc_parser:
     #  'mapped_func(aa,"ee", "aa")
     def parse_value(self):
         self.skip_space()
-        r = re.match(r"(\S+\(.*?\))|([^,\s]*)", self.text)
-        self.text = self.text[r.end(0):]
-        return r[0]
+        return self.match(coc_parser.pat_value)[0]
 
     def parse_tonewline(self):
         self.skip_space()
-        r = re.match(r"[^\r\n]*", self.text)
-        self.text = self.text[r.end(0):]
-        return r[0]
+        return self.match(coc_parser.pat_tonewline)[0]
+
+    def remove_comments(self):
+        # trailing comments are removed from the rest of the file, once;
+        # stripping is idempotent so later object blocks need no new pass
+        if not self.comments_removed:
+            stack = self.state_at(self.pos) if self.macro is not None else ()
+            self.text = coc_parser.pat_comment.sub("", self.text[self.pos:])
+            self.pos = 0
+            self.comments_removed = True
+            if self.macro is not None:
+                self.preprocess(stack)      # positions changed, directives are kept
 
     def parse_object(self):
-        self.text = re.sub(r"\s+//.*?$", "", self.text, flags=re.MULTILINE)      # remove trailing comments
+        self.remove_comments()
         while True:
             obj = self.parse_block()
             self.objects.append(obj)
             if self.parse_char("@"): break
-        
+
         end_text = "const_object_info_end"
-        if not str.startswith(self.text, end_text): raise "error"
-        self.text = self.text[len(end_text):]
-        # print("END: @const_object_info_end test={self.text}")
+        if not self.text.startswith(end_text, self.pos): raise "error"
+        self.pos += len(end_text)
 
-    def parse_string(self):
-        if not self.text[0].isalnum() and self.text[0] != '_': return      # do not proceed, maybe false positive in solidify
+    def parse_ident(self):
+        c = self.peek()
+        if not c.isalnum() and c != '_': return None   # do not proceed, maybe false positive in solidify
         ident = self.parse_word()
-        if not ident: return
-        literal = unescape_operator(ident)
-        if not literal in self.strtab:
-            self.strtab.add(literal)
-            # print(f"str '{ident}' -> {literal}")
+        if not ident: return None
+        return strings.from_ident(ident)
+
+    def parse_string(self):
+        literal = self.parse_ident()
+        if literal is None: return
+        self.strtab.add(literal)
 
     def parse_string_weak(self):
-        if not self.text[0].isalnum() and self.text[0] != '_': return      # do not proceed, maybe false positive in solidify
-        ident = self.parse_word()
-        if not ident: return
-        literal = unescape_operator(ident)
+        literal = self.parse_ident()
+        if literal is None: return
         if not literal in self.strtab:
             self.strtab_weak.add(literal)
-            # print(f"str '{ident}' -> {literal}")
 
     def parse_string_long(self):
-        if not self.text[0].isalnum() and self.text[0] != '_': return      # do not proceed, maybe false positive in solidify
-        ident = self.parse_word()
-        if not ident: return
-        literal = unescape_operator(ident)
+        literal = self.parse_ident()
+        if literal is None: return
         if not literal in self.strtab:
             self.strtab_long.add(literal)
 
     def parse_bin(self):
         ident = self.parse_word()
         if not ident: return
-        if not re.fullmatch(r"[0-9A-Za-z]*", ident): return
-        if not ident in self.bintab:
-            self.bintab.add(ident)
-            # print(f"str '{ident}' -> {literal}")
+        if not coc_parser.pat_bin.fullmatch(ident): return
+        self.bintab.add(ident)
 
     #################################################################################
     # Parse a block of definition like module, class...
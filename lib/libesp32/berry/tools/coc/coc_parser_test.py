@@ -0,0 +1,31 @@
+import unittest
+from coc_parser import *
+from macro_table import *
+
+class Test_coc_parser(unittest.TestCase):
+
+    text = ("be_nested_str(always)\n"
+            "#if BE_USE_FOO\n  be_nested_str(foo)\n#else\n  be_nested_str(no_foo)\n#endif\n"
+            "#ifdef USE_UNKNOWN\n  be_nested_str(maybe)\n#endif\n"
+            "#if 0\n  be_nested_str(never)\n#endif\n")
+
+    def setUp(self):
+        self.macro = macro_table()
+        self.macro.map = { "BE_USE_FOO": 1 }
+
+    def test_no_preprocess(self):
+        p = coc_parser(self.text)
+        self.assertEqual(p.strtab, { "always", "foo", "no_foo", "maybe", "never" })
+
+    def test_preprocess_known(self):
+        p = coc_parser(self.text, self.macro)
+        self.assertEqual(p.strtab, { "always", "foo", "maybe" })
+        self.assertEqual(p.strtab_inactive, { "no_foo", "never" })
+
+    def test_preprocess_strict(self):
+        p = coc_parser(self.text, self.macro, True)
+        self.assertEqual(p.strtab, { "always", "foo" })
+        self.assertEqual(p.strtab_inactive, { "no_foo", "maybe", "never" })
+
+if __name__ == '__main__':
+    unittest.main()
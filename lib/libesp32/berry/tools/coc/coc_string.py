@@ -38,3 +38,76 @@ def unescape_operator(s):
     s = re.sub('_X[0-9A-F][0-9A-F]', lambda m: chr(int(m.group()[2:], 16)), s)
     s = re.sub('_X_', '_X', s)
     return s
+
+# from https://stackoverflow.com/questions/14945095/how-to-escape-string-for-generated-c (simplified)
+def escape_c(s, encoding='ascii'):
+    result = ''
+    for c in s:
+        if not (32 <= ord(c) < 127):
+            result += '\\%03o' % ord(c)
+        elif c == '\\':
+            result += "\\\\"
+        elif c == '"':
+            result += "\\\""
+        else:
+            result += c
+    return '"' + result + '"'
+
+#################################################################################
+# Registry of interned strings, each unique string is hashed and escaped once
+# and shared by the parser, the map builders and the string table
+#################################################################################
+class str_entry:
+    """Interned string, its derived values are computed on first use"""
+    __slots__ = ("str", "len", "_hash", "_ident", "_literal")
+
+    def __init__(self, s):
+        self.str = s
+        self.len = len(s)
+        self._hash = None
+        self._ident = None
+        self._literal = None
+
+    @property
+    def hash(self):
+        if self._hash is None: self._hash = hashcode(self.str)
+        return self._hash
+
+    @property
+    def ident(self):            # C identifier, after `be_const_str_`
+        if self._ident is None: self._ident = escape_operator(self.str)
+        return self._ident
+
+    @property
+    def literal(self):          # C string literal, with quotes
+        if self._literal is None: self._literal = escape_c(self.str)
+        return self._literal
+
+class str_registry:
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.map = {}           # string -> str_entry
+        self.idents = {}        # C identifier -> string
+
+    def get(self, s):
+        ent = self.map.get(s)
+        if ent is None:
+            ent = str_entry(s)
+            self.map[s] = ent
+        return ent
+
+    # string of a C identifier found in the sources
+    def from_ident(self, ident):
+        s = self.idents.get(ident)
+        if s is None:
+            s = unescape_operator(ident)
+            self.idents[ident] = s
+        return s
+
+    def hash(self, s):          return self.get(s).hash
+    def ident(self, s):         return self.get(s).ident
+    def literal(self, s):       return self.get(s).literal
+
+strings = str_registry()        # shared by all phases of one process
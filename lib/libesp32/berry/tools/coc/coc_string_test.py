@@ -14,5 +14,15 @@ class Test_coc_string(unittest.TestCase):
         self.assertEqual(escape_operator("foo._bar"), "foo_dot___bar")
         self.assertEqual(escape_operator("foo. bar"), "foo_dot__20bar")
 
+    def test_registry(self):
+        reg = str_registry()
+        ent = reg.get("foo.bar")
+        self.assertIs(reg.get("foo.bar"), ent)
+        self.assertEqual(ent.hash, hashcode("foo.bar"))
+        self.assertEqual(ent.ident, escape_operator("foo.bar"))
+        self.assertEqual(ent.literal, '"foo.bar"')
+        self.assertEqual(ent.len, 7)
+        self.assertEqual(reg.from_ident("foo_X2Ebar"), "foo.bar")
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
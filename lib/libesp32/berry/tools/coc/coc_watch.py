@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+import collections
+from coc_worker import *
+from str_build import *
+from bytes_build import *
+
+class watcher:
+    """Regenerate the output of a coc run as its sources change
+
+    The results of every source file stay in memory. Each poll re-parses the
+    changed files only, updates the reference counts of strings and bytes, and
+    rebuilds the string or bytes table only if their set of keys changed.
+    Files are rewritten only if their content changed. A change of a
+    configuration file triggers a full run with `rebuild()`.
+    A source file that fails to parse keeps its previous output, if any, and
+    is retried as soon as it changes again."""
+
+    def __init__(self, builder, interval = 1.0, rebuild = None):
+        self.interval = interval
+        self.rebuild = rebuild      # callable returning a new builder
+        self.reset(builder)
+
+    def reset(self, builder):
+        self.builder = builder
+        self.stamps = { f: self.stamp(f) for f in builder.files + (builder.config or []) }
+        self.failed = {}            # source file -> stamp of the version that failed to parse
+        self.counts = [ collections.Counter() for i in range(4) ]  # strong, weak, long, bytes
+        self.tables = {}            # source file -> tables() of its output
+        for (filename, out) in builder.results.items():
+            self.count(filename, out)
+        self.keys = self.table_keys()
+
+    def stamp(self, filename):
+        try:
+            st = os.stat(filename)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    # add the tables of `out` for `filename`, replacing the previous ones
+    def count(self, filename, out):
+        for (counter, keys) in zip(self.counts, self.tables.pop(filename, ([], [], [], []))):
+            counter.subtract(keys)
+        if out is not None:
+            tables = out.tables()
+            for (counter, keys) in zip(self.counts, tables):
+                counter.update(keys)
+            self.tables[filename] = tables
+
+    def table_keys(self):
+        return [ frozenset(k for k, n in c.items() if n > 0) for c in self.counts ]
+
+    # return the list of changed, added and removed source files, or None if
+    # a configuration file changed
+    def poll(self):
+        b = self.builder
+        for f in (b.config or []):
+            if self.stamp(f) != self.stamps.get(f): return None
+        files = b.scan_inputs()
+        changed = []
+        for f in files:
+            st = self.stamp(f)
+            if st != self.stamps.get(f) and (f not in self.failed or st != self.failed[f]):
+                changed.append(f)
+        current = set(files)
+        changed += [ f for f in b.files if f not in current ]
+        b.files = files
+        return changed
+
+    def update(self, changed):
+        b = self.builder
+        written = b.manifest.written
+        for filename in changed:
+            st = self.stamp(filename)
+            out = None
+            if st is not None:
+                try:
+                    with open(filename, encoding='utf-8') as f:
+                        text = f.read()
+                    out = process_file((text, None), b.macro, b.layout, b.preprocess)
+                except Exception as e:      # keep the previous output, retry on the next change
+                    print(f"coc: error in {filename}: {e!r}", file=sys.stderr)
+                    self.failed[filename] = st
+                    continue
+                if b.cache: b.cache.put(filename, text, out.result)
+                b.results[filename] = out
+                self.stamps[filename] = st
+            else:
+                b.results.pop(filename, None)
+                self.stamps.pop(filename, None)
+            self.failed.pop(filename, None)
+            self.count(filename, out)
+
+        b.outputs = {}
+        for filename in b.files:
+            if filename not in b.results: continue      # new file that failed to parse
+            for (name, text) in b.results[filename].files:
+                b.outputs[name] = text      # last definition wins
+
+        keys = self.table_keys()
+        if keys[:3] != self.keys[:3]:
+            (strong, weak, long) = [ dict.fromkeys(k, 0) for k in keys[:3] ]
+            b.tables.update(str_build(strong, weak, long, b.strtab_budget).render())
+        if keys[3] != self.keys[3]:
+            b.tables.update(bytes_build(dict.fromkeys(keys[3], 0)).render())
+        self.keys = keys
+
+        for name in sorted(b.outputs):
+            b.manifest.writefile(b.output + "/" + name, b.outputs[name])
+        for name in sorted(b.tables):
+            b.manifest.writefile(b.output + "/" + name, b.tables[name])
+        removed = b.manifest.prune()
+        return (b.manifest.written - written, len(removed))
+
+    def run(self):
+        print(f"coc: watching {len(self.builder.files)} files, Ctrl-C to stop", file=sys.stderr)
+        try:
+            while True:
+                time.sleep(self.interval)
+                t0 = time.perf_counter()
+                changed = self.poll()
+                if changed is None and self.rebuild:
+                    print("coc: configuration changed, full run", file=sys.stderr)
+                    self.reset(self.rebuild())
+                    continue
+                if not changed: continue
+                try:
+                    (written, removed) = self.update(changed)
+                except Exception as e:      # keep watching, the next edit may fix it
+                    print(f"coc: error: {e!r}", file=sys.stderr)
+                    continue
+                t = (time.perf_counter() - t0) * 1000
+                failed = f", {len(self.failed)} failing" if self.failed else ""
+                print(f"coc: {len(changed)} changed, {written} written, {removed} removed{failed} in {t:.1f} ms", file=sys.stderr)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if self.builder.cache:
+                self.builder.cache.save()
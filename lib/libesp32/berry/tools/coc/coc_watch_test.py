@@ -0,0 +1,58 @@
+import os
+import types
+import tempfile
+import unittest
+import contextlib
+from coc_watch import *
+from coc_bench import load_coc
+
+def output(strtab, bintab = []):
+    result = types.SimpleNamespace(strtab = strtab, strtab_weak = [], strtab_long = [], bintab = bintab)
+    return file_output(result)
+
+class Test_coc_watch(unittest.TestCase):
+
+    def test_count(self):
+        b = types.SimpleNamespace(files = [], config = [], results = { "a.h": output(["x", "y"]), "b.h": output(["y"], ["00"]) })
+        w = watcher(b)
+        self.assertEqual(w.keys[0], {"x", "y"})
+        self.assertEqual(w.keys[3], {"00"})
+        w.count("a.h", output(["z"]))       # `y` is still used by b.h
+        self.assertEqual(w.table_keys()[0], {"y", "z"})
+        w.count("b.h", None)                # removed
+        self.assertEqual(w.table_keys()[0], {"z"})
+        self.assertEqual(w.table_keys()[3], set())
+
+    def source(self, folder, name, body, mtime):
+        path = os.path.join(folder, name)
+        with open(path, "w") as f:
+            f.write("/* @const_object_info_begin\n" + body + "@const_object_info_end */\n")
+        os.utime(path, ns = (mtime, mtime))
+        return path
+
+    def test_failed(self):
+        good = "class be_class_{0} (scope: global, name: {0}) {{\n    init, func(m_init)\n}}\n"
+        with tempfile.TemporaryDirectory() as d:
+            src = os.path.join(d, "src")
+            out = os.path.join(d, "generate")
+            os.mkdir(src)
+            os.mkdir(out)
+            self.source(src, "a.c", good.format("a"), 1000)
+            w = watcher(load_coc().builder([src], out, []))
+            # a new file that does not parse is not marked up to date
+            b = self.source(src, "b.c", "class be_class_b (scope: global) {\n    init, func(m_init)\n", 2000)
+            self.assertEqual(w.poll(), [b])
+            with contextlib.redirect_stdout(None), contextlib.redirect_stderr(None):
+                w.update([b])
+            self.assertIn(b, w.failed)
+            self.assertNotIn(b, w.stamps)
+            self.assertEqual(w.poll(), [])          # unchanged, not parsed again
+            # once fixed, it is parsed and its output written
+            self.source(src, "b.c", good.format("b"), 3000)
+            self.assertEqual(w.poll(), [b])
+            w.update([b])
+            self.assertEqual(w.failed, {})
+            self.assertTrue(os.path.exists(os.path.join(out, "be_fixed_be_class_b.h")))
+
+if __name__ == '__main__':
+    unittest.main()
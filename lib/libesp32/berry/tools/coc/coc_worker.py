@@ -0,0 +1,48 @@
+from coc_parser import *
+from block_builder import *
+from phase_timer import *
+
+class file_output:
+    """Everything produced from one source file, merged by the builder"""
+
+    def __init__(self, result):
+        self.result = result        # parse_result of the file
+        self.strtab = []
+        self.strtab_weak = []
+        self.strtab_long = []
+        self.files = []             # list of (file name, body) to write
+        self.report = []            # map layout statistics
+        self.objects = []           # list of (file name, footprint) of the emitted objects
+        self.timer = None           # phase_timer of this file, when timing
+
+    # strings (strong, weak, long) and bytes used by the file
+    def tables(self):
+        r = self.result
+        return (set(r.strtab) | set(self.strtab), set(r.strtab_weak) | set(self.strtab_weak),
+                set(r.strtab_long) | set(self.strtab_long), set(r.bintab))
+
+# Parse one file (unless a cached result is provided) and emit its blocks.
+# Kept at module level so that it can be dispatched to a process pool.
+def process_file(task, macro, layout = None, preprocess = None, timing = False):
+    (text, result) = task
+    timer = phase_timer() if timing else None
+    if result is None:
+        with timed(timer, "parse"):
+            if preprocess:
+                result = parse_result(coc_parser(text, macro, preprocess == "strict"))
+            else:
+                result = parse_result(coc_parser(text))
+    out = file_output(result)
+    out.timer = timer
+    with timed(timer, "block"):
+        for obj in result.objects:
+            builder = block_builder(obj, macro, layout, timer)
+            out.strtab += builder.strtab
+            out.strtab_weak += builder.strtab_weak
+            out.strtab_long += builder.strtab_long
+            out.files.append(builder.render())
+            out.objects.append((out.files[-1][0], builder.footprint()))
+            out.report += builder.report
+    if timer:                   # `block` includes the nested `layout`
+        timer.phases["block"] -= timer.phases["layout"]
+    return out
@@ -0,0 +1,132 @@
+import json
+from str_build import *
+
+# size of the constant structures on a 32-bit target, with 32-bit `bint` and `breal`
+# (see be_object.h, be_map.h, be_class.h, be_module.h and be_vector.h)
+PTR_SIZE = 4
+MAPNODE_SIZE = 16           # bmapkey (value + type/next) and bvalue (value + type)
+MAP_SIZE = 28               # common header, gray, slots, lastfree, size, count
+CLASS_SIZE = 24             # common header with nvar, super, members, name, gray
+MODULE_SIZE = 20            # common header, table, info, gray
+NATIVE_MODULE_SIZE = 16     # bntvmodule_t: name, attrs, size, module
+VECTOR_SIZE = 20            # capacity, size, count, data, end
+VALUE_SIZE = 8
+
+# bytes used by the object itself, without the strings of its keys
+def object_bytes(fp):
+    slots = fp["slots"]
+    map_bytes = MAP_SIZE + MAPNODE_SIZE * slots
+    if fp["type"] == "map":
+        return map_bytes
+    if fp["type"] == "class":
+        return CLASS_SIZE + (map_bytes if slots > 0 else 0)
+    if fp["type"] == "module":
+        size = MODULE_SIZE + map_bytes + len(fp["name"]) + 1
+        if not fp["local"]: size += NATIVE_MODULE_SIZE
+        return size
+    if fp["type"] == "vartab":
+        return map_bytes + VECTOR_SIZE + VALUE_SIZE * slots
+    return 0
+
+class footprint:
+    """Estimate of the flash used by the constant objects and strings
+
+    The bytes of a string are shared evenly by everything that references it,
+    objects or solidified code. A strong string also costs its share of
+    `m_string_table`. A string referenced by a single object can be dropped
+    by the linker along with the object if the object uses `strings: weak`."""
+
+    def __init__(self, results, sb):
+        self.objects = {}           # output file name -> footprint of its object
+        self.refs = {}              # string -> set of referrers, objects or "code:<source file>"
+        for (filename, out) in results:
+            r = out.result
+            for s in list(r.strtab) + list(r.strtab_weak) + list(r.strtab_long):
+                self.refs.setdefault(s, set()).add("code:" + filename)
+            for (name, fp) in out.objects:
+                if fp is None: continue
+                self.objects[name] = dict(fp, file = filename)   # last definition wins
+        for fp in self.objects.values():
+            for s in fp["strings"]:
+                self.refs.setdefault(s, set()).add(fp["name"])
+
+        self.strong = set(sb.map) | {""}
+        self.weak = set(sb.str_weak)
+        count = max(1, sb.get_count())
+        self.table_bytes = len(sb.buckets) * PTR_SIZE
+        self.table_share = self.table_bytes / count     # per strong string
+
+    def string_bytes(self, s):
+        if s in self.strong:
+            return const_str_bytes(s) + self.table_share
+        if s in self.weak:
+            return const_str_bytes(s)
+        return 0
+
+    def object_entry(self, fp):
+        strings = sorted(set(fp["strings"]))
+        shared = sum(self.string_bytes(s) / len(self.refs[s]) for s in strings)
+        unique = [ s for s in strings if self.refs[s] == {fp["name"]} ]
+        unique_bytes = sum(self.string_bytes(s) for s in unique)
+        size = object_bytes(fp)
+        entry = {
+            "name": fp["name"], "type": fp["type"], "file": fp["file"],
+            "slots": fp["slots"], "weak": fp["weak"],
+            "object_bytes": size,
+            "map_slot_bytes": MAPNODE_SIZE * fp["slots"],
+            "string_bytes": round(shared, 1),
+            "total_bytes": round(size + shared, 1),
+            "strings": len(strings),
+            "unique_strings": len(unique),
+            "unique_string_bytes": round(unique_bytes, 1),
+        }
+        if not fp["weak"]:
+            strong = [ s for s in unique if s in self.strong ]
+            entry["weak_table_saving"] = round(len(strong) * self.table_share, 1)
+            entry["weak_droppable_bytes"] = sum(const_str_bytes(s) for s in strong)
+        return entry
+
+    def todict(self):
+        objects = sorted((self.object_entry(fp) for fp in self.objects.values()),
+                         key = lambda e: (-e["total_bytes"], e["name"]))
+        single = sorted((s, next(iter(r))) for s, r in self.refs.items()
+                        if len(r) == 1 and not next(iter(r)).startswith("code:") and self.string_bytes(s) > 0)
+        candidates = sorted((e for e in objects if e.get("weak_droppable_bytes")),
+                            key = lambda e: (-e["weak_droppable_bytes"], e["name"]))
+        strong_bytes = sum(const_str_bytes(s) for s in self.strong)
+        weak_bytes = sum(const_str_bytes(s) for s in self.weak)
+        return {
+            "totals": {
+                "objects": len(objects),
+                "object_bytes": sum(e["object_bytes"] for e in objects),
+                "strong_strings": len(self.strong),
+                "strong_string_bytes": strong_bytes,
+                "weak_strings": len(self.weak),
+                "weak_string_bytes": weak_bytes,
+                "string_table_bytes": self.table_bytes,
+            },
+            "objects": objects,
+            "single_object_strings": [ { "string": s, "object": o, "bytes": round(self.string_bytes(s), 1) } for (s, o) in single ],
+            "weak_candidates": [ { "name": e["name"], "file": e["file"],
+                                   "weak_droppable_bytes": e["weak_droppable_bytes"],
+                                   "weak_table_saving": e["weak_table_saving"] } for e in candidates ],
+        }
+
+    def tojson(self):
+        return json.dumps(self.todict(), indent=1) + "\n"
+
+    def tostring(self, top = 30):
+        d = self.todict()
+        t = d["totals"]
+        ostr = f"objects: {t['objects']}, {t['object_bytes']} bytes without strings\n"
+        ostr += f"strong strings: {t['strong_strings']}, {t['strong_string_bytes']} bytes, m_string_table {t['string_table_bytes']} bytes\n"
+        ostr += f"weak strings: {t['weak_strings']}, {t['weak_string_bytes']} bytes if all are linked\n\n"
+        ostr += f"largest objects (bytes: total = object + share of strings):\n"
+        for e in d["objects"][:top]:
+            ostr += f"    {e['total_bytes']:8.0f} = {e['object_bytes']:6d} + {e['string_bytes']:7.0f}  {e['type']:<7} {e['name']}\n"
+        single = d["single_object_strings"]
+        ostr += f"\nstrings referenced by one object only: {len(single)}, {sum(x['bytes'] for x in single):.0f} bytes\n"
+        ostr += f"\n`strings: weak` candidates (bytes of strings dropped with the object, m_string_table saving):\n"
+        for e in d["weak_candidates"][:top]:
+            ostr += f"    {e['weak_droppable_bytes']:6d} {e['weak_table_saving']:6.0f}  {e['name']}\n"
+        return ostr
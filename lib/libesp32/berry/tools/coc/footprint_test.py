@@ -0,0 +1,31 @@
+import unittest
+import types
+from footprint import *
+
+def output(objects, strtab = []):
+    result = types.SimpleNamespace(strtab = strtab, strtab_weak = [], strtab_long = [])
+    return types.SimpleNamespace(result = result, objects = objects)
+
+def obj(name, type, strings, weak = False):
+    return { "name": name, "type": type, "slots": len(strings), "local": True, "weak": weak, "strings": strings }
+
+class Test_footprint(unittest.TestCase):
+
+    def test_object_bytes(self):
+        self.assertEqual(object_bytes(obj("m", "map", ["a", "b"])), MAP_SIZE + 2 * MAPNODE_SIZE)
+        self.assertEqual(object_bytes(obj("c", "class", [])), CLASS_SIZE)
+        self.assertEqual(object_bytes(obj("v", "vartab", ["a"])), MAP_SIZE + MAPNODE_SIZE + VECTOR_SIZE + VALUE_SIZE)
+
+    def test_report(self):
+        results = [ ("a.c", output([ ("be_fixed_a.h", obj("a", "map", ["x", "shared"])) ], ["shared"])),
+                    ("b.c", output([ ("be_fixed_b.h", obj("b", "map", ["y"], True)) ])) ]
+        sb = str_build({ "x": 0, "shared": 0 }, { "y": 0 }, {})
+        d = footprint(results, sb).todict()
+        self.assertEqual([ x["string"] for x in d["single_object_strings"] ], ["x", "y"])
+        self.assertEqual([ x["name"] for x in d["weak_candidates"] ], ["a"])
+        self.assertEqual(d["weak_candidates"][0]["weak_droppable_bytes"], const_str_bytes("x"))
+        a = [ e for e in d["objects"] if e["name"] == "a" ][0]
+        self.assertEqual(a["unique_strings"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,30 +1,50 @@
-import copy
 from coc_string import *
 
-# resize a list, from https://stackoverflow.com/a/8850956
-def list_resize_entry(l, newsize, filling=None):                                                                                  
-    if newsize > len(l):                                                                                 
-        l.extend([entry() for x in range(len(l), newsize)])                                                 
-    else:                                                                                                
-        del l[newsize:]
-
 class entry:
-    def __init__(self):
-        self.key = ""
-        self.value = ""
-        self.next = hash_map.NODE_EMPTY
-    
+    __slots__ = ("key", "value", "next")
+
+    def __init__(self, key = "", value = "", next = -2):
+        self.key = key
+        self.value = value
+        self.next = next
+
     def __repr__(self):
         return f"<entry object; key='{self.key}', value='{self.value}', next={self.next}>"
 
+class map_layout:
+    """Options of the collision-minimizing layout of constant maps
+
+    `rank` gives the lookup priority of member names (lower comes first in
+    its chain), read from a file listing the hottest names first."""
+
+    def __init__(self, hot_file = None):
+        self.rank = {}
+        if hot_file:
+            with open(hot_file, encoding='utf-8') as f:
+                for line in f:
+                    name = line.strip()
+                    if name and not name.startswith("#"):
+                        self.rank.setdefault(name, len(self.rank))
+
 class hash_map:
+    """Constant map layout, identical to the one built by the Berry VM
+
+    Slots are stored in parallel lists (keys, values, hashes, next links).
+    The hash of each key is computed once, and the final layout (resized to
+    exactly `count` slots) is computed once and reused by `entry_list()` and
+    `var_count()`."""
+
     NODE_EMPTY = -2
     NODE_NULL = -1
 
     def __init__(self, map):
         self.count = 0
         self.lastfree = 0
-        self.bucket = []
+        self.keys = []
+        self.values = []
+        self.hashes = []
+        self.next = []
+        self.final = False          # True once resized to the final layout
 
         self.resize(2)
         var_count = 0
@@ -36,115 +56,186 @@ class hash_map:
 
         for key in sorted(map.keys()):
             self.insert(key, map[key])
-    
+
     def __repr__(self):
-        return f"<hash_map object; count={self.count}, bucket={self.bucket}, lastfree={self.lastfree}>"
+        return f"<hash_map object; count={self.count}, bucket={self.entries()}, lastfree={self.lastfree}>"
+
+    def entries(self):
+        return [entry(self.keys[i], self.values[i], self.next[i]) for i in range(len(self.next))]
 
-    def is_empty(self, ent):
-        return ent.next == hash_map.NODE_EMPTY
-    
+    def is_empty(self, idx):
+        return self.next[idx] == hash_map.NODE_EMPTY
+
+    # rebuild the table with `size` slots, re-inserting the previous slots in index order
     def resize(self, size):
-        bucket = copy.deepcopy(self.bucket)
-        list_resize_entry(self.bucket, size)
-        # set all slot to empty
-        for i in range(size):
-            self.bucket[i].next = hash_map.NODE_EMPTY
+        keys, values, hashes, next = self.keys, self.values, self.hashes, self.next
+        self.keys = [""] * size
+        self.values = [""] * size
+        self.hashes = [0] * size
+        self.next = [hash_map.NODE_EMPTY] * size
         self.lastfree = size - 1
-        for slot in bucket:
-            if slot.next != hash_map.NODE_EMPTY:
-                self.insert_p(slot.key, slot.value)
+        for i in range(len(next)):
+            if next[i] != hash_map.NODE_EMPTY:
+                self.insert_p(keys[i], values[i], hashes[i])
 
-    def findprev(self, prev, slot):
-        #print(f"findprev: prev={prev} slot={slot}")
+    # return the index of the node linking to `idx` in the chain starting at `prev`
+    def findprev(self, prev, idx):
         while True:
-            next = prev.next
-            if next == hash_map.NODE_NULL or self.bucket[next] == slot: break
-            prev = self.bucket[next]
+            next = self.next[prev]
+            if next == hash_map.NODE_NULL or next == idx: break
+            prev = next
         if next == hash_map.NODE_NULL: return None
         return prev
-    
+
     def nextfree(self):
         while self.lastfree >= 0:
-            if self.bucket[self.lastfree].next == hash_map.NODE_EMPTY:
+            if self.next[self.lastfree] == hash_map.NODE_EMPTY:
                 return self.lastfree
             self.lastfree -= 1
         return -1
-    
-    def find(self, key):
-        hash = hashcode(key)
-        null = entry()
-        slot = self.bucket[hash % len(self.bucket)]
-        if slot.next == hash_map.NODE_EMPTY:
-            return null
-        while slot.key != key:
-            if slot.next == hash_map.NODE_NULL: return null
-            slot = self.bucket[slot.next]
-        return slot
-    
-    def insert_p(self, key, value):
-        slot = self.bucket[hashcode(key) % len(self.bucket)]
-        #print(f"slot={slot}, index={hashcode(key) % len(self.bucket)}")
-        if slot.next == hash_map.NODE_EMPTY:
-            slot.next = hash_map.NODE_NULL
+
+    # return the slot index of `key` or -1 if not found
+    def find(self, key, hash):
+        idx = hash % len(self.next)
+        if self.next[idx] == hash_map.NODE_EMPTY:
+            return -1
+        while self.keys[idx] != key:
+            if self.next[idx] == hash_map.NODE_NULL: return -1
+            idx = self.next[idx]
+        return idx
+
+    def insert_p(self, key, value, hash):
+        size = len(self.next)
+        idx = hash % size
+        if self.next[idx] == hash_map.NODE_EMPTY:
+            self.next[idx] = hash_map.NODE_NULL
         else:
             newidx = self.nextfree()
-            #print(f"newidx={newidx}")
-            # get the main-slot index
-            mainslot = self.bucket[hashcode(slot.key) % len(self.bucket)]
-            newslot = self.bucket[newidx]
-            #print(f"self={self}\nslot={hashcode(key) % len(self.bucket)} idx_main={hashcode(slot.key) % len(self.bucket)} newidx={newidx}")
-            #print(f"insert_p: 1={mainslot} 2={newslot}")
-            if mainslot == slot:
-                newslot.next = mainslot.next
-                mainslot.next = newidx
-                slot = newslot
-            else:   # link to list
-                #print(f"insert_p: 1={mainslot} 2={slot}")
-                prev = self.findprev(mainslot, slot)
-                prev.next = newidx      # link the previous node
+            # get the main-slot index of the colliding node
+            mainidx = self.hashes[idx] % size
+            if mainidx == idx:
+                self.next[newidx] = self.next[idx]
+                self.next[idx] = newidx
+                idx = newidx
+            else:   # colliding node is not in its main slot, move it away
+                prev = self.findprev(mainidx, idx)
+                self.next[prev] = newidx      # link the previous node
                 # copy to new slot
-                newslot.key = slot.key
-                newslot.value = slot.value
-                newslot.next = slot.next
-                slot.next = hash_map.NODE_NULL
-        slot.key = key
-        slot.value = value
+                self.keys[newidx] = self.keys[idx]
+                self.values[newidx] = self.values[idx]
+                self.hashes[newidx] = self.hashes[idx]
+                self.next[newidx] = self.next[idx]
+                self.next[idx] = hash_map.NODE_NULL
+        self.keys[idx] = key
+        self.values[idx] = value
+        self.hashes[idx] = hash
 
     def insert(self, key, value):
-        slot = self.find(key)
-        if slot.next == hash_map.NODE_EMPTY:
-            if self.count >= len(self.bucket):
-                self.resize(len(self.bucket) * 2)
-            self.insert_p(key, value)
+        hash = strings.hash(key)
+        if self.find(key, hash) < 0:
+            if self.count >= len(self.next):
+                self.resize(len(self.next) * 2)
+            self.insert_p(key, value, hash)
             self.count += 1
-    
+            self.final = False
+
+    # shrink the table to exactly `count` slots, only once
+    def finalize(self):
+        if not self.final:
+            self.resize(self.count)
+            self.final = True
+
+    #################################################################################
+    # Collision-minimizing layout
+    #################################################################################
+    # return the chains of the final table, each one starting at its main slot,
+    # as lists of slot indices in lookup order
+    def chains(self):
+        self.finalize()
+        size = len(self.next)
+        res = []
+        for idx in range(size):
+            if self.next[idx] != hash_map.NODE_EMPTY and self.hashes[idx] % size == idx:
+                chain = [idx]
+                while self.next[chain[-1]] != hash_map.NODE_NULL:
+                    chain.append(self.next[chain[-1]])
+                res.append(chain)
+        return res
+
+    # rebuild the final table with each chain starting with the keys of lowest `rank`
+    # (missing keys last, in current order); chain lengths and probes do not change
+    def optimize(self, rank = None):
+        if rank is None: rank = {}
+        final_chains = self.chains()        # finalizes the table, its size is the final one
+        size = len(self.next)
+        chains = []
+        for chain in final_chains:
+            nodes = [ (self.keys[i], self.values[i], self.hashes[i]) for i in chain ]
+            chains.append(sorted(nodes, key=lambda n: rank.get(n[0], len(rank))))
+        self.keys = [""] * size
+        self.values = [""] * size
+        self.hashes = [0] * size
+        self.next = [hash_map.NODE_EMPTY] * size
+        # main slots first, so that no key can take the main slot of another chain
+        for nodes in chains:
+            (key, value, hash) = nodes[0]
+            idx = hash % size
+            self.keys[idx] = key
+            self.values[idx] = value
+            self.hashes[idx] = hash
+            self.next[idx] = hash_map.NODE_NULL
+        self.lastfree = size - 1
+        for nodes in chains:
+            prev = nodes[0][2] % size
+            for (key, value, hash) in nodes[1:]:
+                idx = self.nextfree()
+                self.keys[idx] = key
+                self.values[idx] = value
+                self.hashes[idx] = hash
+                self.next[idx] = hash_map.NODE_NULL
+                self.next[prev] = idx
+                prev = idx
+
+    # return (average probes of a successful lookup, average probes weighted by `rank`
+    # for ranked keys or None, longest chain)
+    def chain_stats(self, rank = None):
+        if rank is None: rank = {}
+        probes = 0
+        hot_probes = 0
+        hot_count = 0
+        longest = 0
+        for chain in self.chains():
+            longest = max(longest, len(chain))
+            for (pos, idx) in enumerate(chain):
+                probes += pos + 1
+                if self.keys[idx] in rank:
+                    hot_probes += pos + 1
+                    hot_count += 1
+        avg = probes / self.count if self.count else 0
+        hot_avg = hot_probes / hot_count if hot_count else None
+        return (avg, hot_avg, longest)
+
     #################################################################################
     # Compute entries in the hash for modules or classes
     #################################################################################
-    # return a list (entiry, var_count)
     def entry_modify(self, ent):
-        ent.key = escape_operator(ent.key)
+        ent.key = strings.ident(ent.key)
         if isinstance(ent.value, int):
             ent.value = "be_const_var(" + str(ent.value) + ")"
         else:
             ent.value = "be_const_" + ent.value
         return ent
-    
+
     #  generate the final map
     def entry_list(self):
-        l = []
-        
-        self.resize(self.count)
-        for it in self.bucket:
-            l.append(self.entry_modify(it))
-        return l
-    
+        self.finalize()
+        return [self.entry_modify(ent) for ent in self.entries()]
+
     def var_count(self):
+        self.finalize()
         count = 0
-
-        self.resize(self.count)
-        for it in self.bucket:
-            if isinstance(it.value, int): count += 1
+        for value in self.values:
+            if isinstance(value, int): count += 1
         return count
 
 if __name__ == '__main__':
@@ -0,0 +1,54 @@
+import unittest
+from hash_map import *
+
+class Test_hash_map(unittest.TestCase):
+
+    def sample(self):
+        return hash_map({ "init": "closure(a)", "x": "var", "y": "var", "+": "func(b)",
+                          "tostring": "closure(c)", "member": "func(d)" })
+
+    def test_layout(self):
+        # layout and next links as produced by the previous list-of-entries implementation
+        entries = [ (e.key, e.value, e.next) for e in self.sample().entry_list() ]
+        self.assertEqual(entries, [
+            ("x", "be_const_var(0)", -1),
+            ("member", "be_const_func(d)", 2),
+            ("tostring", "be_const_closure(c)", -1),
+            ("init", "be_const_closure(a)", 0),
+            ("_X2B", "be_const_func(b)", 5),
+            ("y", "be_const_var(1)", -1),
+        ])
+
+    def test_layout_computed_once(self):
+        m = self.sample()
+        self.assertEqual(m.var_count(), 2)
+        first = [ (e.key, e.next) for e in m.entry_list() ]
+        second = [ (e.key, e.next) for e in m.entry_list() ]
+        self.assertEqual(first, second)
+
+    def test_optimize(self):
+        m = self.sample()
+        before = m.chain_stats()
+        # "x" shares its main slot with "init", rank it first
+        m.optimize({ "x": 0 })
+        self.assertEqual(m.chain_stats()[0], before[0])
+        self.assertEqual(m.chain_stats()[2], before[2])
+        entries = m.entry_list()
+        self.assertEqual(entries[3].key, "x")
+        self.assertEqual(entries[entries[3].next].key, "init")
+
+    def test_optimize_unfinalized(self):
+        keys = [ f"member_{i}" for i in range(1022) ]
+        m = hash_map({ k: "var" for k in keys })
+        m.optimize({ keys[-1]: 0 })
+        self.assertEqual(len(m.next), len(keys))
+        for k in keys:
+            self.assertGreaterEqual(m.find(k, strings.hash(k)), 0)
+
+    def test_empty(self):
+        m = hash_map({})
+        self.assertEqual(m.entry_list(), [])
+        self.assertEqual(m.var_count(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
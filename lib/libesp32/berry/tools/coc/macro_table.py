@@ -1,16 +1,37 @@
 import re
+import os
+import sys
+import hashlib
 
 def int_safe(v):
     try:     return int(v, 0)
     except:  return 0
 
 class macro_table:
-    pat = re.compile("(?:\\n|$)\\s*#define\\s+(\\w+)[ \\t]+(\\w*)", re.MULTILINE)
     pat_query = re.compile("(!?)(\\w+)")
+    pat_comment = re.compile(r"/\*.*?\*/", re.DOTALL)
+    pat_directive = re.compile(r"\s*#\s*(\w+)(.*)")
+    pat_define = re.compile(r"\s*(\w+)(\(?)(.*)")
+    pat_include = re.compile(r'\s*"([^"]+)"')
+    pat_token = re.compile(r"\s*(?:(0[xX][0-9a-fA-F]+|\d+)[uUlL]*|(\w+)|(&&|\|\||<<|>>|<=|>=|==|!=|[-+*/%<>!~&|^()?:]))")
 
-    def __init__(self):
+    # precedence of binary operators in `#if` expressions
+    binary = {
+        "*": 10, "/": 10, "%": 10,
+        "+": 9, "-": 9,
+        "<<": 8, ">>": 8,
+        "<": 7, "<=": 7, ">": 7, ">=": 7,
+        "==": 6, "!=": 6,
+        "&": 5, "^": 4, "|": 3,
+        "&&": 2, "||": 1,
+    }
+
+    def __init__(self, include_dirs = None):
         self.map = {}
-    
+        self.include_dirs = include_dirs if include_dirs else []
+        self.cache = {}             # expression -> bool, for `query()`
+        self.partial = False        # names missing from the table are unknown, see `query_known()`
+
     # def readfile(self, filename):
     #     with open(filename) as f:
     #         return f.read()
@@ -19,17 +40,230 @@ class macro_table:
         if len(s) == 0:             return 1    # defined a macro name but no content, considered true
         if not s[0].isnumeric():    return 1
         return int_safe(s)
-    
-    def scan_file(self, filename):
+
+    # value of a macro body, evaluated as an expression when possible
+    def define_value(self, body):
+        body = body.strip()
+        if len(body) == 0: return 1
+        try:
+            return self.evaluate(body)
+        except ValueError:
+            r = re.match(r"\w*", body)
+            return self.parse_value(r[0])
+
+    def define(self, name, value = "1"):
+        self.map[name] = self.define_value(value)
+        self.cache = {}
+
+    def find_include(self, name, folder):
+        for d in [folder] + self.include_dirs:
+            path = os.path.join(d, name)
+            if os.path.isfile(path): return path
+        return None
+
+    # scan a configuration header, evaluating `#if/#ifdef/#ifndef/#elif/#else/#endif`
+    # and following `#include "..."` of headers found next to it or in `include_dirs`
+    def scan_file(self, filename, depth = 0):
         str = ""
         with open(filename, encoding='utf-8') as f:
            str = f.read()
-        r = macro_table.pat.findall(str)
-        for it in r:
-            # print(f"> it0:{it[0]} it1:{it[1]}")
-            self.map[it[0]] = self.parse_value(it[1])
-    
+        str = macro_table.pat_comment.sub(" ", str)
+        str = str.replace("\\\n", " ")
+        folder = os.path.dirname(filename)
+        stack = []                  # (enclosing region active, a branch was taken)
+        active = True
+        for line in str.splitlines():
+            r = macro_table.pat_directive.match(line)
+            if not r: continue
+            directive = r[1]
+            rest = r[2].split("//", 1)[0]
+            if directive in ("if", "ifdef", "ifndef"):
+                cond = False
+                if active:
+                    if directive == "if":
+                        cond = self.eval_safe(rest)
+                    else:
+                        cond = (rest.split()[0] if rest.split() else "") in self.map
+                        if directive == "ifndef": cond = not cond
+                stack.append((active, cond))
+                active = active and cond
+            elif directive == "elif":
+                if not stack: continue
+                (parent, taken) = stack[-1]
+                active = parent and not taken and self.eval_safe(rest)
+                stack[-1] = (parent, taken or active)
+            elif directive == "else":
+                if not stack: continue
+                (parent, taken) = stack[-1]
+                active = parent and not taken
+                stack[-1] = (parent, True)
+            elif directive == "endif":
+                if not stack: continue
+                (active, taken) = stack.pop()
+            elif not active:
+                continue
+            elif directive == "define":
+                d = macro_table.pat_define.match(rest)
+                if d and not d[2]:              # function-like macros are ignored
+                    # print(f"> define:{d[1]} value:{d[3]}")
+                    self.map[d[1]] = self.define_value(d[3])
+            elif directive == "undef":
+                name = rest.split()
+                if name: self.map.pop(name[0], None)
+            elif directive == "include":
+                d = macro_table.pat_include.match(rest)
+                path = self.find_include(d[1], folder) if d else None
+                if path and depth < 16:
+                    self.scan_file(path, depth + 1)
+        self.cache = {}
+
+    # stable fingerprint of the table, used to invalidate cached results
+    def digest(self):
+        text = "\n".join(f"{k}={v}" for k, v in sorted(self.map.items()))
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    #################################################################################
+    # Evaluate a preprocessor expression, undefined names count as 0
+    #################################################################################
+    def tokenize(self, s):
+        tokens = []
+        pos = 0
+        s = s.rstrip()
+        while pos < len(s):
+            r = macro_table.pat_token.match(s, pos)
+            if not r: raise ValueError(f"unexpected '{s[pos:]}'")
+            if r[1] is not None:    tokens.append(("num", int_safe(r[1])))
+            elif r[2] is not None:  tokens.append(("name", r[2]))
+            else:                   tokens.append(("op", r[3]))
+            pos = r.end(0)
+        return tokens
+
+    def evaluate(self, s):
+        tokens = self.tokenize(s)
+        if not tokens: raise ValueError("empty expression")
+        (value, pos) = self.parse_ternary(tokens, 0)
+        if pos != len(tokens): raise ValueError(f"unexpected token in '{s}'")
+        return value
+
+    def eval_safe(self, s):
+        try:
+            return self.evaluate(s) != 0
+        except ValueError:
+            return False
+
+    def expect(self, tokens, pos, op):
+        if pos >= len(tokens) or tokens[pos] != ("op", op): raise ValueError(f"expected '{op}'")
+        return pos + 1
+
+    def parse_ternary(self, tokens, pos):
+        (cond, pos) = self.parse_binary(tokens, pos, 1)
+        if pos < len(tokens) and tokens[pos] == ("op", "?"):
+            (a, pos) = self.parse_ternary(tokens, pos + 1)
+            pos = self.expect(tokens, pos, ":")
+            (b, pos) = self.parse_ternary(tokens, pos)
+            if cond is None: return (a if a == b else None, pos)
+            return (a if cond else b, pos)
+        return (cond, pos)
+
+    def parse_binary(self, tokens, pos, level):
+        (left, pos) = self.parse_unary(tokens, pos)
+        while pos < len(tokens):
+            (kind, op) = tokens[pos]
+            prec = macro_table.binary.get(op) if kind == "op" else None
+            if prec is None or prec < level: break
+            (right, pos) = self.parse_binary(tokens, pos + 1, prec + 1)
+            left = self.apply(op, left, right)
+        return (left, pos)
+
+    def apply(self, op, a, b):
+        if a is None or b is None:      # unknown operand, only `&&` and `||` may still be decided
+            if op == "&&" and (a == 0 or b == 0): return 0
+            if op == "||" and (a or b): return 1
+            return None
+        if op == "*":   return a * b
+        if op == "/":   return int(a / b) if b else 0
+        if op == "%":   return a % b if b else 0
+        if op == "+":   return a + b
+        if op == "-":   return a - b
+        if op == "<<":  return a << b
+        if op == ">>":  return a >> b
+        if op == "<":   return int(a < b)
+        if op == "<=":  return int(a <= b)
+        if op == ">":   return int(a > b)
+        if op == ">=":  return int(a >= b)
+        if op == "==":  return int(a == b)
+        if op == "!=":  return int(a != b)
+        if op == "&":   return a & b
+        if op == "^":   return a ^ b
+        if op == "|":   return a | b
+        if op == "&&":  return int(bool(a) and bool(b))
+        if op == "||":  return int(bool(a) or bool(b))
+        raise ValueError(f"unknown operator '{op}'")
+
+    def parse_unary(self, tokens, pos):
+        if pos >= len(tokens): raise ValueError("unexpected end of expression")
+        (kind, v) = tokens[pos]
+        if kind == "num":
+            return (v, pos + 1)
+        if kind == "name":
+            if v == "defined":
+                pos += 1
+                paren = pos < len(tokens) and tokens[pos] == ("op", "(")
+                if paren: pos += 1
+                if pos >= len(tokens) or tokens[pos][0] != "name": raise ValueError("expected a name after 'defined'")
+                value = int(tokens[pos][1] in self.map)
+                if self.partial and not value: value = None
+                pos += 1
+                if paren: pos = self.expect(tokens, pos, ")")
+                return (value, pos)
+            if self.partial and v not in self.map: return (None, pos + 1)
+            return (int(self.map.get(v, 0)), pos + 1)
+        if v == "(":
+            (value, pos) = self.parse_ternary(tokens, pos + 1)
+            return (value, self.expect(tokens, pos, ")"))
+        (value, pos) = self.parse_unary(tokens, pos + 1)
+        if value is None: return (None, pos)
+        if v == "!":    return (int(not value), pos)
+        if v == "-":    return (-value, pos)
+        if v == "+":    return (value, pos)
+        if v == "~":    return (~value, pos)
+        raise ValueError(f"unexpected '{v}'")
+
+    #################################################################################
+    # Query a `depend:` condition, results are cached per expression
+    #################################################################################
     def query(self, s):
+        value = self.cache.get(s)
+        if value is None:
+            try:
+                value = self.evaluate(s) != 0
+            except ValueError:
+                print(f"coc: cannot evaluate condition '{s}', using its first name", file=sys.stderr)
+                value = self.query_name(s)
+            self.cache[s] = value
+        # print(f">query: {s}:{value}")
+        return value
+
+    # Evaluate a condition of a source file: names that are not in the table are
+    # unknown (the firmware build may define them) and make the result unknown
+    # unless it is decided anyway. With `strict`, the table is assumed complete
+    # and missing names count as 0. Return True, False or None if unknown.
+    def query_known(self, s, strict = False):
+        key = ("strict" if strict else "known", s)
+        if key in self.cache: return self.cache[key]
+        self.partial = not strict
+        try:
+            value = self.evaluate(s)
+        except ValueError:
+            value = None
+        finally:
+            self.partial = False
+        if value is not None: value = value != 0
+        self.cache[key] = value
+        return value
+
+    # legacy syntax: `NAME` or `!NAME`
+    def query_name(self, s):
         r = macro_table.pat_query.search(s)
         value = False
         if r:
@@ -40,11 +274,10 @@ class macro_table:
                 value = int(self.map[name]) != 0
             if bang == "!":
                 value = not value
-        # print(f">query: {s}:{value}")
         return value
 
 if __name__ == '__main__':
-    # from hash_map import *
-    pat = re.compile("(?:\\n|$)\\s*#define\\s+(\\w+)[ \\t]+(\\w+)", re.MULTILINE)
-    s = "aaa\n#define A 1  // a \n  #define B 2\n#define C \n#define D 0 \n  #define E     11 \na"
-    
\ No newline at end of file
+    m = macro_table()
+    m.map = { "A": 1, "B": 0, "C": 3 }
+    for q in [ "A", "!B", "A && !B", "A || B", "(A && B) || C >= 2", "defined(D)", "!defined D && C == 3" ]:
+        print(f"{q} -> {m.query(q)}")
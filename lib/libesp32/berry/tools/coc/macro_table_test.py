@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+from macro_table import *
+
+class Test_macro_table(unittest.TestCase):
+
+    def setUp(self):
+        self.m = macro_table()
+        self.m.map = { "A": 1, "B": 0, "C": 3 }
+
+    def test_query_legacy(self):
+        self.assertTrue(self.m.query("A"))
+        self.assertFalse(self.m.query("B"))
+        self.assertTrue(self.m.query("!B"))
+        self.assertFalse(self.m.query("UNDEFINED"))
+        self.assertTrue(self.m.query("!UNDEFINED"))
+
+    def test_query_expression(self):
+        self.assertTrue(self.m.query("A && !B"))
+        self.assertFalse(self.m.query("A && B"))
+        self.assertTrue(self.m.query("(A && B) || C >= 2"))
+        self.assertTrue(self.m.query("defined(B) && !defined D"))
+        self.assertTrue(self.m.query("C == 1 + 2 * 1"))
+        self.assertFalse(self.m.query("C < 3"))
+
+    def test_scan_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, "user.h"), "w") as f:
+                f.write("#define USE_FOO\n#define LEVEL (2*3)\n")
+            with open(os.path.join(d, "conf.h"), "w") as f:
+                f.write('#include "user.h"\n'
+                        "#ifdef USE_FOO\n  #define HAS_FOO 1\n#else\n  #define HAS_FOO 0\n#endif\n"
+                        "#if LEVEL > 4 && !defined(USE_BAR)\n  #define BIG 1 // comment\n#elif 1\n  #define BIG 0\n#endif\n"
+                        "/* #define HIDDEN 1 */\n#define GONE 1\n#undef GONE\n")
+            m = macro_table()
+            m.scan_file(os.path.join(d, "conf.h"))
+        self.assertEqual(m.map["HAS_FOO"], 1)
+        self.assertEqual(m.map["LEVEL"], 6)
+        self.assertEqual(m.map["BIG"], 1)
+        self.assertNotIn("HIDDEN", m.map)
+        self.assertNotIn("GONE", m.map)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import json
+
+class manifest:
+    """Files emitted by coc into the output folder
+
+    A file is only rewritten when its content changes, so that its mtime
+    does not force a recompile. Files emitted by the previous run and not
+    emitted anymore are removed by `prune()`. The content of the files
+    is remembered, so that a long-lived manifest (see `--watch`) compares
+    in memory instead of reading the files again."""
+
+    FILENAME = ".coc_manifest.json"
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.previous = self.load()
+        self.emitted = set()
+        self.written = 0
+        self.texts = {}             # file name -> content known to be on disk
+
+    def load(self):
+        try:
+            with open(os.path.join(self.folder, manifest.FILENAME)) as f:
+                return set(json.load(f))
+        except (OSError, ValueError):
+            # no manifest yet, consider any generated header as ours
+            try:
+                return { f for f in os.listdir(self.folder) if f.startswith("be_") and f.endswith(".h") }
+            except OSError:
+                return set()
+
+    def writefile(self, filename, text):
+        name = os.path.relpath(filename, self.folder)
+        self.emitted.add(name)
+        if self.texts.get(name) == text: return
+        buf = None
+        try:
+            with open(filename, encoding='utf-8') as f:
+                buf = f.read()
+        except (OSError, UnicodeDecodeError):
+            pass
+        if buf != text:
+            with open(filename, "w", encoding='utf-8') as f:
+                f.write(text)
+            self.written += 1
+        self.texts[name] = text
+
+    # remove stale files and save the list of emitted files
+    def prune(self):
+        removed = []
+        for name in sorted(self.previous - self.emitted - {manifest.FILENAME}):
+            try:
+                os.remove(os.path.join(self.folder, name))
+                removed.append(name)
+                self.texts.pop(name, None)
+            except FileNotFoundError:
+                pass
+        self.writefile(os.path.join(self.folder, manifest.FILENAME),
+                       json.dumps(sorted(self.emitted), indent=0) + "\n")
+        self.previous = set(self.emitted)
+        self.emitted = set()
+        return removed
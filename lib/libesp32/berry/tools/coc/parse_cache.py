@@ -0,0 +1,62 @@
+import os
+import pickle
+import hashlib
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class parse_cache:
+    """Persistent cache of per-file parse results
+
+    Each entry is keyed by the file name and validated against a hash of
+    the file content. The whole cache is dropped when the macro table or
+    the cache format changes."""
+
+    VERSION = 2
+
+    def __init__(self, filename, macro, mode = ""):
+        self.filename = filename
+        self.macro_hash = macro.digest() + mode
+        self.entries = {}           # entries loaded from disk
+        self.used = {}              # entries seen during this run, saved back
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.filename, "rb") as f:
+                data = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return
+        if not isinstance(data, dict): return
+        if data.get("version") != parse_cache.VERSION: return
+        if data.get("macro") != self.macro_hash: return
+        self.entries = data.get("entries", {})
+
+    def save(self):
+        folder = os.path.dirname(self.filename)
+        if folder: os.makedirs(folder, exist_ok=True)
+        data = {
+            "version": parse_cache.VERSION,
+            "macro": self.macro_hash,
+            "entries": self.used,
+        }
+        tmp = self.filename + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.filename)
+
+    # return the cached result for `filename` or None if missing or stale
+    def get(self, filename, text):
+        key = content_hash(text)
+        ent = self.entries.get(filename)
+        if ent is not None and ent[0] == key:
+            self.used[filename] = ent
+            self.hits += 1
+            return ent[1]
+        self.misses += 1
+        return None
+
+    def put(self, filename, text, result):
+        self.used[filename] = (content_hash(text), result)
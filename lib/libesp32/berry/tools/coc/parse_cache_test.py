@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+from coc_parser import *
+from macro_table import *
+from parse_cache import *
+
+class Test_parse_cache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.dir.name, "cache.pickle")
+        self.macro = macro_table()
+        self.macro.map = { "BE_USE_FOO": 1 }
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def store(self, text):
+        cache = parse_cache(self.filename, self.macro)
+        cache.put("a.c", text, parse_result(coc_parser(text)))
+        cache.save()
+
+    def test_hit(self):
+        text = "be_nested_str(foo) be_nested_str_weak(bar)"
+        self.store(text)
+        cache = parse_cache(self.filename, self.macro)
+        res = cache.get("a.c", text)
+        self.assertEqual(res.strtab, ["foo"])
+        self.assertEqual(res.strtab_weak, ["bar"])
+        self.assertEqual(cache.hits, 1)
+
+    def test_content_changed(self):
+        self.store("be_nested_str(foo)")
+        cache = parse_cache(self.filename, self.macro)
+        self.assertIsNone(cache.get("a.c", "be_nested_str(foo2)"))
+        self.assertEqual(cache.misses, 1)
+
+    def test_macro_changed(self):
+        text = "be_nested_str(foo)"
+        self.store(text)
+        self.macro.map["BE_USE_FOO"] = 0
+        cache = parse_cache(self.filename, self.macro)
+        self.assertIsNone(cache.get("a.c", text))
+
+if __name__ == '__main__':
+    unittest.main()
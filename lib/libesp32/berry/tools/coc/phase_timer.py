@@ -0,0 +1,63 @@
+import time
+import contextlib
+
+class phase_timer:
+    """Wall time spent in each phase of a coc run, and per source file
+
+    Phases: `macro` (configuration scan), `parse` (reading and parsing
+    sources), `block` (building and emitting objects), `layout` (hash map
+    construction and layout), `strtab` (string table), `bytes` (bytes table)
+    and `write` (output files).
+
+    When files are parsed by parallel workers, their `parse`, `block` and
+    `layout` times are summed over the workers and then scaled to the wall
+    time of the parallel run (see `merge_wall()`), so that the phases do
+    not grow with the number of jobs. Per file times are worker times."""
+
+    PHASES = ("macro", "parse", "block", "layout", "strtab", "bytes", "write")
+
+    def __init__(self):
+        self.phases = { p: 0.0 for p in phase_timer.PHASES }
+        self.files = {}             # source file -> time spent in parse, block and layout
+        self.total = 0.0
+
+    def add(self, phase, t):
+        self.phases[phase] = self.phases.get(phase, 0.0) + t
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    # add the phases timed for one source file, in a worker
+    def merge(self, other, filename = None):
+        for p, t in other.phases.items():
+            self.add(p, t)
+        if filename is not None:
+            self.files[filename] = self.files.get(filename, 0.0) + sum(other.phases.values())
+
+    # add the phases of `other`, summed over parallel workers, scaled so that
+    # they add up to the wall time `wall` of the parallel run
+    def merge_wall(self, other, wall):
+        busy = sum(other.phases.values())
+        for p, t in other.phases.items():
+            self.add(p, t * wall / busy if busy > 0 else 0.0)
+        for f, t in other.files.items():
+            self.files[f] = self.files.get(f, 0.0) + t
+
+    def slowest(self, n):
+        return sorted(self.files.items(), key = lambda x: (-x[1], x[0]))[:n]
+
+    def todict(self, top = 10):
+        return {
+            "total": self.total,
+            "phases": dict(self.phases),
+            "files": [ { "file": f, "time": t } for (f, t) in self.slowest(top) ],
+        }
+
+# time `phase` with `timer`, or do nothing if there is no timer
+def timed(timer, phase):
+    return timer.phase(phase) if timer is not None else contextlib.nullcontext()
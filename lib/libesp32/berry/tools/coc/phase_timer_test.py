@@ -0,0 +1,45 @@
+import unittest
+from phase_timer import *
+
+class Test_phase_timer(unittest.TestCase):
+
+    def test_merge(self):
+        t = phase_timer()
+        f = phase_timer()
+        f.add("parse", 0.5)
+        f.add("layout", 0.25)
+        t.merge(f, "a.h")
+        g = phase_timer()
+        g.add("parse", 1.0)
+        t.merge(g, "b.h")
+        self.assertEqual(t.phases["parse"], 1.5)
+        self.assertEqual(t.phases["layout"], 0.25)
+        self.assertEqual(t.slowest(1), [("b.h", 1.0)])
+        self.assertEqual(t.todict(5)["files"], [{"file": "b.h", "time": 1.0}, {"file": "a.h", "time": 0.75}])
+
+    def test_merge_wall(self):
+        workers = phase_timer()
+        f = phase_timer()
+        f.add("parse", 3.0)
+        f.add("block", 1.0)
+        workers.merge(f, "a.h")
+        t = phase_timer()
+        t.add("parse", 0.5)
+        # 4 s of worker time in 2 s of wall time
+        t.merge_wall(workers, 2.0)
+        self.assertEqual(t.phases["parse"], 2.0)
+        self.assertEqual(t.phases["block"], 0.5)
+        self.assertEqual(t.slowest(1), [("a.h", 4.0)])
+        t.merge_wall(phase_timer(), 1.0)
+        self.assertEqual(t.phases["parse"], 2.0)
+
+    def test_timed(self):
+        t = phase_timer()
+        with timed(t, "strtab"):
+            pass
+        self.assertGreaterEqual(t.phases["strtab"], 0.0)
+        with timed(None, "strtab"):
+            pass
+
+if __name__ == '__main__':
+    unittest.main()
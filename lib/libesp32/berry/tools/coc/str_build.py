@@ -1,39 +1,63 @@
 import json
 from coc_string import *
 
-# from https://stackoverflow.com/questions/14945095/how-to-escape-string-for-generated-c (simplified)
-def escape_c(s, encoding='ascii'):
-    result = ''
-    for c in s:
-        if not (32 <= ord(c) < 127):
-            result += '\\%03o' % ord(c)
-        elif c == '\\':
-            result += "\\\\"
-        elif c == '"':
-            result += "\\\""
-        else:
-            result += c
-    return '"' + result + '"'
+# estimated flash used by one constant string: the `bcstring` header
+# (next, type, marked, extra, slen, hash, pointer) plus the NUL-terminated literal
+def const_str_bytes(s):
+    return 16 + len(s.encode('utf8')) + 1
 
 class str_info:
     def __init__(self):
         self.hash = 0
         self.str = ""
         self.extra = 0
+        self.ent = None         # `str_entry` of the registry
+
+# statistics of a constant string table of `size` buckets, from the hashes of its strings
+class strtab_stats:
+    PTR_SIZE = 4            # size of a `const bstring*` in `m_string_table` on target
+
+    def __init__(self, hashes, size):
+        self.size = size
+        self.count = len(hashes)
+        chains = [0] * size
+        for h in hashes:
+            chains[h % size] += 1
+        self.histogram = {}         # chain length -> number of buckets
+        for l in chains:
+            self.histogram[l] = self.histogram.get(l, 0) + 1
+        # a successful lookup of the n-th string of a chain takes n probes
+        self.hit_avg = sum(l * (l + 1) // 2 for l in chains) / max(1, self.count)
+        # an unsuccessful lookup walks the whole chain
+        self.miss_avg = self.count / size
+        self.max = max(chains) if chains else 0
+        self.bytes = size * strtab_stats.PTR_SIZE
+
+    def tostring(self, title):
+        ostr = f"{title}: size={self.size} count={self.count} m_string_table={self.bytes} bytes\n"
+        ostr += f"    probes hit avg={self.hit_avg:.3f} miss avg={self.miss_avg:.3f} max={self.max}\n"
+        ostr += "    chain length histogram:\n"
+        for l in sorted(self.histogram):
+            ostr += f"    {l:4d}: {self.histogram[l]}\n"
+        return ostr
 
 class str_build:
-    def __init__(self, map, map_weak, map_long):
+    def __init__(self, map, map_weak, map_long, budget = None):
         self.map = map.copy()
         self.str_weak = []
         self.str_long = []
 
         size = int(len(self.map) / 2)         # voluntarily reduce hash size to half
         if size < 4: size = 4
+
+        self.keywords()     # add keywords to self.map
+
+        self.default_size = size
+        if budget is not None:
+            size = self.optimize_size(budget)
         self.buckets = []
         for i in range(size):
             self.buckets.append([])
-        
-        self.keywords()     # add keywords to self.map
 
         self.make_ceil("", 0)   # add empty string as it is always useful
         self.count = len(self.map) + 1       # TODO it is not actually accurate since keywords are not counted
@@ -50,10 +74,38 @@ class str_build:
             if not k in self.map:
                 self.str_long.append(k)
 
-    def build(self, path):
-        prefix = path + "/be_const_strtab"
-        self.writefile(prefix + "_def.h", self.build_table_def())
-        self.writefile(prefix + ".h", self.build_table_ext())
+    def hashes(self):
+        return [strings.hash("")] + [strings.hash(k) for k in self.map]
+
+    # choose the number of buckets that minimizes the average number of probes
+    # of successful lookups, with `m_string_table` fitting in `budget` bytes
+    # (smallest table wins on ties, and the table never goes below 4 buckets)
+    def optimize_size(self, budget):
+        hashes = self.hashes()
+        best = None
+        best_cost = 0
+        for size in range(4, max(4, int(budget / strtab_stats.PTR_SIZE)) + 1):
+            cost = strtab_stats(hashes, size).hit_avg
+            if best is None or cost < best_cost:
+                best = size
+                best_cost = cost
+        return best
+
+    def report(self):
+        hashes = self.hashes()
+        ostr = strtab_stats(hashes, len(self.buckets)).tostring("selected")
+        if len(self.buckets) != self.default_size:
+            ostr += "\n" + strtab_stats(hashes, self.default_size).tostring("default")
+        return ostr
+
+    # return the list of output file names (without folder) and their content
+    def render(self):
+        return [ ("be_const_strtab_def.h", self.build_table_def()), ("be_const_strtab.h", self.build_table_ext()) ]
+
+    def build(self, path, manifest = None):
+        writefile = manifest.writefile if manifest else self.writefile
+        for (name, text) in self.render():
+            writefile(path + "/" + name, text)
     
     def get_count(self):            # compute the total size by adding sizes of each bucket
         size = 0
@@ -80,10 +132,12 @@ class str_build:
             self.map[key] = v
     
     def make_ceil(self, name, extra):
+        ent = strings.get(name)
         info = str_info()
-        info.hash = hashcode(name)
+        info.hash = ent.hash
         info.str = name
         info.extra = extra
+        info.ent = ent
         self.buckets[info.hash % len(self.buckets)].append(info)
 
     def writefile(self, filename, text):
@@ -98,74 +152,69 @@ class str_build:
                 f.write(text)
     
     def build_table_def(self):
-        strings = {}
+        return "".join(self.emit_table_def())
+
+    def build_table_ext(self):
+        return "".join(self.emit_table_ext())
+
+    # the emitters yield the output in chunks, joined once by the callers
+    def emit_table_def(self):
+        defs = {}
         for bucket in self.buckets:
             # print(f"> Bucket= {[x.str for x in bucket]}")
             size = len(bucket)
             for i in range(size):
                 info = bucket[i]
-                node = escape_operator(info.str)
-                istr = ""
+                ent = info.ent
                 if i < size - 1:
-                    next = "&be_const_str_" + escape_operator(bucket[i + 1].str)
+                    next = "&be_const_str_" + bucket[i + 1].ent.ident
                 else:
                     next = "NULL"
-                istr += "be_define_const_str("
-                istr += node + ", " + escape_c(info.str) + ", "
-                istr += str(info.hash) + "u, " + str(info.extra) + ", "
-                istr += str(len(info.str)) + ", " + next + ");\n"
-                strings[info.str] = istr
-        
-        ostr = ""
-        for s in sorted(strings.keys()):
-            ostr += strings[s]
-        ostr += "\n"
-
-        ostr += "\n/* weak strings */\n"
+                defs[info.str] = f"be_define_const_str({ent.ident}, {ent.literal}, {info.hash}u, {info.extra}, {ent.len}, {next});\n"
+
+        for s in sorted(defs.keys()):
+            yield defs[s]
+        yield "\n"
+
+        yield "\n/* weak strings */\n"
         for k in self.str_weak:
-            ostr += "be_define_const_str("
-            ostr += escape_operator(k) + ", " + escape_c(k) + ", "
-            ostr += "0u, 0, " + str(len(k)) + ", NULL);\n"
+            ent = strings.get(k)
+            yield f"be_define_const_str({ent.ident}, {ent.literal}, 0u, 0, {ent.len}, NULL);\n"
 
         for k in self.str_long:
-            ostr += "be_define_const_str_long("
-            ostr += escape_operator(k) + ", " + escape_c(k) + ", " + str(len(k)) + ");\n"
-
-        ostr += "\n"
-        ostr += "static const bstring* const m_string_table[] = {\n"
+            ent = strings.get(k)
+            yield f"be_define_const_str_long({ent.ident}, {ent.literal}, {ent.len});\n"
 
+        yield "\n"
+        yield "static const bstring* const m_string_table[] = {\n"
 
         size = len(self.buckets)
         for i in range(size):
             bucket = self.buckets[i]
             if len(bucket) > 0:
-                ostr += "    (const bstring *)&be_const_str_" + escape_operator(bucket[0].str)
+                yield "    (const bstring *)&be_const_str_" + bucket[0].ent.ident
             else:
-                ostr += "    NULL"
-            if i < size - 1: ostr += ","
-            ostr += "\n"
-        ostr += "};\n\n"
-        ostr += "static const struct bconststrtab m_const_string_table = {\n"
-        ostr += "    .size = " + str(size) + ",\n"
-        ostr += "    .count = " + str(self.get_count()) + ",\n"
-        ostr += "    .table = m_string_table\n"
-        ostr += "};\n"
-        return ostr
+                yield "    NULL"
+            yield ",\n" if i < size - 1 else "\n"
+        yield "};\n\n"
+        yield "static const struct bconststrtab m_const_string_table = {\n"
+        yield f"    .size = {size},\n"
+        yield f"    .count = {self.get_count()},\n"
+        yield "    .table = m_string_table\n"
+        yield "};\n"
 
-    def build_table_ext(self):
-        ostr = ""
+    def emit_table_ext(self):
         # put all in a sorted sed
         all = set()
         for bucket in self.buckets:
             for info in bucket:
-                all.add(escape_operator(info.str))
+                all.add(info.ent.ident)
         for s in sorted(all):
-            ostr += "extern const bcstring be_const_str_" + s + ";\n"
-            # ostr += "#define BE_CONST_STR_" + s + "\n"
+            yield "extern const bcstring be_const_str_" + s + ";\n"
+            # yield "#define BE_CONST_STR_" + s + "\n"
         # weak strings
-        ostr += "\n/* weak strings */\n"
+        yield "\n/* weak strings */\n"
         for s in self.str_weak:
-            ostr += "extern const bcstring be_const_str_" + escape_operator(s) + ";\n"
+            yield "extern const bcstring be_const_str_" + strings.ident(s) + ";\n"
         for s in self.str_long:
-            ostr += "extern const bclstring be_const_str_" + escape_operator(s) + ";\n"
-        return ostr
+            yield "extern const bclstring be_const_str_" + strings.ident(s) + ";\n"
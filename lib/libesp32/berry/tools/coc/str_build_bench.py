@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of the constant string table generation
+
+Builds a `str_build` from a synthetic set of strings (strong, weak and long)
+and times the full generation of `be_const_strtab_def.h` and `be_const_strtab.h`.
+
+    python3 str_build_bench.py [-n STRINGS] [-r REPEAT]
+"""
+import argparse
+import random
+import time
+from str_build import *
+
+def make_strings(n, seed = 0):
+    rnd = random.Random(seed)
+    alphabet = "abcdefghijklmnopqrstuvwxyz_"
+    words = set()
+    while len(words) < n:
+        w = "".join(rnd.choice(alphabet) for i in range(rnd.randint(2, 24)))
+        if rnd.random() < 0.05: w += "."     # some names need escaping
+        words.add(w)
+    words = sorted(words)
+    strong = { w: 0 for w in words[: n * 3 // 4] }
+    weak = { w: 0 for w in words[n * 3 // 4 : n * 19 // 20] }
+    long = { w * 12: 0 for w in words[n * 19 // 20 :] }
+    return (strong, weak, long)
+
+def bench(n, repeat):
+    (strong, weak, long) = make_strings(n)
+    best = None
+    size = 0
+    for i in range(repeat):
+        strings.clear()             # start from a cold registry, as a fresh coc run does
+        t0 = time.perf_counter()
+        sb = str_build(strong, weak, long)
+        text = sb.build_table_def() + sb.build_table_ext()
+        t = time.perf_counter() - t0
+        best = t if best is None else min(best, t)
+        size = len(text)
+    return (best, size)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the constant string table generation')
+    parser.add_argument("-n", type=int, default=5000, help="number of strings (default 5000)")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="number of runs, the best is reported (default 5)")
+    args = parser.parse_args()
+    (t, size) = bench(args.n, args.repeat)
+    print(f"strtab: {args.n} strings, {size} bytes of output, best of {args.repeat}: {t * 1000:.2f} ms")
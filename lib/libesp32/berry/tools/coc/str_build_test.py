@@ -0,0 +1,21 @@
+import unittest
+from str_build import *
+
+class Test_str_build(unittest.TestCase):
+
+    def strings(self, n):
+        return { f"str_{i}": 0 for i in range(n) }
+
+    def test_budget(self):
+        sb = str_build(self.strings(1200), {}, {}, 1000)
+        self.assertGreater(sb.default_size * strtab_stats.PTR_SIZE, 1000)
+        self.assertLessEqual(len(sb.buckets) * strtab_stats.PTR_SIZE, 1000)
+        # a budget below the 4 buckets minimum still gives 4 buckets
+        self.assertEqual(len(str_build(self.strings(100), {}, {}, 8).buckets), 4)
+
+    def test_default(self):
+        sb = str_build(self.strings(1200), {}, {})
+        self.assertEqual(len(sb.buckets), sb.default_size)
+
+if __name__ == '__main__':
+    unittest.main()
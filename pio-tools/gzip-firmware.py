@@ -36,6 +36,8 @@ if tasmotapiolib.is_env_set(tasmotapiolib.ENABLE_ESP32_GZ, env) or env["PIOPLATF
     import time
 
     gzip_level = int(env['ENV'].get('GZIP_LEVEL', 10))
+    # processes compressing segments of the image in parallel, 0 for all cores
+    gzip_jobs = int(env['ENV'].get('GZIP_JOBS', 1))
 
     def bin_gzip(source, target, env):
         # create string with location and file names based on variant
@@ -50,7 +52,7 @@ if tasmotapiolib.is_env_set(tasmotapiolib.ENABLE_ESP32_GZ, env) or env["PIOPLATF
         with bin_file.open("rb") as fp:
             with gzip_file.open("wb") as f:
                 time_start = time.time()
-                gz = tasmotapiolib.compress(fp.read(), gzip_level)
+                gz = tasmotapiolib.compress(fp.read(), gzip_level, jobs=gzip_jobs or None)
                 time_delta = time.time() - time_start
                 f.write(gz)
 
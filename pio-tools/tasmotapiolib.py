@@ -24,6 +24,10 @@ Values in .ini files override environment variables
 import zlib
 import pathlib
 import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 # === AVAILABLE OVERRIDES ===
 # if set to 1, will not gzip bin files at all
@@ -136,6 +140,7 @@ def _compress_with_gzip(data, level=9):
 
 try:
     import zopfli
+    HAVE_ZOPFLI = True
 
     # two python modules call themselves `zopfli`, which one is this?
     if hasattr(zopfli, 'ZopfliCompressor'):
@@ -176,7 +181,12 @@ try:
         else:
             raise ValueError(f'Invalid level: {repr(level)}')
 
-    def compress(data, level=None, *, iterations=None, maxsplit=None, **kw):
+    def compress(data, level=None, *, iterations=None, maxsplit=None, jobs=1, **kw):
+        if jobs != 1:
+            if iterations is not None: kw['iterations'] = iterations
+            if maxsplit is not None: kw['maxsplit'] = maxsplit
+            return compress_parallel(data, level, jobs=jobs, **kw)
+
         if level is not None and (iterations is not None or maxsplit is not None):
             raise ValueError("The `level` argument can't be used with `iterations` and/or `maxsplit`!")
 
@@ -195,5 +205,209 @@ try:
         return _compress_with_zopfli(data, **kw)
 
 except ModuleNotFoundError:
-    def compress(data, level=9, **kw):
+    HAVE_ZOPFLI = False
+
+    def compress(data, level=9, *, jobs=1, **kw):
+        if jobs != 1:
+            return compress_parallel(data, level, jobs=jobs, **kw)
         return _compress_with_gzip(data, level)
+
+
+# === PARALLEL COMPRESSION ===
+# Like pigz, the input is cut in segments compressed on a process pool. All
+# segments but the last end with a non final, byte aligned empty stored block,
+# so their raw deflate data can be concatenated in a single gzip member that
+# inflaters read as one stream, the same structure as zlib's Z_SYNC_FLUSH.
+# zlib segments are primed with the last 32 KiB of the previous segment;
+# zopfli has no such option, so its segments start with an empty history.
+
+# segments are not made smaller than this
+PARALLEL_MIN_SEGMENT = 128 * 1024
+
+# no file name, no timestamp, unix
+_GZIP_HEADER = bytes([0x1F, 0x8B, 8, 0, 0, 0, 0, 0, 0, 3])
+_SYNC_BLOCK = b"\x00\x00\xff\xff"
+
+_CODE_LENGTH_ORDER = [16, 17, 18, 0, 8, 7, 9, 6, 10, 5, 11, 4, 12, 3, 13, 2, 14, 1, 15]
+_LENGTH_EXTRA = [0] * 8 + [n for n in range(1, 6) for _ in range(4)] + [0]
+_DIST_EXTRA = [0, 0] + [n for n in range(14) for _ in range(2)]
+
+
+def _huffman_table(lengths):
+    """Lookup table of a canonical Huffman code, indexed by the next
+    `max_len` bits of the stream and giving (symbol, code length)"""
+    max_len = max(lengths)
+    table = [None] * (1 << max_len)
+    code = 0
+    for n in range(1, max_len + 1):
+        for symbol, length in enumerate(lengths):
+            if length == n:
+                reversed_code = int(format(code, "0{}b".format(n))[::-1], 2)
+                for i in range(reversed_code, 1 << max_len, 1 << n):
+                    table[i] = (symbol, n)
+                code += 1
+        code <<= 1
+    return (table, max_len)
+
+
+_FIXED_TABLES = (
+    _huffman_table([8] * 144 + [9] * 112 + [7] * 24 + [8] * 8),
+    _huffman_table([5] * 30),
+)
+
+
+def _last_block(raw):
+    """Bit offsets of the header of the final block of a raw deflate stream
+    and of the end of the stream
+
+    Only the block structure is decoded, no output is produced."""
+    data = raw + bytes(4)
+    pos = 0
+
+    def bits(n):
+        nonlocal pos
+        value = (int.from_bytes(data[pos >> 3:(pos >> 3) + 4], "little") >> (pos & 7)) & ((1 << n) - 1)
+        pos += n
+        return value
+
+    def symbol(huffman):
+        nonlocal pos
+        (table, max_len) = huffman
+        (value, n) = table[bits(max_len)]
+        pos += n - max_len
+        return value
+
+    while True:
+        if pos >= 8 * len(raw):
+            raise ValueError("deflate stream without a final block")
+        header = pos
+        final = bits(1)
+        btype = bits(2)
+        if btype == 0:
+            pos = (pos + 7) & ~7
+            size = bits(16)
+            bits(16)
+            pos += 8 * size
+        else:
+            if btype == 1:
+                (literals, distances) = _FIXED_TABLES
+            elif btype == 2:
+                nlit = bits(5) + 257
+                ndist = bits(5) + 1
+                ncode = bits(4) + 4
+                code_lengths = [0] * 19
+                for i in range(ncode):
+                    code_lengths[_CODE_LENGTH_ORDER[i]] = bits(3)
+                code_table = _huffman_table(code_lengths)
+                lengths = []
+                while len(lengths) < nlit + ndist:
+                    value = symbol(code_table)
+                    if value < 16:
+                        lengths.append(value)
+                    elif value == 16:
+                        lengths += lengths[-1:] * (3 + bits(2))
+                    elif value == 17:
+                        lengths += [0] * (3 + bits(3))
+                    else:
+                        lengths += [0] * (11 + bits(7))
+                literals = _huffman_table(lengths[:nlit])
+                distances = _huffman_table(lengths[nlit:])
+            else:
+                raise ValueError("invalid deflate block type")
+            while True:
+                value = symbol(literals)
+                if value < 256:
+                    continue
+                if value == 256:
+                    break
+                pos += _LENGTH_EXTRA[value - 257]
+                extra = _DIST_EXTRA[symbol(distances)]
+                pos += extra
+        if final:
+            return (header, pos)
+
+
+def _gzip_deflate(member):
+    """Raw deflate data of a gzip member"""
+    flags = member[3]
+    pos = 10
+    if flags & 4:       # FEXTRA
+        pos += 2 + int.from_bytes(member[pos:pos + 2], "little")
+    if flags & 8:       # FNAME
+        pos = member.index(0, pos) + 1
+    if flags & 16:      # FCOMMENT
+        pos = member.index(0, pos) + 1
+    if flags & 2:       # FHCRC
+        pos += 2
+    return member[pos:-8]
+
+
+def _unfinal(raw):
+    """Make a complete raw deflate stream continuable: clear the final bit
+    of its last block and close it with an empty stored block"""
+    (header, end) = _last_block(raw)
+    size = (end + 3 + 7) >> 3      # 3 zero bits of the stored block header, then byte aligned
+    out = bytearray(raw[:size]).ljust(size, b"\x00")
+    out[header >> 3] &= ~(1 << (header & 7))
+    out[end >> 3] &= (1 << (end & 7)) - 1
+    for i in range((end >> 3) + 1, size):
+        out[i] = 0
+    return bytes(out) + _SYNC_BLOCK
+
+
+def _compress_segment(args):
+    """Raw deflate data of one segment, continuable unless `last` is set"""
+    (segment, history, last, use_zopfli, level, kw) = args
+    if use_zopfli:
+        raw = _gzip_deflate(compress(segment, level, **kw))
+        return raw if last else _unfinal(raw)
+    options = {"zdict": history} if history else {}
+    zobj = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, **options)
+    return zobj.compress(segment) + zobj.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def compress_parallel(data, level=None, *, jobs=None, segment_size=None, **kw):
+    """gzip `data` in segments compressed by `jobs` processes (all cores
+    if None), the result is a single gzip member
+
+    With a single segment, this is the same as compress(). If processes
+    can't be started, the segments are compressed one after the other."""
+    jobs = jobs or os.cpu_count() or 1
+    if segment_size is None:
+        segment_size = max(PARALLEL_MIN_SEGMENT, -(-len(data) // jobs))
+    if jobs <= 1 or len(data) <= segment_size:
+        return compress(data, level, **kw)
+
+    use_zopfli = HAVE_ZOPFLI and (level is None or level >= 10)
+    if not use_zopfli:
+        level = 9 if level is None else min(max(level, 0), 9)
+    starts = range(0, len(data), segment_size)
+    args = [(data[start:start + segment_size], data[max(0, start - 32768):start],
+             start + segment_size >= len(data), use_zopfli, level, kw) for start in starts]
+    try:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(args))) as pool:
+            parts = list(pool.map(_compress_segment, args))
+    except (OSError, BrokenProcessPool):
+        parts = [_compress_segment(a) for a in args]
+
+    trailer = struct.pack("<II", zlib.crc32(data), len(data) & 0xFFFFFFFF)
+    return _GZIP_HEADER + b"".join(parts) + trailer
+
+
+def compare_parallel(data, level=None, *, jobs=None, **kw):
+    """Compress `data` as a single stream and in parallel, return the sizes,
+    the times and the ratio cost of the parallel output"""
+    time_start = time.time()
+    single = len(compress(data, level, **kw))
+    single_time = time.time() - time_start
+    time_start = time.time()
+    parallel = len(compress_parallel(data, level, jobs=jobs, **kw))
+    parallel_time = time.time() - time_start
+    return {
+        "single": single,
+        "parallel": parallel,
+        "cost": parallel - single,
+        "cost_percent": (parallel - single) / single * 100 if single else 0.0,
+        "single_time": single_time,
+        "parallel_time": parallel_time,
+    }
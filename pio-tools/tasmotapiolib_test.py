@@ -0,0 +1,82 @@
+import gzip
+import zlib
+import random
+import struct
+import unittest
+
+import tasmotapiolib as lib
+
+STRATEGIES = {
+    "fixed": zlib.Z_FIXED,
+    "default": zlib.Z_DEFAULT_STRATEGY,
+    "rle": zlib.Z_RLE,
+    "huffman": zlib.Z_HUFFMAN_ONLY,
+}
+LEVELS = (0, 1, 6, 9)
+
+# text, runs and random bytes, more than one stored block at level 0
+def sample(size = 80 * 1024):
+    rnd = random.Random(0)
+    words = [ b"tasmota", b"berry", b"wifi", b"mqtt", b"<div>", b"\n" ]
+    out = bytearray()
+    while len(out) < size:
+        kind = rnd.randrange(3)
+        if kind == 0:
+            out += b" ".join(rnd.choice(words) for _ in range(rnd.randrange(1, 40)))
+        elif kind == 1:
+            out += bytes([rnd.randrange(256)]) * rnd.randrange(3, 300)
+        else:
+            out += bytes(rnd.randrange(256) for _ in range(rnd.randrange(1, 200)))
+    return bytes(out[:size])
+
+def gzip_member(data, level, strategy):
+    zobj = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS, strategy = strategy)
+    return zobj.compress(data) + zobj.flush()
+
+def bit(data, pos):
+    return (data[pos >> 3] >> (pos & 7)) & 1
+
+class Test_block_walker(unittest.TestCase):
+
+    def setUp(self):
+        self.data = sample()
+
+    def test_last_block(self):
+        for (name, strategy) in STRATEGIES.items():
+            for level in LEVELS:
+                with self.subTest(strategy = name, level = level):
+                    raw = lib._gzip_deflate(gzip_member(self.data, level, strategy))
+                    (header, end) = lib._last_block(raw)
+                    self.assertEqual(bit(raw, header), 1)               # BFINAL
+                    self.assertEqual((end + 7) >> 3, len(raw))          # the stream ends in its last byte
+
+    def test_unfinal(self):
+        for (name, strategy) in STRATEGIES.items():
+            for level in LEVELS:
+                with self.subTest(strategy = name, level = level):
+                    raw = lib._gzip_deflate(gzip_member(self.data, level, strategy))
+                    (header, end) = lib._last_block(raw)
+                    out = lib._unfinal(raw)
+                    self.assertEqual(out[:header >> 3], raw[:header >> 3])
+                    self.assertEqual(bit(out, header), 0)
+                    # empty stored block: BFINAL 0, BTYPE 00, zero padding, LEN 0, NLEN 0xFFFF
+                    self.assertTrue(out.endswith(lib._SYNC_BLOCK))
+                    self.assertTrue(all(bit(out, i) == 0 for i in range(end, 8 * (len(out) - 4))))
+                    self.assertLess(8 * (len(out) - 4) - end, 3 + 8)
+                    with self.assertRaises(ValueError):
+                        lib._last_block(out)                            # no final block left
+                    # continued by a final empty block, it is still a valid gzip member
+                    trailer = struct.pack("<II", zlib.crc32(self.data), len(self.data))
+                    member = lib._GZIP_HEADER + out + b"\x03\x00" + trailer
+                    self.assertEqual(gzip.decompress(member), self.data)
+
+    def test_segments(self):
+        half = len(self.data) // 2
+        parts = [ lib._gzip_deflate(gzip_member(self.data[:half], 6, zlib.Z_DEFAULT_STRATEGY)),
+                  lib._gzip_deflate(gzip_member(self.data[half:], 1, zlib.Z_HUFFMAN_ONLY)) ]
+        trailer = struct.pack("<II", zlib.crc32(self.data), len(self.data))
+        member = lib._GZIP_HEADER + lib._unfinal(parts[0]) + parts[1] + trailer
+        self.assertEqual(gzip.decompress(member), self.data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2978,8 +2978,8 @@ String UrlEscape(const char *unescaped) {
 
 Unishox compressor;
 
-// New variant where you provide the String object yourself
-int32_t DecompressNoAlloc(const char * compressed, size_t uncompressed_size, String & content) {
+// Variant for data compressed with a shared dictionary (see tools/unishox/compress-html-uncompressed.py --dict)
+int32_t DecompressNoAlloc(const char * compressed, size_t uncompressed_size, String & content, const char * dict, size_t dict_size) {
   uncompressed_size += 2;    // take a security margin
 
   // We use a nasty trick here. To avoid allocating twice the buffer,
@@ -2989,7 +2989,7 @@ int32_t DecompressNoAlloc(const char * compressed, size_t uncompressed_size, Str
   content.reserve(uncompressed_size);
   char * buffer = content.begin();
 
-  int32_t len = compressor.unishox_decompress(compressed, strlen_P(compressed), buffer, uncompressed_size);
+  int32_t len = compressor.unishox_decompress(compressed, strlen_P(compressed), buffer, uncompressed_size, dict, dict_size);
   if (len > 0) {
     buffer[len] = 0;    // terminate string with NULL
     content = buffer;         // copy in place
@@ -2997,10 +2997,21 @@ int32_t DecompressNoAlloc(const char * compressed, size_t uncompressed_size, Str
   return len;
 }
 
+// New variant where you provide the String object yourself
+int32_t DecompressNoAlloc(const char * compressed, size_t uncompressed_size, String & content) {
+  return DecompressNoAlloc(compressed, uncompressed_size, content, nullptr, 0);
+}
+
 String Decompress(const char * compressed, size_t uncompressed_size) {
   String content("");
   DecompressNoAlloc(compressed, uncompressed_size, content);
   return content;
 }
 
+String Decompress(const char * compressed, size_t uncompressed_size, const char * dict, size_t dict_size) {
+  String content("");
+  DecompressNoAlloc(compressed, uncompressed_size, content, dict, dict_size);
+  return content;
+}
+
 #endif // USE_UNISHOX_COMPRESSION
@@ -7,6 +7,23 @@
 # run:
 # python compress-html-uncompressed.py
 #
+# options:
+# --force     recompress files whose input did not change
+# --optimal   smallest output, slower (see Unishox.compressOptimal)
+# --jobs=N    number of processes compressing stale files (default: number of CPUs)
+# --no-minify compress the C strings as they are, see minify()
+# --gzip[=LEVEL] also write a gzip variant of the strings that are a
+#             complete response (see complete_response), with --force for
+#             files whose input did not change
+# --auto      store each string raw or Unishox compressed, whichever saves
+#             the most, see choose_codec()
+# --min-saving=BYTES     PROGMEM a codec must save to be used (default 16)
+# --decode-weight=BYTES  PROGMEM one ms of host Unishox decoding is worth (default 0)
+# --dict[=BYTES]         compress with a shared dictionary of up to BYTES
+#             (default 1024), written to HTTP_DICTIONARY.h. Without the
+#             option the dictionary already in HTTP_DICTIONARY.h is kept,
+#             --dict=0 removes it and compresses without one
+#
 # The intent it to commit both uncompressed and compressed to the repo
 # else this script would need to be run at build.
 #
@@ -19,11 +36,20 @@
 #
 ###############################################################
 
+import io
+import os
+import re
+import sys
+import json
 import unishox
 from sys import argv
+from time import perf_counter
 from datetime import datetime
 from pathlib import Path
 from hashlib import sha256
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 self_dir = Path(__file__).absolute().parent
 base_dir = self_dir.parent.parent
@@ -52,25 +78,36 @@ def extract_c_string(s: str) -> str:
         out += c
   return out
 
-def compress_html(source, target, argv=None, verbose=False):
-  if argv is None: argv = []
-
-  with open(source, "r") as f:
-    text = f.read()
-
-  src_sha, old_sha = sha256(text.encode()).hexdigest(), None
-
-  if not ('--force' in argv):
+# sha256 of the input recorded in a compressed file, None if there is none
+def target_sha(target):
+  try:
     with open(target, "r") as f:
       for line in f:
         prefix = line[:17]
         if prefix == '// input sha256: ':
-          old_sha = line[17:17+64]
-          break
-
-    if src_sha == old_sha:
-      return (0, 0)
+          return line[17:17+64]
+  except FileNotFoundError:
+    pass
+  return None
+
+#PROGMEM is growing in steps 0,8,24,40,56,... bytes of data resulting in size of 0,16,32,48,64,... bytes
+# returns the bytes available for data, the real PROGMEM size is 8 bytes more
+def progmem_real(size):
+  for real in range(8,size+16,16):
+      if real>=size:
+        return real
+
+def is_stale(source, target, argv=None, dictionary=b''):
+  if argv and '--force' in argv:
+    return True
+  with open(source, "r") as f:
+    text = f.read()
+  if dictionary_sha(dictionary) != target_dictionary_sha(target):
+    return True
+  return sha256(text.encode()).hexdigest() != target_sha(target)
 
+# const char name and content of the C string of an html_uncompressed file
+def parse_html(text):
   #text = Tk().clipboard_get()
   # print(text)
 
@@ -119,9 +156,6 @@ def compress_html(source, target, argv=None, verbose=False):
           # print(text[lastel+1:pos:])
       lastel = pos
 
-  if verbose:
-    print("####### Parsing input from " + str(source.relative_to(base_dir)))
-    print("  Const char name: "+const_name)
   #print('####### Cleaned input:')
   #print(input)
 
@@ -133,33 +167,589 @@ def compress_html(source, target, argv=None, verbose=False):
   input = input.replace("\\b", "\b")
   input = input.replace("\\\"", u"\u0022")
 
+  return (const_name, input)
+
+###############################################################
+# Minifier
+#
+# The strings are fragments: a page is sent as a sequence of them and a
+# fragment may stop in the middle of a <script> or <style>, so nothing is
+# assumed about what comes before or after. Everything is kept as is unless
+# it is known to be safe: string, template and regex literals, printf
+# formats (%s, %d, %%, %06x), <pre> and <textarea> contents, quoted
+# attribute values with spaces or '%'.
+###############################################################
+
+JS_REGEX_KEYWORDS = ('return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void',
+                     'throw', 'case', 'do', 'else', 'yield', 'await')
+JS_EMPTY_BODY_KEYWORDS = ('if', 'while', 'for', 'with')
+HTML_VOID_ELEMENTS = ('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+                      'link', 'meta', 'source', 'track', 'wbr')
+HTML_JS_TYPES = ('', 'text/javascript', 'application/javascript', 'module')
+# boolean attributes, whose value can only be empty or their name
+HTML_BOOLEAN_ATTRIBUTES = ('allowfullscreen', 'async', 'autofocus', 'autoplay', 'checked', 'controls',
+                           'default', 'defer', 'disabled', 'formnovalidate', 'hidden', 'inert', 'ismap',
+                           'loop', 'multiple', 'muted', 'nomodule', 'novalidate', 'open', 'readonly',
+                           'required', 'reversed', 'selected')
+
+# 'html', 'js', 'css' or 'text' from the const char name and the content
+def content_type(const_name, text):
+  if text.lstrip().startswith('<'):
+    return 'html'
+  if 'SCRIPT' in const_name:
+    return 'js'
+  if 'STYLE' in const_name:
+    return 'css'
+  return 'text'
+
+# literals are replaced by a private use character while the text is
+# rewritten, then put back
+def protect(text, pattern, literals):
+  def placeholder(m):
+    literals.append(m.group(0))
+    return chr(0xE000 + len(literals) - 1)
+  return re.sub(pattern, placeholder, text)
+
+def restore(text, literals):
+  return re.sub('[\ue000-\uf8ff]', lambda m: literals[ord(m.group(0)) - 0xE000], text)
+
+def js_tokens(text):
+  tokens = []
+  i = 0
+  n = len(text)
+  while i < n:
+    c = text[i]
+    if c.isspace():
+      j = i
+      while j < n and text[j].isspace(): j += 1
+      tokens.append(('ws', '\n' if '\n' in text[i:j] else ' '))
+    elif text.startswith('//', i):
+      j = text.find('\n', i)
+      j = n if j < 0 else j
+      tokens.append(('ws', ' '))
+    elif text.startswith('/*', i):
+      j = text.find('*/', i + 2)
+      j = n if j < 0 else j + 2
+      tokens.append(('ws', '\n' if '\n' in text[i:j] else ' '))
+    elif c in '\'"`' or (c == '/' and js_regex_allowed(tokens)):
+      j = i + 1
+      in_class = False
+      while j < n and (text[j] != c or in_class):
+        if text[j] == '\\':
+          j += 1
+        elif c == '/' and text[j] in '[]':
+          in_class = text[j] == '['
+        elif c == '/' and text[j] == '\n':
+          break
+        j += 1
+      j += 1
+      if c == '/':
+        while j < n and (text[j].isalnum()): j += 1   # flags
+      tokens.append(('literal', text[i:j]))
+    elif c.isalnum() or c in '_$%\\.':
+      j = i
+      while j < n and (text[j].isalnum() or text[j] in '_$%\\.'): j += 1
+      tokens.append(('word', text[i:j]))
+    else:
+      j = i + 1
+      tokens.append(('punct', c))
+    if len(tokens) > 1 and tokens[-1][0] == tokens[-2][0] == 'ws':
+      tokens[-2:] = [('ws', '\n' if '\n' in tokens[-2][1] + tokens[-1][1] else ' ')]
+    i = j
+  return tokens
+
+def js_regex_allowed(tokens):
+  for (kind, value) in reversed(tokens):
+    if kind == 'ws':
+      continue
+    if kind == 'punct':
+      return value not in ')]'
+    if kind == 'word':
+      return value in JS_REGEX_KEYWORDS
+    return False
+  return True
+
+# true if a space or newline between a and b can be dropped
+def js_space_needed(a, b):
+  word = lambda c: c.isalnum() or c in '_$%\\.'
+  if word(a[-1]) and word(b[0]):
+    return True
+  return (a[-1] + b[0]) in ('++', '--', '//', '/*', '<!', '->')
+
+# a ';' before '}' is dropped unless it is an empty statement: if(x);}
+def js_empty_statement(tokens, k):
+  prev = [ t for t in tokens[:k] if t[0] != 'ws' ]
+  if not prev:
+    return True
+  (kind, value) = prev[-1]
+  if kind == 'word':
+    return value in ('else', 'do')
+  if value == ':':
+    return True
+  if value != ')':
+    return False
+  depth = 0
+  for i in range(len(prev) - 1, -1, -1):
+    if prev[i] == ('punct', ')'):
+      depth += 1
+    elif prev[i] == ('punct', '('):
+      depth -= 1
+      if depth == 0:
+        return i > 0 and prev[i - 1][0] == 'word' and prev[i - 1][1] in JS_EMPTY_BODY_KEYWORDS
+  return True
+
+def minify_js(text):
+  (text, rest) = split_element_end(text, 'script')
+  tokens = js_tokens(text)
+  out = []
+  for k, (kind, value) in enumerate(tokens):
+    if kind == 'ws':
+      prev = tokens[k - 1][1] if k > 0 else None
+      next = tokens[k + 1][1] if k + 1 < len(tokens) else None
+      if prev is None or next is None:
+        out.append(value)               # keep the edges of the fragment
+      elif js_space_needed(prev, next):
+        out.append(value)
+      elif value == '\n' and prev[-1] not in '{(,;[' and next[0] not in ')]};,':
+        out.append(value)               # automatic semicolon insertion
+      continue
+    if value == ';':
+      next = [ t for t in tokens[k + 1:k + 3] if t[0] != 'ws' ][:1]
+      if next == [('punct', '}')] and not js_empty_statement(tokens, k):
+        continue
+    out.append(value)
+  return ''.join(out) + (minify_html(rest) if rest else '')
+
+def minify_css(text):
+  (text, rest) = split_element_end(text, 'style')
+  literals = []
+  text = protect(text, r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|url\([^)]*\)', literals)
+  text = re.sub(r'/\*.*?\*/', ' ', text, flags=re.S)
+  text = re.sub(r'\s+', ' ', text)
+  text = re.sub(r' ?([{};,>]) ?', r'\1', text)
+  text = re.sub(r';+(?=})', '', text)
+  text = re.sub(r'(?<![\w.#%])0\.(\d)', r'.\1', text)
+  return restore(text, literals) + (minify_html(rest) if rest else '')
+
+# declarations of a style attribute
+def minify_style_attribute(text):
+  text = minify_css(text)
+  return text[:-1] if text.endswith(';') else text
+
+# the text up to the end tag of `element` and the rest
+def split_element_end(text, element):
+  m = re.search(r'</' + element + r'\b', text, flags=re.I)
+  if m is None:
+    return (text, '')
+  return (text[:m.start()], text[m.start():])
+
+def minify_tag(m):
+  tag = m.group(0)
+  name = m.group(1).lower()
+  attrs = re.findall(r'\s*([^\s=/>]+)(?:\s*=\s*(\'[^\']*\'|"[^"]*"|[^\s>]+))?', m.group(2))
+  if m.group(3) == '/':
+    if name not in HTML_VOID_ELEMENTS:
+      return tag        # SVG or MathML, keep the quotes away from '/>'
+    if attrs and attrs[-1][1] and attrs[-1][1][0] not in '\'"':
+      return tag        # the '/' of <img src=a/> is part of the value
+  out = '<' + m.group(1)
+  for (attr, value) in attrs:
+    if value and value[0] in '\'"':
+      (quote, value) = (value[0], value[1:-1])
+      if attr.lower() == 'style':
+        value = minify_style_attribute(value)
+      if (name, attr.lower(), value.lower()) in (('script', 'type', 'text/javascript'), ('style', 'type', 'text/css')):
+        continue
+      if attr in HTML_BOOLEAN_ATTRIBUTES and value == attr:     # checked='checked'
+        value = None
+      elif not re.fullmatch(r'[\w.:#-]+(?:/[\w.:#-]+)*', value):
+        value = quote + value + quote
+    out += ' ' + attr + ('=' + value if value else '')
+  return out + '>'
+
+def minify_html(text):
+  literals = []
+  # the content of elements that are minified separately or kept as is
+  def element(m):
+    (start, name, body) = (m.group(1), m.group(2).lower(), m.group(3))
+    if name == 'script':
+      t = re.search(r'\stype\s*=\s*[\'"]?([^\'"\s>]*)', start)
+      if (t.group(1).lower() if t else '') in HTML_JS_TYPES:
+        body = minify_js(body)
+    elif name == 'style':
+      body = minify_css(body)
+    literals.append(body)
+    return start + chr(0xE000 + len(literals) - 1)
+  text = re.sub(r'(<(script|style|pre|textarea)\b[^>]*>)(.*?)(?=</\2\b|$)', element, text, flags=re.S | re.I)
+  text = re.sub(r'<!--(?!\[if).*?-->', '', text, flags=re.S)
+  text = re.sub(r'<([A-Za-z][\w-]*)((?:[^>\'"]|\'[^\']*\'|"[^"]*")*?)\s*(/?)>', minify_tag, text)
+  # whitespace between tags, not in attribute values
+  text = re.sub(r'(<(?:[^>\'"]|\'[^\']*\'|"[^"]*")*>)|[ \t\r\n\f]+', lambda m: m.group(1) or ' ', text)
+  return restore(text, literals)
+
+MINIFIERS = { 'html': minify_html, 'js': minify_js, 'css': minify_css, 'text': lambda text: text }
+
+# content type and minified text of a C string, the text is kept as is if it
+# already holds private use characters
+def minify(const_name, text):
+  kind = content_type(const_name, text)
+  if re.search('[\ue000-\uf8ff]', text):
+    return (kind, text)
+  return (kind, MINIFIERS[kind](text))
+
+###############################################################
+# gzip variants
+#
+# A string that is a whole response can be kept gzipped in PROGMEM and sent
+# as is with 'Content-Encoding: gzip': the browser inflates it, the device
+# does no decoding and sends fewer bytes over Wi-Fi. Most strings are
+# fragments sent in the middle of a chunked page (HTTP_HEAD_STYLE1...) or
+# printf formats, they cannot be sent gzipped on their own and get no
+# variant.
+###############################################################
+
+pio_dir = Path(base_dir, 'pio-tools')
+
+# (True, level) if the gzip variants are asked for with --gzip or
+# --gzip=LEVEL, level None is the default of tasmotapiolib.compress()
+def gzip_option(argv):
+  for arg in argv:
+    if arg == '--gzip':
+      return (True, None)
+    if arg.startswith('--gzip='):
+      return (True, int(arg[7:]))
+  return (False, None)
+
+# the text sent for a format string without arguments, None if it takes some
+def printf_text(text):
+  if re.search(r'%[-+ #0-9.]*[a-zA-Z]', text.replace('%%', '')):
+    return None
+  return text.replace('%%', '%')
+
+# the text sent for a string that is a complete html document without printf
+# arguments, None for a page fragment or a format taking arguments
+def complete_response(text):
+  served = printf_text(text)
+  if served is None:
+    return None
+  page = served.strip().lower()
+  if not (page.startswith('<!doctype html') or page.startswith('<html')) or not page.endswith('</html>'):
+    return None
+  return served
+
+def gzip_asset(data, level=None):
+  if str(pio_dir) not in sys.path:
+    sys.path.append(str(pio_dir))
+  import tasmotapiolib
+  if level is None:
+    return tasmotapiolib.compress(data)
+  return tasmotapiolib.compress(data, level)
+
+def c_byte_array(name, data):
+  lines = [ ",".join(f"0x{b:02X}" for b in data[i:i + 20]) for i in range(0, len(data), 20) ]
+  return f"const uint8_t {name}[] PROGMEM = {{\n  " + ",\n  ".join(lines) + "\n};"
+
+# PROGMEM size, bytes sent over Wi-Fi and bytes decoded by the device for
+# each way of storing an asset
+def asset_report(rows):
+  ostr = f"  {'option':<10} {'PROGMEM':>8} {'sent':>6} {'decoded':>8}\n"
+  for (option, progmem, sent, decoded) in rows:
+    ostr += f"  {option:<10} {progmem:8d} {sent:6d} {decoded:8d}\n"
+  return ostr
+
+###############################################################
+# Codec decision
+#
+# With --auto each string is stored the cheapest way: raw or Unishox. A codec
+# is chosen if its score, the PROGMEM bytes it saves minus --decode-weight
+# bytes per ms the host Unishox decoder needs for the string (rounded, see
+# decode_bucket()), is at least --min-saving bytes. gzip is only reported:
+# the firmware sends the strings with WSContentSend_P() and no code serves
+# a _GZ array, so the text definition is always kept. The decision is
+# recorded in the compressed file, see target_codec().
+###############################################################
+
+# option --name=value of argv as a number, `default` if it is not there
+def numeric_option(argv, name, default):
+  for arg in argv:
+    if arg.startswith(name + '='):
+      return type(default)(arg[len(name) + 1:])
+  return default
+
+# best time in us of the host Unishox decoder for a compressed string
+def decode_time(codec, data, size, dictionary=b'', repeat=5):
+  out = bytearray(size + 16)
+  best = None
+  for i in range(repeat):
+    start = perf_counter()
+    codec.decompress(data, len(data), out, len(out), dictionary)
+    t = (perf_counter() - start) * 1e6
+    best = t if best is None else min(best, t)
+  return best
+
+# `us` rounded up to the 1, 2, 5, 10, 20... series: the time is recorded in
+# the compressed file, which must not change with the noise of the host
+def decode_bucket(us):
+  step = 1
+  while True:
+    for m in (1, 2, 5):
+      if us <= step * m:
+        return step * m
+    step *= 10
+
+# `progmem` maps the codecs that can be used to their real PROGMEM size,
+# `decode_us` to their decode time on the device side
+def choose_codec(progmem, decode_us, min_saving=16, bytes_per_ms=0.0):
+  (best, best_score) = ('raw', 0.0)
+  for codec in ('unishox', 'gzip'):
+    if codec not in progmem:
+      continue
+    score = progmem['raw'] - progmem[codec] - bytes_per_ms * decode_us.get(codec, 0.0) / 1000
+    if score >= min_saving and score > best_score:
+      (best, best_score) = (codec, score)
+  return best
+
+# decision recorded in a compressed file by --auto, None if there is none
+def target_codec(target):
+  try:
+    with open(target, "r") as f:
+      for line in f:
+        if line.startswith('// codec: '):
+          return json.loads(line[10:])
+  except FileNotFoundError:
+    pass
+  return None
+
+def decision_summary(files):
+  ostr = f"  {'const char name':<28} {'raw':>5} {'unishox':>7} {'gzip':>5} {'decode us':>9}  codec\n"
+  (total_raw, total) = (0, 0)
+  for (source, target) in files:
+    d = target_codec(target)
+    if d is None:
+      ostr += f"  {source.stem:<28} no decision, compress with --auto --force\n"
+      continue
+    p = d["progmem"]
+    gz = str(p["gzip"]) if "gzip" in p else "-"
+    ostr += f"  {d['name']:<28} {p['raw']:5d} {p['unishox']:7d} {gz:>5} {d['decode_us']:9.0f}  {d['codec']}\n"
+    total_raw += p["raw"]
+    total += p[d["codec"]]
+  ostr += f"  PROGMEM {total} bytes instead of {total_raw} raw\n"
+  return ostr
+
+# C string of `text` (str or bytes) in lines of up to 100 bytes, non ASCII
+# bytes in octal
+def c_string(const_name, text):
+  data = text.encode('utf-8') if isinstance(text, str) else text
+  escapes = { ord('\\'): '\\\\', ord('"'): '\\"', ord('\n'): '\\n', ord('\r'): '\\r', ord('\t'): '\\t' }
+  def escape(b):
+    if b in escapes:
+      return escapes[b]
+    if b < 0x20 or b >= 0x7F:
+      return f"\\{b:03o}"
+    return chr(b)
+  lines = [ '"' + ''.join(escape(b) for b in data[i:i + 100]) + '"' for i in range(0, len(data), 100) ] or ['""']
+  return f"const char {const_name}[] PROGMEM =\n  " + "\n  ".join(lines) + ";"
+
+# const char name, content type, text to compress and size before
+# minification of an html_uncompressed file
+def prepare(text, argv):
+  (const_name, input) = parse_html(text)
+  raw_len = len(input.encode('utf-8'))
+  kind = content_type(const_name, input)
+  if not ('--no-minify' in argv):
+    (kind, input) = minify(const_name, input)
+  return (const_name, kind, input, raw_len)
+
+###############################################################
+# Shared dictionary
+#
+# With --dict[=BYTES] the strings are compressed with a dictionary of the
+# substrings they share, stored once in HTTP_DICTIONARY.h. The decoder sees
+# it as output before the first byte, so DICT codes reference it like
+# earlier output (see Unishox::unishox_decompress()).
+#
+# The dictionary is made of segments chosen like the COVER algorithm of
+# zstd: the segment whose d-mers are shared by the most const char names
+# first, its d-mers are then not counted again. The number of segments
+# kept is the one giving the smallest PROGMEM for the strings and the
+# dictionary, the most shared segments are put last, closest to the strings.
+###############################################################
+
+DICT_NAME = 'HTTP_DICTIONARY'
+DICT_SEGMENT = 64
+DICT_DMER = 6
+
+# the dictionary size asked with --dict or --dict=BYTES, None without
+# (0 with --dict=0)
+def dict_option(argv):
+  for arg in argv:
+    if arg == '--dict':
+      return 1024
+    if arg.startswith('--dict='):
+      return int(arg[7:])
+  return None
+
+# `pages` is a list of (const char name, bytes), alternatives of the same
+# string share a name and count as one
+def dictionary_segments(pages, max_size, seg=DICT_SEGMENT, d=DICT_DMER):
+  owners = {}
+  for (name, data) in pages:
+    for j in range(len(data) - d + 1):
+      owners.setdefault(data[j:j + d], set()).add(name)
+  freq = { k: len(v) for k, v in owners.items() if len(v) > 1 }
+  segments = []
+  size = 0
+  while size < max_size:
+    (best, best_score) = (None, 0)
+    for (name, data) in pages:
+      acc = [0]
+      for j in range(len(data) - d + 1):
+        acc.append(acc[-1] + freq.get(data[j:j + d], 0))
+      w = min(seg, len(data)) - d + 1
+      for j in range(len(acc) - w):
+        if acc[j + w] - acc[j] > best_score:
+          (best, best_score) = (data[j:j + w + d - 1], acc[j + w] - acc[j])
+    if best is None:
+      break
+    best = best[:max_size - size]
+    for j in range(len(best) - d + 1):
+      freq.pop(best[j:j + d], None)
+    segments.append(best)
+    size += len(best)
+  return segments
+
+# PROGMEM of the compressed strings
+def pages_progmem(codec, pages, dictionary):
+  total = 0
+  for (name, data) in pages:
+    out = bytearray(len(data) * 2 + 16)
+    total += progmem_real(codec.compress(data, len(data), out, len(out), dictionary)) + 8
+  return total
+
+# returns the dictionary, the PROGMEM of the strings without it and with it
+def build_dictionary(pages, max_size):
+  codec = unishox.Unishox()     # the greedy parse is enough to compare
+  without = pages_progmem(codec, pages, b'')
+  (best, best_total) = (b'', without)
+  segments = dictionary_segments(pages, max_size)
+  for k in range(1, len(segments) + 1):
+    dictionary = b''.join(reversed(segments[:k]))
+    total = pages_progmem(codec, pages, dictionary) + progmem_real(len(dictionary)) + 8
+    if total < best_total:
+      (best, best_total) = (dictionary, total)
+  return (best, without, best_total - (progmem_real(len(best)) + 8 if best else 0))
+
+def dictionary_sha(dictionary):
+  return sha256(dictionary).hexdigest() if dictionary else None
+
+# sha256 of the dictionary a compressed file was made with, None if there is none
+def target_dictionary_sha(target):
+  try:
+    with open(target, "r") as f:
+      for line in f:
+        if line.startswith('// dictionary sha256: '):
+          return line[22:22+64]
+  except FileNotFoundError:
+    pass
+  return None
+
+# dictionary of a HTTP_DICTIONARY.h written by dictionary_header(), b'' if
+# there is none or it does not match its sha256
+def stored_dictionary(dict_target):
+  try:
+    header = dict_target.read_text()
+  except FileNotFoundError:
+    return b''
+  strings = re.findall(r'"((?:[^"\\]|\\.)*)"', header.split('PROGMEM =', 1)[-1])
+  dictionary = ''.join(strings).encode('latin-1').decode('unicode_escape').encode('latin-1')
+  if dictionary_sha(dictionary) != target_dictionary_sha(dict_target):
+    return b''
+  return dictionary
+
+def dictionary_header(dictionary):
+  ostr  = "/////////////////////////////////////////////////////////////////////\n"
+  ostr += "// shared dictionary of the compressed strings\n"
+  ostr += "// made by tools/unishox/compress-html-uncompressed.py --dict\n"
+  ostr += f"// dictionary sha256: {dictionary_sha(dictionary)}\n"
+  ostr += "/////////////////////////////////////////////////////////////////////\n"
+  ostr += f"#ifndef {DICT_NAME}_H\n#define {DICT_NAME}_H\n\n"
+  ostr += f"const size_t {DICT_NAME}_SIZE = {len(dictionary)};\n"
+  ostr += c_string(DICT_NAME, dictionary) + "\n\n"
+  ostr += f"#endif  // {DICT_NAME}_H\n"
+  return ostr
+
+def compress_html(source, target, argv=None, verbose=False, dictionary=b''):
+  if argv is None: argv = []
+
+  with open(source, "r") as f:
+    text = f.read()
+
+  src_sha = sha256(text.encode()).hexdigest()
+
+  if not ('--force' in argv):
+    old_sha = target_sha(target)
+
+    if src_sha == old_sha:
+      return (0, 0)
+
+  (const_name, kind, input, raw_len) = prepare(text, argv)
+
+  if verbose:
+    print("####### Parsing input from " + str(source.relative_to(base_dir)))
+    print("  Const char name: "+const_name+" ("+kind+")")
+
   in_bytes = bytearray(input, 'utf-8')
   in_len = len(in_bytes)
   out_bytes = bytearray(in_len * 2)
 
-  UNISHOX = unishox.Unishox()
-  out_len = UNISHOX.compress(in_bytes, len(in_bytes), out_bytes, len(out_bytes))
+  UNISHOX = unishox.Unishox(optimal='--optimal' in argv)
+  out_len = UNISHOX.compress(in_bytes, len(in_bytes), out_bytes, len(out_bytes), dictionary)
   if verbose:
     print("  ####### Compression result:")
+    reduction = 100-(float(in_len)/float(raw_len)*100)
+    print(f"  Minified from {raw_len} to {in_len}, -{reduction:.1f}%")
     reduction = 100-(float(out_len)/float(in_len)*100)
     print(f"  Compressed from {in_len} to {out_len}, -{reduction:.1f}%")
   out_bytes = out_bytes[:out_len]     # truncate to right size
 
-  #PROGMEM is growing in steps 0,8,24,40,56,... bytes of data resulting in size of 0,16,32,48,64,... bytes
-  for in_real in range(8,in_len+16,16):
-      if in_real>=in_len:
-        if verbose:
-          print(f"  Old real PROGMEM-size:{in_real+8}(unused bytes:{in_real-in_len})")
-        break
-  for out_real in range(8,out_len+16,16):
-      if out_real>=out_len:
-        if verbose:
-          print(f"  New real PROGMEM-size:{out_real+8}(unused bytes:{out_real-out_len})")
-        break
+  in_real = progmem_real(raw_len)     # html_uncompressed is not minified
+  out_real = progmem_real(out_len)
+  if verbose:
+    print(f"  Old real PROGMEM-size:{in_real+8}(unused bytes:{in_real-raw_len})")
+    print(f"  New real PROGMEM-size:{out_real+8}(unused bytes:{out_real-out_len})")
 
   if verbose:
     print(f"  the optimal case would be raw bytes + 8, real difference: {in_real - out_real}bytes")
 
+  (gzip, gzip_level) = gzip_option(argv)
+  auto = '--auto' in argv
+  served = complete_response(input) if gzip or auto else None
+  if served is not None:
+    gz_bytes = gzip_asset(served.encode('utf-8'), gzip_level)
+    gz_len = len(gz_bytes)
+  if verbose and (gzip or auto):
+    rows = [ ("raw", in_real+8, raw_len, 0), ("unishox", out_real+8, in_len, in_len) ]
+    if served is not None:
+      rows.append(("gzip", progmem_real(gz_len)+8, gz_len, 0))
+    else:
+      print("  no gzip variant, the string is a page fragment or a printf format with arguments")
+    print(asset_report(rows), end="")
+
+  codec = 'unishox'
+  if auto:
+    progmem = { 'raw': progmem_real(in_len)+8, 'unishox': out_real+8 }
+    if served is not None:
+      progmem['gzip'] = progmem_real(gz_len)+8
+    decision = { 'name': const_name, 'progmem': progmem,
+                 'decode_us': decode_bucket(decode_time(UNISHOX, out_bytes, in_len, dictionary)) }
+    progmem = { k: v for k, v in progmem.items() if k != 'gzip' }   # the firmware needs the text
+    codec = choose_codec(progmem, { 'unishox': decision['decode_us'] },
+                         numeric_option(argv, '--min-saving', 16),
+                         numeric_option(argv, '--decode-weight', 0.0))
+    decision['codec'] = codec
+    if verbose:
+      print(f"  Codec: {codec}")
+
   # https://www.geeksforgeeks.org/break-list-chunks-size-n-python/
   def chunked(my_list, n):
       return [my_list[i * n:(i + 1) * n] for i in range((len(my_list) + n - 1) // n )]
@@ -175,8 +765,16 @@ def compress_html(source, target, argv=None, verbose=False):
   #print(lines)
 
   definition = f"#define  {const_name}       Decompress({const_name}_COMPRESSED,{const_name}_SIZE).c_str()"
+  if dictionary:
+    lines = f'\n#include "{DICT_NAME}.h"\n' + lines
+    definition = f"#define  {const_name}       Decompress({const_name}_COMPRESSED,{const_name}_SIZE,{DICT_NAME},{DICT_NAME}_SIZE).c_str()"
   #print(definition)
 
+  if codec == 'raw':
+    lines = "\n" + c_string(const_name, input) + "\n"
+    definition = ""
+    out_real = progmem_real(in_len)
+
   now = datetime.now() # current date and time
   percent = int((float(out_real)/float(in_real))*100.0)
   saving = in_real - out_real
@@ -185,8 +783,16 @@ def compress_html(source, target, argv=None, verbose=False):
   comment  = "/////////////////////////////////////////////////////////////////////\n"
   comment += "// compressed by tools/unishox/compress-html-uncompressed.py\n"
   comment += f"// input sha256: {src_sha}\n"
+  if auto:
+    comment += f"// codec: {json.dumps(decision)}\n"
+  if dictionary:     # also for raw strings, see is_stale()
+    comment += f"// dictionary sha256: {dictionary_sha(dictionary)}\n"
   comment += "/////////////////////////////////////////////////////////////////////\n"
 
+  if served is not None and gzip:
+    gz_lines = f"\n\nconst size_t {const_name}_GZ_SIZE = {gz_len};    // gzip of {len(served.encode('utf-8'))} bytes, send as is with Content-Encoding: gzip\n"
+    definition += gz_lines + c_byte_array(f"{const_name}_GZ", gz_bytes)
+
   with open(target, "w") as f:
       f.write(comment + lines + definition)
 
@@ -195,14 +801,76 @@ def compress_html(source, target, argv=None, verbose=False):
   if verbose:
     print("####### Wrote output to " + str(target.relative_to(base_dir)))
 
-def compress_dir(source_dir, target_dir, argv=None, verbose=False):
+# compress one file in a worker, returns the result of compress_html(), the
+# time spent and what it printed
+def compress_job(source, target, argv, verbose, dictionary):
+  log = io.StringIO()
+  start = perf_counter()
+  with redirect_stdout(log):
+    result = compress_html(source, target, ['--force'] + argv, verbose, dictionary)   # compress_dir() checked it is stale
+  return result, perf_counter() - start, log.getvalue()
+
+def compress_dir(source_dir, target_dir, argv=None, verbose=False, jobs=None):
+  if argv is None: argv = []
   totalIn, totalSaved = 0, 0
 
-  for source in source_dir.iterdir():
-    target = Path(target_dir, source.stem + ".h")
-    bytesIn, bytesSaved = compress_html(source, target, argv, verbose)
+  files = [(source, Path(target_dir, source.stem + ".h")) for source in sorted(source_dir.iterdir())]
+
+  dict_target = Path(target_dir, DICT_NAME + ".h")
+  dictionary = b''
+  dict_changed = False
+  dict_size = dict_option(argv)
+  if dict_size is None:
+    dictionary = stored_dictionary(dict_target)   # keep the mode of the last --dict run
+  elif dict_size == 0:
+    dict_target.unlink(missing_ok=True)
+  else:
+    pages = []
+    for (source, target) in files:
+      (const_name, kind, input, raw_len) = prepare(source.read_text(), argv)
+      pages.append((const_name, input.encode('utf-8')))
+    (dictionary, without, total) = build_dictionary(pages, dict_size)
+    header = dictionary_header(dictionary)
+    if not dict_target.exists() or dict_target.read_text() != header:
+      with open(dict_target, "w") as f:
+        f.write(header)
+      dict_changed = True
+    if verbose:
+      dict_real = progmem_real(len(dictionary)) + 8
+      print(f"####### Shared dictionary: {len(dictionary)} bytes, PROGMEM {dict_real}")
+      print(f"  PROGMEM of the strings {without} without it, {total} with it, total saving {without - total - dict_real} bytes")
+
+  stale = [(source, target) for (source, target) in files if is_stale(source, target, argv, dictionary)]
+  if verbose:
+    print(f"####### {len(stale)} of {len(files)} files to compress")
+
+  if jobs is None:
+    jobs = os.cpu_count() or 1
+  jobs = min(jobs, len(stale))
+  args = [(source, target, argv, verbose, dictionary) for (source, target) in stale]
+
+  results = None
+  if jobs > 1:
+    try:
+      with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(compress_job, *zip(*args)))
+    except (OSError, BrokenProcessPool):
+      results = None    # no worker processes available, compress here
+  if results is None:
+    results = [compress_job(*a) for a in args]
+
+  for (bytesIn, bytesSaved), elapsed, log in results:
+    if verbose:
+      print(log, end='')
+      print(f"  Compressed in {elapsed * 1000:.0f} ms")
     totalIn += bytesIn
     totalSaved += bytesSaved
+  if dictionary and dict_changed:
+    totalSaved -= progmem_real(len(dictionary)) + 8     # the new HTTP_DICTIONARY.h is in PROGMEM too
+
+  if verbose and '--auto' in argv:
+    print("####### Codec decisions:")
+    print(decision_summary(files), end='')
 
   return (totalIn, totalSaved)
 
@@ -210,7 +878,12 @@ if __name__ == '__main__':
   path_uncompressed = Path(base_dir, 'tasmota', 'html_uncompressed')
   path_compressed   = Path(base_dir, 'tasmota', 'html_compressed')
 
-  totalIn, totalSaved = compress_dir(path_uncompressed, path_compressed, argv, True)
+  jobs = None
+  for arg in argv:
+    if arg.startswith('--jobs='):
+      jobs = int(arg[7:])
+
+  totalIn, totalSaved = compress_dir(path_uncompressed, path_compressed, argv, True, jobs)
 
   if totalSaved > 0:
     print(f"If all files are in use, total saving was {totalSaved} out of {totalIn}")
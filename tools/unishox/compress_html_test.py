@@ -0,0 +1,192 @@
+import re
+import gzip
+import tempfile
+import unittest
+from pathlib import Path
+
+html = __import__('compress-html-uncompressed')
+
+def pages():
+    for source in sorted(Path(html.base_dir, 'tasmota', 'html_uncompressed').iterdir()):
+        yield html.parse_html(source.read_text())
+
+class Test_minify(unittest.TestCase):
+
+    def test_content_type(self):
+        self.assertEqual(html.content_type('HTTP_SCRIPT_ROOT', 'var x;'), 'js')
+        self.assertEqual(html.content_type('HTTP_HEAD_STYLE1', 'div{}'), 'css')
+        self.assertEqual(html.content_type('HTTP_HEAD_STYLE3', '</style><body>'), 'html')
+        self.assertEqual(html.content_type('HTTP_MSG', 'Restart'), 'text')
+
+    def test_js(self):
+        for (text, minified) in [
+            ("if(a) { b(); }", "if(a){b()}"),
+            ("while(i++<3);}", "while(i++<3);}"),
+            ("if(x);else;}", "if(x);else;}"),
+            ("a + +b; c - --d", "a+ +b;c- --d"),
+            ("x / /re/.source", "x/ /re/.source"),
+            ("s.split(/}1/);}", "s.split(/}1/)}"),
+            ("a='x ;} y' ;\"%s\"; // c\n", "a='x ;} y';\"%s\";\n"),
+            ("return\n42}", "return\n42}"),
+            ("1 .toString()", "1 .toString()"),
+            ("f(1);</script><p  class='a'>", "f(1);</script><p class=a>"),
+        ]:
+            self.assertEqual(html.minify_js(text), minified)
+
+    def test_css(self):
+        self.assertEqual(html.minify_css("p { margin : 0.5em -0.25em ; } /* c */ a>b{x:1;;}"), "p{margin : .5em -.25em}a>b{x:1}")
+        self.assertEqual(html.minify_css('a{content:" ; 0.5 }";width:100%%;}'), 'a{content:" ; 0.5 }";width:100%%}')
+        self.assertEqual(html.minify_css("--c_bg:#%06x;}</style><b>"), "--c_bg:#%06x}</style><b>")
+
+    def test_html(self):
+        for (text, minified) in [
+            ("<meta name='viewport' content='width=device-width, initial-scale=1'/>", "<meta name=viewport content='width=device-width, initial-scale=1'>"),
+            ("<html lang=\"%s\" class=\"\">", "<html lang=\"%s\" class=\"\">"),
+            ("<input type='checkbox' checked='checked'>", "<input type=checkbox checked>"),
+            ("<input id='id' name='name' value='value' placeholder='Placeholder'>", "<input id=id name=name value=value placeholder=Placeholder>"),
+            ("<option value='x' selected='Selected'>", "<option value=x selected=Selected>"),
+            ("<img src=a/><svg><path d='M0 0'/></svg>", "<img src=a/><svg><path d='M0 0'/></svg>"),
+            ("<p>a  \n b</p><!-- c --><pre> x  y </pre>", "<p>a b</p><pre> x  y </pre>"),
+            ("<div style='width:100%%;opacity:0.5;'>", "<div style='width:100%%;opacity:.5'>"),
+            ("<script type='text/javascript'>f( 1 );</script>", "<script>f(1);</script>"),
+            ("<script type='text/x-tmpl'> a ; } </script>", "<script type=text/x-tmpl> a ; } </script>"),
+        ]:
+            self.assertEqual(html.minify_html(text), minified)
+
+    def test_pages(self):
+        for (const_name, text) in pages():
+            (kind, minified) = html.minify(const_name, text)
+            self.assertLessEqual(len(minified), len(text))
+            self.assertEqual(html.minify(const_name, minified), (kind, minified))
+            # printf formats are kept
+            self.assertEqual(minified.count('%'), text.count('%'))
+
+class Test_gzip(unittest.TestCase):
+
+    def test_printf_text(self):
+        self.assertEqual(html.printf_text("a{width:100%%}"), "a{width:100%}")
+        self.assertEqual(html.printf_text("a{width:100%;}"), "a{width:100%;}")
+        self.assertIsNone(html.printf_text("<b>%s</b>"))
+        self.assertIsNone(html.printf_text("setTimeout(la,%d)"))
+
+    def test_complete_response(self):
+        self.assertEqual(html.complete_response("<!DOCTYPE html><html><b>100%%</b></html>"), "<!DOCTYPE html><html><b>100%</b></html>")
+        self.assertIsNone(html.complete_response("<style>a{width:100%}</style>"))
+        self.assertIsNone(html.complete_response("<!DOCTYPE html><html><b>%s</b></html>"))
+
+    def test_gzip_variant(self):
+        # HTTP_HEAD_STYLE1 is sent in the middle of a chunked page
+        source = Path(html.base_dir, 'tasmota', 'html_uncompressed', 'HTTP_HEAD_STYLE1.h')
+        with tempfile.TemporaryDirectory() as d:
+            target = Path(d, source.name)
+            html.compress_html(source, target, ['--gzip'])
+            self.assertNotIn('_GZ', target.read_text())
+            source = Path(d, 'HTTP_TEST_PAGE.c')
+            source.write_text('const char HTTP_TEST_PAGE[] PROGMEM =\n'
+                              '  "<!DOCTYPE html><html><head><title>Test</title></head>"\n'
+                              '  "<body><div style=\'width:100%%\'>Tasmota</div></body></html>";\n')
+            (const_name, text) = html.parse_html(source.read_text())
+            target = Path(d, 'HTTP_TEST_PAGE.h')
+            html.compress_html(source, target, ['--gzip'])
+            out = target.read_text()
+        size = int(re.search(const_name + r'_GZ_SIZE = (\d+);', out).group(1))
+        data = bytes(int(b, 16) for b in re.findall(r'0x([0-9A-F]{2})', out.split(const_name + '_GZ[]')[1]))
+        self.assertEqual(len(data), size)
+        self.assertEqual(gzip.decompress(data).decode(), html.complete_response(html.minify(const_name, text)[1]))
+
+class Test_codec(unittest.TestCase):
+
+    def test_choose_codec(self):
+        progmem = { 'raw': 640, 'unishox': 352, 'gzip': 336 }
+        self.assertEqual(html.choose_codec(progmem, { 'unishox': 400 }), 'gzip')
+        self.assertEqual(html.choose_codec({ 'raw': 240, 'unishox': 224 }, {}), 'unishox')
+        self.assertEqual(html.choose_codec({ 'raw': 240, 'unishox': 224 }, {}, min_saving=32), 'raw')
+        # 16 bytes saved are not worth 1 ms of decoding at 20 bytes per ms
+        self.assertEqual(html.choose_codec({ 'raw': 240, 'unishox': 224 }, { 'unishox': 1000 }, 0, 20.0), 'raw')
+
+    def test_decode_bucket(self):
+        self.assertEqual([ html.decode_bucket(us) for us in (0.3, 1, 1.5, 4.9, 7, 10, 11, 180, 2001) ],
+                         [ 1, 1, 2, 5, 10, 10, 20, 200, 5000 ])
+
+    def test_c_string(self):
+        self.assertEqual(html.c_string('S', 'a"b\\c\n\x01'), 'const char S[] PROGMEM =\n  "a\\"b\\\\c\\n\\001";')
+
+    def test_auto(self):
+        source = Path(html.base_dir, 'tasmota', 'html_uncompressed', 'HTTP_HEAD_STYLE3.h')
+        with tempfile.TemporaryDirectory() as d:
+            target = Path(d, source.name)
+            html.compress_html(source, target, ['--auto', '--min-saving=1000'])
+            decision = html.target_codec(target)
+            self.assertEqual(decision['codec'], 'raw')
+            self.assertIn('const char HTTP_HEAD_STYLE3[] PROGMEM =', target.read_text())
+            html.compress_html(source, target, ['--auto', '--force'])
+            decision = html.target_codec(target)
+            self.assertEqual(decision['codec'], 'unishox')
+            self.assertEqual(decision['decode_us'], html.decode_bucket(decision['decode_us']))
+            self.assertIn('Decompress(HTTP_HEAD_STYLE3_COMPRESSED', target.read_text())
+
+    def test_auto_keeps_text(self):
+        source_dir = Path(html.base_dir, 'tasmota', 'html_uncompressed')
+        with tempfile.TemporaryDirectory() as d:
+            html.compress_dir(source_dir, Path(d), ['--auto', '--gzip', '--force'])
+            for source in sorted(source_dir.iterdir()):
+                with self.subTest(source = source.name):
+                    const_name = html.parse_html(source.read_text())[0]
+                    target = Path(d, source.name)
+                    out = target.read_text()
+                    self.assertTrue(f'const char {const_name}[] PROGMEM' in out or f'#define  {const_name} ' in out)
+                    self.assertIn(html.target_codec(target)['codec'], ('raw', 'unishox'))
+
+class Test_dictionary(unittest.TestCase):
+
+    def test_build_dictionary(self):
+        minified = [ (const_name, html.minify(const_name, text)[1].encode('utf-8')) for (const_name, text) in pages() ]
+        (dictionary, without, total) = html.build_dictionary(minified, 512)
+        self.assertTrue(0 < len(dictionary) <= 512)
+        self.assertLess(total + html.progmem_real(len(dictionary)) + 8, without)
+
+    def test_dict_mode(self):
+        source_dir = Path(html.base_dir, 'tasmota', 'html_uncompressed')
+        with tempfile.TemporaryDirectory() as d:
+            (total_in, total_saved) = html.compress_dir(source_dir, Path(d), ['--dict=512'])
+            header = Path(d, 'HTTP_DICTIONARY.h').read_text()
+            size = int(re.search(r'HTTP_DICTIONARY_SIZE = (\d+);', header).group(1))
+            strings = re.findall(r'"((?:[^"\\]|\\.)*)"', header.split('PROGMEM =')[1])
+            dictionary = b''.join(eval('b"' + x + '"') for x in strings)
+            self.assertEqual(len(dictionary), size)
+            sizes = [ int(re.search(r'compressed size (\d+) bytes', t.read_text()).group(1))
+                      for t in Path(d).iterdir() if t.name != 'HTTP_DICTIONARY.h' ]
+            self.assertEqual(total_saved, total_in - sum(html.progmem_real(n) for n in sizes) - (html.progmem_real(size) + 8))
+            # same dictionary, it is not counted again
+            self.assertEqual(html.compress_dir(source_dir, Path(d), ['--dict=512', '--force']),
+                             (total_in, total_in - sum(html.progmem_real(n) for n in sizes)))
+            target = Path(d, 'HTTP_GV_PAGE.h')
+            self.assertIn('#include "HTTP_DICTIONARY.h"', target.read_text())
+            self.assertIn('HTTP_DICTIONARY,HTTP_DICTIONARY_SIZE).c_str()', target.read_text())
+            self.assertEqual(html.target_dictionary_sha(target), html.dictionary_sha(dictionary))
+            self.assertEqual(html.stored_dictionary(Path(d, 'HTTP_DICTIONARY.h')), dictionary)
+            self.assertFalse(html.is_stale(Path(source_dir, 'HTTP_GV_PAGE.h'), target, [], dictionary))
+            # the build runs without --dict and keeps the dictionary
+            html.compress_dir(source_dir, Path(d))
+            self.assertEqual(Path(d, 'HTTP_DICTIONARY.h').read_text(), header)
+            self.assertEqual(html.target_dictionary_sha(target), html.dictionary_sha(dictionary))
+            html.compress_dir(source_dir, Path(d), ['--dict=0'])
+            self.assertFalse(Path(d, 'HTTP_DICTIONARY.h').exists())
+            self.assertNotIn('HTTP_DICTIONARY', target.read_text())
+
+    def test_dict_auto(self):
+        source_dir = Path(html.base_dir, 'tasmota', 'html_uncompressed')
+        with tempfile.TemporaryDirectory() as d:
+            html.compress_dir(source_dir, Path(d), ['--dict=512', '--auto'])
+            target = Path(d, 'HTTP_GV_PAGE.h')
+            self.assertEqual(html.target_codec(target)['codec'], 'unishox')
+            self.assertIn('HTTP_DICTIONARY,HTTP_DICTIONARY_SIZE).c_str()', target.read_text())
+            # raw decisions are kept by the build, which runs without --auto
+            html.compress_dir(source_dir, Path(d), ['--dict=512', '--auto', '--force', '--min-saving=100000'])
+            dictionary = html.stored_dictionary(Path(d, 'HTTP_DICTIONARY.h'))
+            for source in source_dir.iterdir():
+                self.assertEqual(html.target_codec(Path(d, source.name))['codec'], 'raw')
+                self.assertFalse(html.is_stale(source, Path(d, source.name), [], dictionary))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""Benchmark of the Unishox codec on a built-in corpus
+
+The corpus has three groups: the `tasmota/html_uncompressed` pages as
+minified and compressed by compress-html-uncompressed.py, typical Rules,
+and synthetic worst cases. For each group the compression ratio, the real PROGMEM size
+and the compress/decompress throughput are reported.
+
+    python3 unishox_bench.py [-r REPEAT] [--optimal] [--json FILE] [--baseline FILE]
+
+With `--baseline`, the result is compared to a previous `--json` result and
+the exit status is 1 if the compressed size grew or the throughput dropped
+by more than `--tolerance`.
+"""
+import sys
+import json
+import time
+import random
+from pathlib import Path
+from unishox import Unishox
+
+html = __import__('compress-html-uncompressed')
+
+RULES = [
+    b'ON Switch1#State==1 DO Add1 1 ENDON ON Var1#State==0 DO ShutterStop1 ENDON ON Var1#State==1 DO ShutterClose1 ENDON ON Var1#State>=2 DO Var1 0 ENDON ON Shutter1#Close DO Var1 0 ENDON ON Switch2#State==1 DO Add2 1 ENDON ON Var2#State==0 DO ShutterStop1 ENDON ON Var2#State==1 DO ShutterOpen1 ENDON ON Var2#State>=2 DO Var2 0 ENDON ON Shutter1#Open DO Var2 0 ENDON',
+    b'ON System#Boot DO Backlog Var1 0; RuleTimer1 60 ENDON ON Rules#Timer=1 DO Backlog Publish stat/%topic%/RESULT {"Var1":%var1%}; RuleTimer1 60 ENDON',
+    b'ON Power1#State=1 DO Backlog Power2 0; Delay 10; Power3 1 ENDON ON Power1#State=0 DO Power3 0 ENDON ON Tele-AM2301#Temperature>%Mem1% DO Power1 1 ENDON',
+    b'ON Time#Minute|5 DO Backlog WebSend [192.168.1.20] Power TOGGLE; Mem2 %timestamp% ENDON',
+    b'ON Button1#State DO Publish cmnd/other/POWER TOGGLE ENDON',
+    b'ON Wifi#Connected DO Backlog Subscribe BkLight, stat/bedroom/POWER; Power1 %value% ENDON ON Event#BkLight=ON DO Power1 1 ENDON',
+    b'ON Tele-SI7021#Humidity>65 DO Backlog Power1 1; RuleTimer1 600 ENDON ON Rules#Timer=1 DO Power1 0 ENDON',
+    b'ON Analog#A0div10 DO Dimmer %value% ENDON ON Dimmer#State DO Backlog Var1 %value%; Publish2 tele/%topic%/DIMMER %value% ENDON',
+    b'ON Time#Initialized DO Backlog event checktime=%time% ENDON ON Clock#Timer=1 DO event checktime=%time% ENDON ON event#checktime>=%sunset% DO Power1 1 ENDON ON event#checktime<%sunrise% DO Power1 0 ENDON',
+    b'ON ENERGY#Power>2300 DO Backlog Power1 OFF; Publish cmnd/alarm/POWER ON; Delay 300; Power1 ON ENDON',
+]
+
+# inputs stressing the codec: binary, state switches, upper case, runs
+def synthetic(seed = 0, size = 512):
+    rnd = random.Random(seed)
+    items = {}
+    items['random bytes'] = bytes(rnd.getrandbits(8) for _ in range(size))
+    items['alternating digits'] = bytes(rnd.choice(b'abcdef') if i % 2 else rnd.choice(b'0123456789') for i in range(size))
+    items['alternating case'] = bytes(rnd.choice(b'ABCDEF') if i % 2 else rnd.choice(b'abcdef') for i in range(size))
+    items['upper case words'] = b' '.join(bytes(rnd.choice(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(rnd.randint(2, 8))) for _ in range(size // 6))
+    items['punctuation'] = bytes(rnd.choice(b'{}[]<>;:"=%\'&_!\\|~`^*#') for _ in range(size))
+    items['control chars'] = bytes(rnd.choice(b'\t\r\n\x01\x1b') for _ in range(size))
+    items['runs'] = b''.join(bytes([rnd.choice(b' =-#0')]) * rnd.randint(1, 40) for _ in range(size // 20))
+    items['repeats'] = bytes(rnd.choice(b'<div></div>') for _ in range(32)) * (size // 32)
+    return items
+
+def corpus():
+    groups = {}
+    pages = {}
+    for source in sorted(Path(html.base_dir, 'tasmota', 'html_uncompressed').iterdir()):
+        (const_name, text) = html.parse_html(source.read_text())
+        (kind, text) = html.minify(const_name, text)
+        pages[source.stem] = text.encode('utf-8')     # several files define HTTP_SCRIPT_ROOT
+    groups['html'] = pages
+    groups['rules'] = { f"rule {i + 1}": r for i, r in enumerate(RULES) }
+    groups['synthetic'] = synthetic()
+    return groups
+
+# best time of `repeat` calls of f()
+def best_time(f, repeat):
+    best = None
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        f()
+        t = time.perf_counter() - t0
+        best = t if best is None else min(best, t)
+    return best
+
+def bench_group(codec, items, repeat):
+    compressed = {}
+    def compress_all():
+        for name, data in items.items():
+            out = bytearray(len(data) * 2 + 16)
+            n = codec.compress(data, len(data), out, len(out))
+            compressed[name] = bytes(out[:n])
+    def decompress_all():
+        for name, data in items.items():
+            out = bytearray(len(data) + 16)
+            codec.decompress(compressed[name], len(compressed[name]), out, len(out))
+    t_comp = best_time(compress_all, repeat)
+    t_dec = best_time(decompress_all, repeat)
+
+    entries = []
+    for name, data in items.items():
+        out = bytearray(len(data) + 16)
+        n = codec.decompress(compressed[name], len(compressed[name]), out, len(out))
+        size = len(compressed[name])
+        entries.append({
+            "name": name,
+            "input": len(data),
+            "compressed": size,
+            "progmem_input": html.progmem_real(len(data)) + 8,
+            "progmem_compressed": html.progmem_real(size) + 8,
+            "roundtrip": bytes(out[:n]) == data,
+        })
+    total_in = sum(e["input"] for e in entries)
+    total_out = sum(e["compressed"] for e in entries)
+    return {
+        "input": total_in,
+        "compressed": total_out,
+        "ratio": total_out / total_in if total_in else 0.0,
+        "progmem_input": sum(e["progmem_input"] for e in entries),
+        "progmem_compressed": sum(e["progmem_compressed"] for e in entries),
+        "compress_mbps": total_in / t_comp / 1e6 if t_comp else 0.0,
+        "decompress_mbps": total_in / t_dec / 1e6 if t_dec else 0.0,
+        "roundtrip_errors": [ e["name"] for e in entries if not e["roundtrip"] ],
+        "items": entries,
+    }
+
+def bench(repeat = 3, optimal = False):
+    codec = Unishox(optimal = optimal)
+    groups = { g: bench_group(codec, items, repeat) for g, items in corpus().items() }
+    return { "optimal": optimal, "repeat": repeat, "groups": groups }
+
+def tostring(result):
+    ostr = f"unishox: {'optimal' if result['optimal'] else 'greedy'} parse, best of {result['repeat']}\n"
+    ostr += f"    {'group':<10} {'input':>7} {'output':>7} {'ratio':>6} {'PROGMEM':>15} {'comp MB/s':>10} {'dec MB/s':>9}\n"
+    for g, r in result["groups"].items():
+        progmem = f"{r['progmem_input']}->{r['progmem_compressed']}"
+        ostr += f"    {g:<10} {r['input']:7d} {r['compressed']:7d} {r['ratio']:6.3f} {progmem:>15} {r['compress_mbps']:10.3f} {r['decompress_mbps']:9.3f}\n"
+        for name in r["roundtrip_errors"]:
+            ostr += f"    ROUNDTRIP ERROR: {g} {name}\n"
+    return ostr
+
+# compare to a baseline, return the report and the list of regressions
+def compare(result, baseline, tolerance):
+    ostr = f"    {'group':<10} {'metric':<18} {'baseline':>10} {'current':>10}  change\n"
+    regressed = []
+    for g, r in result["groups"].items():
+        base = baseline.get("groups", {}).get(g)
+        if base is None:
+            continue
+        for (metric, higher_is_better) in [ ("compressed", False), ("progmem_compressed", False),
+                                            ("compress_mbps", True), ("decompress_mbps", True) ]:
+            (b, c) = (base[metric], r[metric])
+            change = (c - b) / b * 100 if b else 0.0
+            flag = ""
+            if higher_is_better:
+                worse = c < b * (1 - tolerance)
+            else:
+                worse = c > b               # any byte counts
+            if worse:
+                flag = "  REGRESSION"
+                regressed.append(f"{g} {metric}")
+            ostr += f"    {g:<10} {metric:<18} {b:10.3f} {c:10.3f}  {change:+6.1f}%{flag}\n"
+    return (ostr, regressed)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='benchmark the Unishox codec')
+    parser.add_argument("-r", "--repeat", type=int, default=3, help='number of runs, the fastest is reported (default 3)')
+    parser.add_argument("--optimal", action='store_true', help='benchmark the optimal parse')
+    parser.add_argument("--json", help='write the result to this file')
+    parser.add_argument("--baseline", help='compare to the result of a previous --json run')
+    parser.add_argument("--tolerance", type=float, default=0.10, help='relative throughput drop reported as a regression (default 0.10)')
+    args = parser.parse_args()
+
+    result = bench(args.repeat, args.optimal)
+    print(tostring(result), end="")
+    failed = any(r["roundtrip_errors"] for r in result["groups"].values())
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+            f.write("\n")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        (report, regressed) = compare(result, baseline, args.tolerance)
+        print("compared to " + args.baseline + ":")
+        print(report, end="")
+        if regressed:
+            print("regressed: " + ", ".join(regressed))
+            failed = True
+    if failed:
+        sys.exit(1)
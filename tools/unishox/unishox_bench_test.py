@@ -0,0 +1,14 @@
+import unittest
+from pathlib import Path
+import unishox_bench
+
+class Test_unishox_bench(unittest.TestCase):
+
+    def test_corpus(self):
+        # one entry per page, several files define the same const char name
+        sources = sorted(Path(unishox_bench.html.base_dir, 'tasmota', 'html_uncompressed').iterdir())
+        pages = unishox_bench.corpus()['html']
+        self.assertEqual(list(pages), [ source.stem for source in sources ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import hashlib
+import random
+import unittest
+from pathlib import Path
+from unishox import Unishox
+
+base_dir = Path(__file__).absolute().parent.parent.parent
+
+RULES = [
+    b'ON Switch1#State==1 DO Add1 1 ENDON ON Var1#State==0 DO ShutterStop1 ENDON ON Var1#State==1 DO ShutterClose1 ENDON ON Var1#State>=2 DO Var1 0 ENDON ON Shutter1#Close DO Var1 0 ENDON ON Switch2#State==1 DO Add2 1 ENDON ON Var2#State==0 DO ShutterStop1 ENDON ON Var2#State==1 DO ShutterOpen1 ENDON ON Var2#State>=2 DO Var2 0 ENDON ON Shutter1#Open DO Var2 0 ENDON',
+    b'ON System#Boot DO Backlog Var1 0; RuleTimer1 60 ENDON ON Rules#Timer=1 DO Backlog Publish stat/%topic%/RESULT {"Var1":%var1%}; RuleTimer1 60 ENDON',
+    b'ON Power1#State=1 DO Backlog Power2 0; Delay 10; Power3 1 ENDON ON Power1#State=0 DO Power3 0 ENDON ON Tele-AM2301#Temperature>%Mem1% DO Power1 1 ENDON',
+    b'ON Time#Minute|5 DO Backlog WebSend [192.168.1.20] Power TOGGLE; Mem2 %timestamp% ENDON',
+    b'ON Button1#State DO Publish cmnd/other/POWER TOGGLE ENDON',
+]
+
+# sha256 of the compressed RULES and synthetic() inputs, as output by the
+# original bit by bit encoder
+DIGEST = '34efdf8f2ef31af5543cc16513f9e0404f75c41e37549ce09e4a43756c470608'
+
+def synthetic(seed = 0, count = 20, alphabets = None):
+    rnd = random.Random(seed)
+    items = []
+    for alpha in alphabets or [ b'ab', b'abc ', b'ON Var1#State==1 DO ', bytes(range(256)), b'aaaaab' ]:
+        for i in range(count):
+            items.append(bytes(rnd.choice(alpha) for _ in range(rnd.randint(0, 300))))
+    return items
+
+def corpus():
+    items = list(RULES)
+    for f in sorted(Path(base_dir, 'tasmota', 'html_uncompressed').iterdir()):
+        items.append(f.read_bytes())
+    return items + synthetic()
+
+# bit by bit reference of packBits()
+def pack_bits(codes):
+    bits = ''.join(format(value, '0%db' % n) for (value, n) in codes)
+    out = bytearray()
+    for i in range(0, len(bits) - 7, 8):
+        b = int(bits[i:i + 8], 2)
+        out += bytes([0x2A, b + 1]) if b in (0x00, 0x2A) else bytes([b])
+    return bytes(out), len(bits) % 8
+
+class UnishoxScan(Unishox):
+    """Match finder of the original code, scanning the whole prefix backwards"""
+
+    def findMatch(self, inn, len_, l_, index):
+        longest_dist = 0
+        longest_len = 0
+        j = l_ - self.NICE_LEN
+        while j >= 0:
+            k = l_
+            while k < len_ and j + k - l_ < l_:
+                if inn[k] != inn[j + k - l_]:
+                    break
+                k += 1
+            if k - l_ > self.NICE_LEN - 1:
+                match_len = k - l_ - self.NICE_LEN
+                match_dist = l_ - j - self.NICE_LEN + 1
+                if match_len > longest_len:
+                    longest_len = match_len
+                    longest_dist = match_dist
+            j -= 1
+        return longest_len, longest_dist
+
+def compress(codec, data, dictionary = b''):
+    out = bytearray(len(data) * 2 + 16)
+    n = codec.compress(data, len(data), out, len(out), dictionary)
+    return bytes(out[:n])
+
+def decompress(codec, data, size, dictionary = b''):
+    out = bytearray(size + 16)
+    n = codec.decompress(data, len(data), out, len(out), dictionary)
+    return bytes(out[:n])
+
+class Test_unishox(unittest.TestCase):
+
+    def test_roundtrip(self):
+        codec = Unishox()
+        for data in corpus():
+            self.assertEqual(decompress(codec, compress(codec, data), len(data)), data)
+
+    def test_match_finder(self):
+        codec = Unishox()
+        ref = UnishoxScan()
+        for data in corpus():
+            self.assertEqual(compress(codec, data), compress(ref, data))
+
+    def test_output(self):
+        codec = Unishox()
+        h = hashlib.sha256()
+        for data in RULES + synthetic():
+            h.update(compress(codec, data))
+        self.assertEqual(h.hexdigest(), DIGEST)
+
+    def test_pack_bits(self):
+        codec = Unishox()
+        rnd = random.Random(1)
+        for i in range(200):
+            codes = []
+            for j in range(rnd.randint(0, 50)):
+                n = rnd.randint(1, 16)
+                value = rnd.choice([ 0, 0x2A, (1 << n) - 1, rnd.getrandbits(n) ]) & ((1 << n) - 1)
+                codes.append((value, n))
+            buf = bytearray()
+            (acc, nacc) = codec.packBits(codes, buf, 0, 0)
+            self.assertEqual((bytes(buf), nacc), pack_bits(codes))
+            self.assertLess(acc, 1 << nacc)
+
+    def test_fuzz(self):
+        codec = Unishox()
+        # markers, zeros and runs stress the escaping and the bit alignment
+        alphabets = [ b'\x00*+\x01', b'*A1 \n', bytes(range(128, 256)), b'Aa0 ~\t\r\n', b'zzzzzzzzzy' ]
+        for data in synthetic(seed = 2, count = 100, alphabets = alphabets):
+            self.assertEqual(decompress(codec, compress(codec, data), len(data)), data)
+
+    def test_optimal(self):
+        codec = Unishox(optimal=True)
+        greedy = Unishox()
+        alphabets = [ b'*A1 \n', b'Aa0 ~\t\r\n', b'AB CD\tab12', b'zzzzzzzzzy' ]
+        for data in corpus() + synthetic(seed = 3, alphabets = alphabets):
+            self.assertEqual(decompress(codec, compress(codec, data), len(data)), data)
+            self.assertLessEqual(len(compress(codec, data)), len(compress(greedy, data)))
+        for data in RULES:
+            self.assertLess(len(compress(codec, data)), len(compress(greedy, data)))
+        # long runs and repeats, in bounded time
+        for data in [ b'x' * 2000, b'0123456789' * 200 ]:
+            self.assertEqual(decompress(codec, compress(codec, data), len(data)), data)
+            self.assertLessEqual(len(compress(codec, data)), len(compress(greedy, data)))
+
+    def test_dictionary(self):
+        rnd = random.Random(4)
+        for codec in (Unishox(), Unishox(optimal=True)):
+            for data in RULES:
+                dictionary = b' '.join(r for r in RULES if r != data)
+                self.assertLess(len(compress(codec, data, dictionary)), len(compress(codec, data)))
+                self.assertEqual(decompress(codec, compress(codec, data, dictionary), len(data), dictionary), data)
+            # matches crossing from the dictionary into the output
+            for data in synthetic(seed = 4, count = 10, alphabets = [ b'ab <>', b'ON Var1#State==1 DO ' ]):
+                dictionary = bytes(rnd.choice(b'ab <>') for _ in range(rnd.randint(1, 200))) + data[:rnd.randint(0, 50)]
+                self.assertEqual(decompress(codec, compress(codec, data, dictionary), len(data), dictionary), data)
+
+    def test_overflow(self):
+        codec = Unishox()
+        for (data, dictionary) in [ (b'0123456789abcdef' * 8, b''), (RULES[1], RULES[0]), (b'x' * 100, b'') ]:
+            packed = compress(codec, data, dictionary)
+            for size in range(1, len(data) + 1):
+                out = bytearray(size)
+                self.assertEqual(codec.decompress(packed, len(packed), out, size, dictionary), -1)
+                self.assertEqual(len(out), size)
+                # `out` is not grown when it is smaller than `len_out`
+                if size < len(data):
+                    self.assertEqual(codec.decompress(packed, len(packed), out, len(data) + 16, dictionary), -1)
+                    self.assertEqual(len(out), size)
+
+    def test_copies(self):
+        copy = Path(base_dir, 'lib', 'default', 'Unishox-Tasmota-1.0', 'python', 'unishox.py')
+        self.assertEqual(Path(__file__).with_name('unishox.py').read_text(), copy.read_text())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Train Unishox `sets` and `cl_95` tables on a corpus
+
+The decoder logic stays the same: letters are permuted among the letter
+slots of Set1, Set1A and Set1B (so that upper case still works) and
+punctuation among the slots of Set3, Set4 and Set4A (so that it can still
+be sent in Set2). Space, digits and the special codes keep their place.
+The most frequent symbols get the shortest slots, frequencies being
+counted on the chars the dictionary matches leave to literal codes.
+
+    python3 unishox_train.py [--extra FILE ...] [--python] [--c] [--write]
+
+Tables trained on a corpus are not compatible with data compressed with
+other tables: compressed web pages must be regenerated and Rules stored
+compressed in the settings of a device can no longer be read.
+"""
+import re
+import sys
+import string
+from pathlib import Path
+from unishox import Unishox
+import unishox_bench
+
+base_dir = Path(__file__).absolute().parent.parent.parent
+LIB_DIR = Path(base_dir, 'lib', 'default', 'Unishox-Tasmota-1.0')
+
+# vcode and its length for each position of a set, see generator/generator.c
+VCODES = [0, 2, 3, 4, 10, 11, 12, 13, 14, 30, 31]
+VCODE_LENS = [2, 3, 3, 3, 4, 4, 4, 4, 4, 5, 5]
+# switch code to each set from Set1 and its length
+SET_CODES = [(0, 0), (0, 3), (6, 5), (28, 7), (29, 7), (30, 7), (31, 7)]
+
+LETTER_SETS = (Unishox.SHX_SET1, Unishox.SHX_SET1A, Unishox.SHX_SET1B)
+PUNCT_SETS = (4, 5, 6)
+
+def slot_len(h, v):
+    return SET_CODES[h][1] + VCODE_LENS[v]
+
+# (set, position) of the slots holding a letter and a punctuation in `sets`
+def slots(sets):
+    letters = [(h, v) for h in LETTER_SETS for v in range(11) if sets[h][v] in string.ascii_lowercase]
+    punct = [(h, v) for h in PUNCT_SETS for v in range(11) if sets[h][v] in string.punctuation]
+    return (letters, punct)
+
+# cl_95 of `sets`, code in the upper bits and length in the low nibble,
+# codes of 13 bits are shifted left by one (see Unishox.literalBits)
+def code_table(sets):
+    cl_95 = [0] * 95
+    for h in range(7):
+        for v in range(11):
+            c = sets[h][v]
+            if c in ('\0', ' '):
+                continue
+            (set_code, set_len) = SET_CODES[h]
+            code_len = set_len + VCODE_LENS[v]
+            code = (set_code << (16 - set_len)) + (VCODES[v] << (16 - code_len))
+            cl_95[ord(c) - 32] = (code, code_len)
+            if c in string.ascii_lowercase:
+                # 0010 switch to upper case, then the lower case code
+                cl_95[ord(c) - 64] = ((2 << 12) + (code >> 4), code_len + 4)
+    cl_95[0] = (0x4000, 3)      # space, Set1 vcode 1
+    return [(code << 1 if code_len == 13 else code) + code_len for (code, code_len) in cl_95]
+
+# symbol counts of the chars left to literal codes by the dictionary matches
+def literal_counts(items):
+    counts = {}
+    class Counter(Unishox):
+        """Unishox recording the positions covered by the dictionary"""
+        def findMatch(self, inn, len_, l_, index):
+            (longest_len, longest_dist) = super().findMatch(inn, len_, l_, index)
+            if longest_len:
+                self.covered.update(range(l_, l_ + longest_len + self.NICE_LEN))
+            return longest_len, longest_dist
+    codec = Counter()
+    for data in items:
+        codec.covered = set()
+        out = bytearray(len(data) * 2 + 16)
+        codec.compress(data, len(data), out, len(out))
+        for i, b in enumerate(data):
+            if i not in codec.covered:
+                c = chr(b).lower()
+                counts[c] = counts.get(c, 0) + 1
+    return counts
+
+# sets with the most frequent letters and punctuation in the shortest slots,
+# ties keep the order of `stock`
+def train(counts, stock = Unishox.sets):
+    sets = [list(s) for s in stock]
+    for group in slots(stock):
+        ranked = sorted(group, key = lambda hv: (slot_len(*hv), hv))
+        rank = { stock[h][v]: i for i, (h, v) in enumerate(ranked) }
+        chars = sorted(rank, key = lambda c: (-counts.get(c, 0), rank[c]))
+        for (h, v), c in zip(ranked, chars):
+            sets[h][v] = c
+    return sets
+
+def codec(sets, optimal = False):
+    return Unishox(optimal = optimal, sets = sets, cl_95 = code_table(sets))
+
+def python_char(c):
+    return {'\0': "'\\0'", '\'': "'\\''", '\\': "'\\\\'"}.get(c, f"'{c}'")
+
+def c_char(c):
+    return {'\0': "  0", '\'': "'\\''", '\\': "'\\\\'"}.get(c, f"'{c}'")
+
+def cl_95_items(cl_95):
+    return ", ".join(f"0x{cl & 0xFFF0:04X} + {cl & 0x000F:2d}" for cl in cl_95)
+
+def python_tables(sets, cl_95):
+    rows = [ "[" + ", ".join(python_char(c) for c in s) + "]" for s in sets ]
+    ostr = f"    cl_95 = [{cl_95_items(cl_95)}]\n"
+    ostr += "    sets = [" + ",\n            ".join(rows) + "]\n"
+    return ostr
+
+def c_sets(sets, indent):
+    rows = [ "{" + ", ".join(c_char(c) for c in s) + "}" for s in sets ]
+    return "{" + ("," + "\n" + " " * indent).join(rows) + "};\n"
+
+def c_tables(sets, cl_95):
+    ostr = f"static uint16_t cl_95[95] PROGMEM = {{{cl_95_items(cl_95)} }};\n"
+    ostr += "static char sets[][11] PROGMEM = \n                  " + c_sets(sets, 19)
+    return ostr
+
+# replace the tables in the Python copies, unishox.cpp and generator.c
+def write_tables(sets, cl_95):
+    python_files = [Path(base_dir, 'tools', 'unishox', 'unishox.py'), Path(LIB_DIR, 'python', 'unishox.py')]
+    (py_cl, py_sets) = python_tables(sets, cl_95).split("    sets = ")
+    for p in python_files:
+        text = p.read_text()
+        text = re.sub(r"^    cl_95 = \[.*\]\n", lambda m: py_cl, text, count = 1, flags = re.M)
+        text = re.sub(r"^    sets = \[\[.*?\]\]\n", lambda m: "    sets = " + py_sets, text, count = 1, flags = re.M | re.S)
+        p.write_text(text)
+    cpp = Path(LIB_DIR, 'src', 'unishox.cpp')
+    (c_cl, c_set) = c_tables(sets, cl_95).split("static char sets")
+    text = cpp.read_text()
+    text = re.sub(r"^static uint16_t cl_95\[95\] PROGMEM = \{.*\};\n", lambda m: c_cl, text, count = 1, flags = re.M)
+    text = re.sub(r"^static char sets\[\]\[11\] PROGMEM = .*?\}\};\n", lambda m: "static char sets" + c_set, text, count = 1, flags = re.M | re.S)
+    cpp.write_text(text)
+    gen = Path(LIB_DIR, 'generator', 'generator.c')
+    text = gen.read_text()
+    text = re.sub(r"^char us_sets\[\]\[11\] = .*?\}\};\n", lambda m: "char us_sets[][11] = \n                  " + c_sets(sets, 19), text, count = 1, flags = re.M | re.S)
+    gen.write_text(text)
+    return python_files + [cpp, gen]
+
+def compressed_size(codec, items):
+    size = 0
+    progmem = 0
+    for data in items:
+        out = bytearray(len(data) * 2 + 16)
+        n = codec.compress(data, len(data), out, len(out))
+        size += n
+        progmem += unishox_bench.html.progmem_real(n) + 8
+    return (size, progmem)
+
+def report(groups, sets, optimal = False):
+    stock = Unishox(optimal = optimal)
+    trained = codec(sets, optimal)
+    ostr = f"    {'group':<10} {'input':>7} {'stock':>7} {'trained':>8}  gain   PROGMEM stock->trained\n"
+    for g, items in groups.items():
+        (a, pa) = compressed_size(stock, items)
+        (b, pb) = compressed_size(trained, items)
+        gain = (a - b) / a * 100 if a else 0.0
+        ostr += f"    {g:<10} {sum(map(len, items)):7d} {a:7d} {b:8d} {gain:+5.1f}%   {pa}->{pb}\n"
+    return ostr
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='train Unishox code tables on the web pages and Rules')
+    parser.add_argument("--extra", nargs='*', default=[], help='more text files to train on')
+    parser.add_argument("--python", action='store_true', help='print the tables for unishox.py')
+    parser.add_argument("--c", action='store_true', help='print the tables for unishox.cpp')
+    parser.add_argument("--optimal", action='store_true', help='report the gain with the optimal parse')
+    parser.add_argument("--write", action='store_true', help='replace the tables in unishox.py, unishox.cpp and generator.c')
+    args = parser.parse_args()
+
+    corpus = unishox_bench.corpus()
+    groups = { 'html': list(corpus['html'].values()), 'rules': list(corpus['rules'].values()) }
+    if args.extra:
+        groups['extra'] = [ Path(f).read_bytes() for f in args.extra ]
+    counts = literal_counts([data for items in groups.values() for data in items])
+    sets = train(counts)
+    cl_95 = code_table(sets)
+
+    print("sets:")
+    for s in sets:
+        print("    " + " ".join(c if c not in ('\0', ' ') else '.' for c in s))
+    print(f"compressed size ({'optimal' if args.optimal else 'greedy'} parse):")
+    print(report(groups, sets, args.optimal), end="")
+    if args.python:
+        print("\n" + python_tables(sets, cl_95), end="")
+    if args.c:
+        print("\n" + c_tables(sets, cl_95), end="")
+    if args.write:
+        for p in write_tables(sets, cl_95):
+            print("wrote " + str(p.relative_to(base_dir)), file=sys.stderr)
@@ -0,0 +1,30 @@
+import unittest
+from unishox import Unishox
+from unishox_test import RULES, synthetic, compress, decompress
+from unishox_train import *
+
+class Test_unishox_train(unittest.TestCase):
+
+    def test_stock_tables(self):
+        self.assertEqual(code_table(Unishox.sets), Unishox.cl_95)
+        self.assertEqual(train({}), Unishox.sets)
+
+    def test_trained_roundtrip(self):
+        counts = literal_counts(RULES)
+        sets = train(counts)
+        self.assertNotEqual(sets, Unishox.sets)
+        self.assertEqual(sorted(sum(sets, [])), sorted(sum(Unishox.sets, [])))
+        for optimal in (False, True):
+            codec_ = codec(sets, optimal)
+            for data in RULES + synthetic(count = 5):
+                self.assertEqual(decompress(codec_, compress(codec_, data), len(data)), data)
+
+    def test_python_tables(self):
+        sets = train(literal_counts(RULES))
+        scope = {}
+        exec("class T:\n" + python_tables(sets, code_table(sets)), scope)
+        self.assertEqual(scope['T'].sets, sets)
+        self.assertEqual(scope['T'].cl_95, code_table(sets))
+
+if __name__ == '__main__':
+    unittest.main()